@@ -1,41 +1,40 @@
 # ai_utils.py
 import os
+import re
+import time
+import sqlite3
+import hashlib
 import logging  # <<<=== 修正一：在這裡也引入 logging 模組！
-import google.generativeai as genai
+import threading
 
-# 從環境變數讀取 API Key 並進行設定
-GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+from tracing import span
+from shared_state import shared_state
 
-def ask_gemini_for_news(headline, summary):
-    """
-    使用一個精心設計的 prompt 來同時完成翻譯和摘要。
-    """
-    if not GEMINI_API_KEY:
-        return "錯誤：尚未設定 Gemini API Key。"
+# 從環境變數讀取 API Key 與設定
+GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'gemini')
+NEWS_SUMMARY_DB = os.environ.get('NEWS_SUMMARY_DB', 'news_summaries.db')
+# 摘要在共用後端保留的秒數 (本機 SQLite 則一直保留)
+NEWS_SUMMARY_SHARED_TTL = float(os.environ.get('NEWS_SUMMARY_SHARED_TTL', 7 * 24 * 3600))
+# 本機摘要只保留最近幾天 (新聞指令只查過去一週的新聞)，每 NEWS_SUMMARY_PRUNE_INTERVAL 秒清一次
+NEWS_SUMMARY_RETENTION_DAYS = int(os.environ.get('NEWS_SUMMARY_RETENTION_DAYS', 14))
+NEWS_SUMMARY_PRUNE_INTERVAL = float(os.environ.get('NEWS_SUMMARY_PRUNE_INTERVAL', 3600))
 
-    generation_config = {
-      "temperature": 0.2,
-      "top_p": 1,
-      "top_k": 1,
-      "max_output_tokens": 2048,
-    }
-    
-    # <<<=== 修正二：更換為最新的 Gemini 1.5 Flash 模型！ ===>>>
-    # 這個模型既快速又強大，是目前的首選。
-    model = genai.GenerativeModel(model_name="gemini-1.5-flash-latest",
-                                  generation_config=generation_config)
+GENERATION_CONFIG = {
+  "temperature": 0.2,
+  "top_p": 1,
+  "top_k": 1,
+  "max_output_tokens": 2048,
+}
 
-    # 提示工程 (Prompt Engineering)
-    prompt = f"""
+NEWS_PROMPT_HEADER = """
     你現在是一位專業的美股新聞分析師，在為一個股市 Line Bot 提供服務。
     請根據以下提供的英文新聞標題和內容，完成兩項任務：
     1. 將標題翻譯成專業且吸引人的繁體中文。
     2. 用條列式的方式，以繁體中文總結新聞內容的 2-3 個重點。
+"""
 
-    請嚴格按照以下格式回覆，不要包含任何額外的前言或結語：
-
+NEWS_PROMPT_FORMAT = """
     【標題】
     [此處填寫翻譯後的中文標題]
 
@@ -43,16 +42,244 @@ def ask_gemini_for_news(headline, summary):
     - [此處填寫第一個重點]
     - [此處填寫第二個重點]
     - [此處填寫第三個重點，如果有的話]
+"""
+
+
+# =============================================================
+# LLM 後端 (可替換，測試與壓測時可用 StubBackend 取代 Gemini)
+# =============================================================
+class GeminiBackend:
+    """整個程式共用一個 GenerativeModel，不再每次呼叫都重新建立。"""
+
+    def __init__(self, api_key=GEMINI_API_KEY):
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        # <<<=== 修正二：更換為最新的 Gemini 1.5 Flash 模型！ ===>>>
+        # 這個模型既快速又強大，是目前的首選。
+        self.model = genai.GenerativeModel(model_name="gemini-1.5-flash-latest",
+                                           generation_config=GENERATION_CONFIG)
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt).text
+
+
+class StubBackend:
+    """不連網的假後端：依 prompt 中的新聞數量產生固定格式的回覆，可設定延遲模擬 API 耗時。"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def generate(self, prompt):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        headlines = re.findall(r'英文新聞標題: "(.*)"', prompt)
+        blocks = [f"【標題】\n{headline}\n\n【AI 摘要】\n- (stub) {headline}" for headline in headlines]
+        if len(blocks) <= 1:
+            return blocks[0] if blocks else ""
+        return "\n".join(f"===== {i} =====\n{block}" for i, block in enumerate(blocks, 1))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def set_llm_backend(backend):
+    """替換 LLM 後端，例如測試時改用 StubBackend()。"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def get_llm_backend():
+    """回傳目前的 LLM 後端；Gemini 未設定 API Key 時回傳 None。"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if LLM_BACKEND == 'stub':
+                    _backend = StubBackend()
+                elif GEMINI_API_KEY:
+                    _backend = GeminiBackend()
+    return _backend
+
+
+# =============================================================
+# 摘要快取 (存在本機 SQLite，重新啟動後仍然有效；有共用後端時其他機器摘要過的新聞也能直接使用)
+# 寫入時順便清掉超過 NEWS_SUMMARY_RETENTION_DAYS 的舊摘要，檔案不會一直變大
+# =============================================================
+class SummaryCache:
+
+    def __init__(self, path=NEWS_SUMMARY_DB, shared=None):
+        self.path = path
+        self.shared = shared
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pruned_at = None
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self.pruned = 0
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS news_summaries (
+                    cache_key TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            self._conn.execute("CREATE INDEX IF NOT EXISTS news_summaries_created_at ON news_summaries (created_at)")
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(url, headline):
+        return hashlib.sha256(f"{url or ''}\n{headline or ''}".encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT summary FROM news_summaries WHERE cache_key = ?", (key,)).fetchone()
+            if row is not None:
+                self.hits += 1
+                return row[0]
+        shared = self.shared.get(f"news:{key}") if self.shared is not None else None
+        if shared is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        summary = shared.decode('utf-8')
+        self._save(key, summary)
+        with self._lock:
+            self.shared_hits += 1
+        return summary
 
+    def _save(self, key, summary):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO news_summaries (cache_key, summary, created_at) VALUES (?, ?, ?)",
+                         (key, summary, time.time()))
+            conn.commit()
+            due = self._pruned_at is None or time.monotonic() - self._pruned_at >= NEWS_SUMMARY_PRUNE_INTERVAL
+        if due:
+            self.prune()
+
+    def prune(self, max_age_days=NEWS_SUMMARY_RETENTION_DAYS):
+        """刪除超過 max_age_days 天的摘要，回傳刪除的筆數。"""
+        cutoff = time.time() - max_age_days * 86400
+        with self._lock:
+            conn = self._connection()
+            removed = conn.execute("DELETE FROM news_summaries WHERE created_at < ?", (cutoff,)).rowcount
+            conn.commit()
+            self._pruned_at = time.monotonic()
+            self.pruned += removed
+        return removed
+
+    def set(self, key, summary):
+        self._save(key, summary)
+        if self.shared is not None:
+            self.shared.set(f"news:{key}", summary.encode('utf-8'), NEWS_SUMMARY_SHARED_TTL)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'shared_hits': self.shared_hits, 'pruned': self.pruned}
+
+
+summary_cache = SummaryCache(shared=shared_state)
+
+
+# =============================================================
+# 對外介面
+# =============================================================
+def _news_prompt(headline, summary):
+    # 提示工程 (Prompt Engineering)
+    return f"""{NEWS_PROMPT_HEADER}
+    請嚴格按照以下格式回覆，不要包含任何額外的前言或結語：
+{NEWS_PROMPT_FORMAT}
     ---
     英文新聞標題: "{headline}"
     英文新聞內容: "{summary}"
     """
 
+
+def _batch_news_prompt(articles):
+    sections = "\n".join(
+        f"    ===== {i} =====\n    英文新聞標題: \"{headline}\"\n    英文新聞內容: \"{summary}\""
+        for i, (headline, summary, _) in enumerate(articles, 1))
+    return f"""{NEWS_PROMPT_HEADER}
+    以下共有 {len(articles)} 則新聞，請逐則處理。每一則的回覆都要以「===== 編號 =====」單獨一行開頭，
+    編號與下方新聞相同，接著嚴格按照以下格式回覆，不要包含任何額外的前言或結語：
+{NEWS_PROMPT_FORMAT}
+    ---
+{sections}
+    """
+
+
+def _split_batch_response(text, count):
+    """把批次回覆依「===== 編號 =====」切開，回傳長度為 count 的列表，缺少的編號為 None。"""
+    results = [None] * count
+    parts = re.split(r'^\s*=+\s*(\d+)\s*=+\s*$', text, flags=re.MULTILINE)
+    for number, body in zip(parts[1::2], parts[2::2]):
+        index = int(number) - 1
+        if 0 <= index < count and body.strip():
+            results[index] = body.strip()
+    return results
+
+
+def ask_gemini_for_news(headline, summary, url=None):
+    """
+    使用一個精心設計的 prompt 來同時完成翻譯和摘要。
+    相同的新聞 (網址 + 標題) 只會送給 AI 一次，之後直接從摘要快取回傳。
+    """
+    backend = get_llm_backend()
+    if backend is None:
+        return "錯誤：尚未設定 Gemini API Key。"
+
+    key = SummaryCache.make_key(url, headline)
+    cached = summary_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        with span('llm.generate'):
+            result = backend.generate(_news_prompt(headline, summary))
+        summary_cache.set(key, result)
+        return result
     except Exception as e:
         # 現在 logging 模組被正確引入了，這個日誌可以正常運作
         logging.error(f"呼叫 Gemini API 時發生錯誤: {e}", exc_info=True)
-        return "呼叫 AI 時發生錯誤，請稍後再試。"
\ No newline at end of file
+        return "呼叫 AI 時發生錯誤，請稍後再試。"
+
+
+def summarize_news_batch(articles):
+    """
+    一次摘要多則新聞。articles 為 (headline, summary, url) 的列表，回傳順序相同的摘要列表。
+    已快取的新聞不會再送出；其餘新聞合併成一個 prompt，回覆缺漏的部分再逐則補呼叫。
+    """
+    backend = get_llm_backend()
+    if backend is None:
+        return ["錯誤：尚未設定 Gemini API Key。"] * len(articles)
+
+    keys = [SummaryCache.make_key(url, headline) for headline, _, url in articles]
+    results = [summary_cache.get(key) for key in keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if len(pending) > 1:
+        try:
+            with span('llm.generate', articles=len(pending)):
+                text = backend.generate(_batch_news_prompt([articles[i] for i in pending]))
+            for i, body in zip(pending, _split_batch_response(text, len(pending))):
+                if body is not None:
+                    results[i] = body
+                    summary_cache.set(keys[i], body)
+        except Exception as e:
+            logging.error(f"批次呼叫 Gemini API 時發生錯誤: {e}", exc_info=True)
+
+    for i, result in enumerate(results):
+        if result is None:
+            headline, summary, url = articles[i]
+            results[i] = ask_gemini_for_news(headline, summary, url)
+    return results
@@ -0,0 +1,297 @@
+# alerts.py
+# 價格提醒引擎：每 ALERTS_INTERVAL 秒掃描一次所有使用者設定的提醒。
+#   1. 從資料庫載入全部提醒，依代碼排序建成欄位陣列 (代碼編號、方向、門檻、是否已觸發)，
+#      同一檔股票的提醒連續排在一起，offsets 就是「代碼 -> 使用者」的索引
+#   2. 所有不重複的代碼只做一次批次報價：報價快取裡已經有的直接用，沒有的才向 Finnhub 查。
+#      查詢用自己的執行緒池與 Finnhub 的背景額度 (FINNHUB_BACKGROUND_SHARE)，不會拖慢使用者的查詢；
+#      一輪最多查 ALERTS_QUOTE_BUDGET 檔，最久沒查的先查，代碼再多也會輪流檢查到，
+#      這一輪沒有報價的代碼記在 stats() 的 unevaluated。
+#      最壞情況 (代碼都不在快取裡) 每檔股票要 ceil(代碼數 / ALERTS_QUOTE_BUDGET) × ALERTS_INTERVAL 秒才會檢查一次：
+#      預設的免費方案 (60 次/分鐘，背景佔 1/4) 一輪 15 檔，1 萬檔約要 11 小時；
+#      要在 ALERTS_MAX_STALENESS 內檢查完 ALERTS_TARGET_SYMBOLS 檔，一分鐘需要約 167 次背景額度
+#      (FINNHUB_RATE_LIMIT 約 670 次/分鐘)。設定達不到時啟動會記錄警告，stats() 的 worst_case_staleness 是目前代碼數的最壞情況
+#   3. 用 numpy 一次比較所有提醒：每檔股票的價格依代碼編號展開成每筆提醒的價格，再與門檻比較
+#   4. 同一筆提醒觸發後就標記為已觸發，要等價格回到門檻另一側 (加上 ALERTS_REARM_MARGIN 的緩衝) 才會再提醒，
+#      在門檻附近上下震盪時不會一直通知；狀態存在資料庫裡，重啟或換 worker 也不會重複通知。
+#      標記是有條件的 (只改還沒觸發的列)，只通知真的由這一輪標記成功的提醒，租約過期、兩個行程同時掃描也不會重複通知
+#   5. 同一位使用者的多則提醒合併成一則訊息；內容完全相同的訊息用 multicast 一次送給最多 500 人，
+#      只有一人時用 push_message，每次呼叫 LINE API 前先向 token bucket 取得額度 (ALERTS_PUSH_RATE 次/秒)
+# 多個 worker / 多台機器時，每一輪只有搶到共用後端租約的行程會執行。
+# 這個模組會載入 numpy，main 只在背景執行緒中引入它，不影響冷啟動。
+import os
+import math
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from finnhub_client import TokenBucket, finnhub
+from quote_cache import quote_cache
+from quotes import Quote, get_quotes
+from tracing import span
+
+ALERTS_INTERVAL = float(os.environ.get('ALERTS_INTERVAL', 60))
+# 每秒最多呼叫幾次 LINE push / multicast API (LINE 的上限是 multicast 200 次/秒)
+ALERTS_PUSH_RATE = float(os.environ.get('ALERTS_PUSH_RATE', 100))
+# 一輪批次報價最多等幾秒
+ALERTS_QUOTE_DEADLINE = float(os.environ.get('ALERTS_QUOTE_DEADLINE', 30))
+# 查報價用的執行緒數 (與使用者查詢的執行緒池分開)
+ALERTS_QUOTE_WORKERS = int(os.environ.get('ALERTS_QUOTE_WORKERS', 2))
+# 一輪最多向 Finnhub 查幾檔快取裡沒有的股票；0 表示依背景額度計算 (每秒額度 × 掃描間隔)
+ALERTS_QUOTE_BUDGET = int(os.environ.get('ALERTS_QUOTE_BUDGET', 0))
+# 設計目標：這麼多檔股票時，每檔最久 ALERTS_MAX_STALENESS 秒要檢查一次
+ALERTS_TARGET_SYMBOLS = int(os.environ.get('ALERTS_TARGET_SYMBOLS', 10000))
+ALERTS_MAX_STALENESS = float(os.environ.get('ALERTS_MAX_STALENESS', 3600))
+# 觸發後價格要離開門檻多少比例才重新啟用 (0.01 = 1%)
+ALERTS_REARM_MARGIN = float(os.environ.get('ALERTS_REARM_MARGIN', 0.01))
+
+# LINE multicast 一次最多 500 位收件人
+MULTICAST_LIMIT = 500
+
+DIRECTIONS = ('above', 'below', 'move')
+ABOVE, BELOW, MOVE = range(len(DIRECTIONS))
+_DIRECTION_CODES = {name: code for code, name in enumerate(DIRECTIONS)}
+
+
+def format_alert(symbol, direction, threshold, price, pct):
+    if direction == ABOVE:
+        return f"🔔 {symbol} 漲破 ${threshold:,.2f}，目前 ${price:,.2f} ({pct:+.2f}%)"
+    if direction == BELOW:
+        return f"🔔 {symbol} 跌破 ${threshold:,.2f}，目前 ${price:,.2f} ({pct:+.2f}%)"
+    return f"🔔 {symbol} 今日漲跌 {pct:+.2f}%，超過 ±{threshold:g}%，目前 ${price:,.2f}"
+
+
+class AlertIndex:
+    """
+    所有提醒的欄位式索引。rows 為 [(id, 使用者, 代碼, 方向, 門檻, 是否已觸發)]，
+    建好後依代碼排序：symbols[k] 的提醒位於 offsets[k]:offsets[k + 1]。
+    """
+
+    def __init__(self, rows):
+        rows = list(rows)
+        if rows:
+            ids, users, symbols, directions, thresholds, triggered = zip(*rows)
+        else:
+            ids = users = symbols = directions = thresholds = triggered = ()
+        self.symbols, symbol_idx = np.unique(np.array(symbols, dtype=object), return_inverse=True)
+        order = np.argsort(symbol_idx, kind='stable')
+        self.symbol_idx = symbol_idx.reshape(-1)[order].astype(np.int32)
+        self.offsets = np.searchsorted(self.symbol_idx, np.arange(len(self.symbols) + 1))
+        self.ids = np.array(ids, dtype=np.int64)[order]
+        self.users = np.array(users, dtype=object)[order]
+        self.direction = np.array([_DIRECTION_CODES[d] for d in directions], dtype=np.int8)[order]
+        self.threshold = np.array(thresholds, dtype=np.float64)[order]
+        self.triggered = np.array(triggered, dtype=bool)[order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def users_for(self, symbol):
+        """某檔股票有設定提醒的使用者 (可能重複，每筆提醒一個)。"""
+        k = np.searchsorted(self.symbols, symbol)
+        if k == len(self.symbols) or self.symbols[k] != symbol:
+            return []
+        return list(self.users[self.offsets[k]:self.offsets[k + 1]])
+
+    def evaluate(self, prices, pcts, margin=ALERTS_REARM_MARGIN):
+        """
+        prices / pcts 為與 symbols 對齊的價格與漲跌幅 (查不到的代碼為 NaN)。
+        回傳 (fire, rearm) 兩個布林遮罩：fire 是這一輪新觸發的提醒，rearm 是條件已解除、可以重新啟用的提醒。
+        """
+        price = prices[self.symbol_idx]
+        move = np.abs(pcts[self.symbol_idx])
+        valid = ~np.isnan(price)
+        is_above, is_below = self.direction == ABOVE, self.direction == BELOW
+        with np.errstate(invalid='ignore'):
+            hit = np.where(is_above, price >= self.threshold,
+                           np.where(is_below, price <= self.threshold, move >= self.threshold))
+            clear = np.where(is_above, price < self.threshold * (1 - margin),
+                             np.where(is_below, price > self.threshold * (1 + margin),
+                                      move < self.threshold * (1 - margin)))
+        fire = valid & hit & ~self.triggered
+        rearm = valid & clear & self.triggered
+        return fire, rearm
+
+    def notifications(self, fire, prices, pcts):
+        """把觸發的提醒依使用者合併成 {使用者: 訊息文字}。"""
+        lines = {}
+        for i in np.flatnonzero(fire):
+            k = self.symbol_idx[i]
+            text = format_alert(self.symbols[k], self.direction[i], self.threshold[i], prices[k], pcts[k])
+            lines.setdefault(self.users[i], []).append(text)
+        return {user: '\n'.join(texts) for user, texts in lines.items()}
+
+
+def batch_notifications(notifications, limit=MULTICAST_LIMIT):
+    """把 {使用者: 文字} 依文字分組，回傳 [(收件人清單, 文字)]，每組最多 limit 人。"""
+    groups = {}
+    for user, text in notifications.items():
+        groups.setdefault(text, []).append(user)
+    return [(users[start:start + limit], text)
+            for text, users in groups.items() for start in range(0, len(users), limit)]
+
+
+class AlertEngine:
+    """
+    load_rows() 回傳所有提醒；claim(ids) 把還沒觸發的提醒標記為已觸發並回傳真的標記成功的 id，
+    rearm(ids) 把已觸發的提醒重新啟用；
+    push(user_id, text) 與 multicast(user_ids, text) 負責實際送出 LINE 訊息。
+    fetch_quotes(symbols, deadline) 向上游查報價 (預設走背景額度)，cached_quote(symbol) 只查快取。
+    """
+
+    def __init__(self, load_rows, claim, rearm, push, multicast, fetch_quotes=None, cached_quote=quote_cache.get,
+                 quote_budget=ALERTS_QUOTE_BUDGET, interval=ALERTS_INTERVAL, push_rate=ALERTS_PUSH_RATE, shared=None):
+        self.load_rows = load_rows
+        self.claim = claim
+        self.rearm = rearm
+        self.push = push
+        self.multicast = multicast
+        self.fetch_quotes = fetch_quotes or self._fetch_background_quotes
+        self.cached_quote = cached_quote
+        self.quote_budget = quote_budget or max(1, int(finnhub.background_limiter.rate * interval))
+        self.interval = interval
+        self._executor = None
+        self._attempted = {}   # symbol -> 上次向上游查詢的 time.monotonic()
+        self.bucket = TokenBucket(push_rate, max(1, push_rate))
+        self.shared = shared
+        self._worker = None
+        self._lock = threading.Lock()
+        self.ticks = 0
+        self.alerts = 0
+        self.symbols = 0
+        self.fired = 0
+        self.api_calls = 0
+        self.send_failures = 0
+        self.last_tick_seconds = None
+        self.unevaluated = []
+
+    def worst_case_staleness(self, symbols):
+        """代碼都不在快取裡時，symbols 檔股票中每一檔最久隔多少秒才會查到一次報價。"""
+        return math.ceil(symbols / self.quote_budget) * self.interval
+
+    def _fetch_background_quotes(self, symbols, deadline):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=ALERTS_QUOTE_WORKERS, thread_name_prefix='alert-quote')
+        return get_quotes(symbols, deadline=deadline, executor=self._executor, background=True)
+
+    def _price_arrays(self, symbols):
+        now = time.monotonic()
+        attempted, self._attempted = self._attempted, {}
+        quotes = {}
+        missing = []
+        for symbol in symbols:
+            quote = self.cached_quote(symbol)
+            if isinstance(quote, Quote):
+                quotes[symbol] = quote
+                self._attempted[symbol] = now
+            else:
+                missing.append(symbol)
+                self._attempted[symbol] = attempted.get(symbol, 0.0)
+        # 最久沒檢查 (或從沒查過) 的先查，額度不夠時下一輪接著查其他代碼
+        batch = sorted(missing, key=self._attempted.get)[:self.quote_budget]
+        if batch:
+            self._attempted.update((symbol, now) for symbol in batch)
+            quotes.update(self.fetch_quotes(batch, deadline=ALERTS_QUOTE_DEADLINE))
+        prices = np.full(len(symbols), np.nan)
+        pcts = np.full(len(symbols), np.nan)
+        for k, symbol in enumerate(symbols):
+            quote = quotes.get(symbol)
+            if isinstance(quote, Quote):
+                prices[k], pcts[k] = quote.price, quote.pct
+        return prices, pcts
+
+    def _send(self, batches):
+        sent = failed = 0
+        for users, text in batches:
+            self.bucket.acquire()
+            try:
+                if len(users) == 1:
+                    self.push(users[0], text)
+                else:
+                    self.multicast(users, text)
+                sent += 1
+            except Exception as e:
+                failed += 1
+                logging.error(f"送出價格提醒時發生錯誤 ({len(users)} 位使用者): {e}", exc_info=True)
+        return sent, failed
+
+    def tick(self):
+        """執行一輪掃描，回傳這一輪觸發的提醒數量。"""
+        started = time.perf_counter()
+        with span('alerts.load'):
+            index = AlertIndex(self.load_rows())
+        fired = 0
+        if len(index):
+            with span('alerts.quotes', symbols=len(index.symbols)):
+                prices, pcts = self._price_arrays(index.symbols)
+            unevaluated = list(index.symbols[np.isnan(prices)])
+            if unevaluated:
+                logging.warning(f"價格提醒：這一輪有 {len(unevaluated)} 檔股票沒有報價 (額度不足或查詢失敗)，"
+                                f"例如 {', '.join(unevaluated[:10])}；之後幾輪會輪流補查")
+            with span('alerts.evaluate'):
+                fire, rearm = index.evaluate(prices, pcts)
+            # 先寫回狀態再送出：送出失敗頂多漏一次通知，不會因為重試而重複通知。
+            # 只通知這一輪真的標記成功的提醒，其他行程已經標記過的就跳過
+            with span('alerts.mark'):
+                claimed = self.claim([int(i) for i in index.ids[fire]])
+                self.rearm([int(i) for i in index.ids[rearm]])
+            fire &= np.isin(index.ids, np.array(claimed, dtype=np.int64))
+            notifications = index.notifications(fire, prices, pcts)
+            fired = int(fire.sum())
+            with span('alerts.send', users=len(notifications)):
+                sent, failed = self._send(batch_notifications(notifications))
+        else:
+            sent = failed = 0
+            unevaluated = []
+        with self._lock:
+            self.ticks += 1
+            self.alerts = len(index)
+            self.symbols = len(index.symbols)
+            self.fired += fired
+            self.api_calls += sent
+            self.send_failures += failed
+            self.last_tick_seconds = round(time.perf_counter() - started, 3)
+            self.unevaluated = unevaluated
+        return fired
+
+    def _acquire_lease(self):
+        """多個 worker 共用後端時，每個週期只讓一個行程執行。"""
+        if self.shared is None:
+            return True
+        return self.shared.add('alerts:lease', str(os.getpid()).encode(), self.interval * 0.9)
+
+    def start(self):
+        if self._worker is not None:
+            return
+
+        staleness = self.worst_case_staleness(ALERTS_TARGET_SYMBOLS)
+        if staleness > ALERTS_MAX_STALENESS:
+            logging.warning(f"價格提醒：一輪最多查 {self.quote_budget} 檔、每 {self.interval:g} 秒一輪，"
+                            f"{ALERTS_TARGET_SYMBOLS} 檔股票時每檔最久 {staleness / 3600:.1f} 小時才檢查一次，"
+                            f"超過 ALERTS_MAX_STALENESS ({ALERTS_MAX_STALENESS:g} 秒)；"
+                            f"請提高 FINNHUB_RATE_LIMIT / FINNHUB_BACKGROUND_SHARE 或 ALERTS_QUOTE_BUDGET")
+
+        def loop():
+            while True:
+                try:
+                    if self._acquire_lease():
+                        self.tick()
+                except Exception as e:
+                    logging.error(f"價格提醒掃描時發生錯誤: {e}", exc_info=True)
+                time.sleep(self.interval)
+
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=loop, name='alerts', daemon=True)
+                self._worker.start()
+
+    def stats(self):
+        with self._lock:
+            return {'ticks': self.ticks, 'alerts': self.alerts, 'symbols': self.symbols, 'fired': self.fired,
+                    'api_calls': self.api_calls, 'send_failures': self.send_failures,
+                    'last_tick_seconds': self.last_tick_seconds, 'unevaluated': len(self.unevaluated),
+                    'unevaluated_sample': self.unevaluated[:20],
+                    'worst_case_staleness': self.worst_case_staleness(self.symbols)}
+
@@ -0,0 +1,44 @@
+# 價格提醒的規模測試：python -m bench.bench_alerts  (10 萬位使用者、1 萬檔股票，不連網)
+import time
+
+from alerts import AlertEngine, AlertIndex
+from tests.fixtures import SyntheticMarket
+
+
+def main(users=100000, symbols=10000, alerts_per_user=3, seed=7):
+    market = SyntheticMarket(users, symbols, alerts_per_user, seed)
+    engine = market.engine()
+    index = AlertIndex(market.load_rows())
+    prices, pcts = engine._price_arrays(index.symbols)
+
+    start = time.perf_counter()
+    index = AlertIndex(market.load_rows())
+    build_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(20):
+        index.evaluate(prices, pcts)
+    evaluate_time = (time.perf_counter() - start) / 20
+
+    start = time.perf_counter()
+    first = engine.tick()
+    first_time = time.perf_counter() - start
+    start = time.perf_counter()
+    second = engine.tick()
+    second_time = time.perf_counter() - start
+    market.moves[:] = 0
+    engine.tick()
+    rearmed = sum(1 for triggered in market.state.values() if not triggered)
+
+    calls = market.calls
+    print(f"{users} 位使用者、{symbols} 檔股票、{len(market.rows)} 筆提醒：")
+    print(f"  建立索引 {build_time * 1000:.0f} ms，向量化比較 {evaluate_time * 1000:.1f} ms")
+    print(f"  第一輪 {first_time:.2f} 秒：觸發 {first} 筆，"
+          f"{calls['push']} 次 push + {calls['multicast']} 次 multicast 送給 {calls['recipients']} 人")
+    print(f"  第二輪 (價格不變) {second_time:.2f} 秒：觸發 {second} 筆；價格回穩後重新啟用 {rearmed} 筆")
+    default = AlertEngine(market.load_rows, market.claim, market.rearm, market.push, market.multicast)
+    print(f"  目前的 Finnhub 額度一輪查 {default.quote_budget} 檔，都不在快取時每檔最久 "
+          f"{default.worst_case_staleness(len(index.symbols)) / 3600:.1f} 小時檢查一次")
+
+
+if __name__ == "__main__":
+    main()
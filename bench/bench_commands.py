@@ -0,0 +1,57 @@
+# 指令路由的基準測試：python -m bench.bench_commands
+# 和舊版 handle_message 的 if/elif 串接比較每則訊息的路由時間，以及快速回覆按鈕重建與重用的差距。
+import timeit
+
+from commands import route_message
+
+MESSAGES = ['使用說明', 'help', '我的最愛', 'hot stocks', '熱門成交量', 'gainers', 'NVDA profile', 'TSLA news',
+            'Bank of America chart', 'add MSFT', 'NVDA', '輝達', 'News Corp', 'newsmax', 'alert NVDA > 150',
+            '我的提醒', '  AAPL  ']
+
+
+def _legacy_route(user_message_original):
+    """舊版 handle_message 的 if/elif 判斷，只用來比較速度。"""
+    user_message = user_message_original.lower()
+    if user_message in ['使用說明', 'help', '查詢股價', 'stock', 'query']:
+        return 'help'
+    elif user_message in ['我的最愛', 'favorite', 'favorites']:
+        return 'favorites'
+    elif user_message in ['熱門股', 'hot stocks', 'hot']:
+        return 'hot'
+    elif user_message in ['熱門成交量', 'volume']:
+        return 'volume'
+    elif user_message in ['漲幅排名', 'gainers']:
+        return 'gainers'
+    elif 'profile' in user_message:
+        return 'profile'
+    elif 'news' in user_message:
+        return 'news'
+    elif 'add ' in user_message:
+        return 'add'
+    elif 'chart' in user_message:
+        return 'chart'
+    return 'quote'
+
+
+def main(rounds=20000):
+    legacy_time = min(timeit.repeat(lambda: [_legacy_route(m) for m in MESSAGES], number=rounds // 10, repeat=5))
+    current_time = min(timeit.repeat(lambda: [route_message(m) for m in MESSAGES], number=rounds // 10, repeat=5))
+    total = len(MESSAGES) * (rounds // 10)
+    print(f"{total} 則訊息：")
+    print(f"  舊版 if/elif 串接: {legacy_time / total * 1e6:.2f} µs/則")
+    print(f"  路由表: {current_time / total * 1e6:.2f} µs/則")
+
+    try:
+        from linebot.models import QuickReply, QuickReplyButton, MessageAction
+    except ImportError:
+        return
+    labels = [("漲幅排名 🚀", "漲幅排名"), ("熱門成交量 📈", "熱門成交量"), ("我的最愛 ❤️", "我的最愛"), ("使用說明 📝", "使用說明")]
+    build = lambda: QuickReply(items=[QuickReplyButton(action=MessageAction(label=label, text=text)) for label, text in labels])
+    prebuilt = build()
+    rebuild_time = min(timeit.repeat(build, number=rounds, repeat=5))
+    reuse_time = min(timeit.repeat(lambda: prebuilt, number=rounds, repeat=5))
+    print(f"快速回覆按鈕：每則重建 {rebuild_time / rounds * 1e6:.2f} µs，預先建好 {reuse_time / rounds * 1e6:.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+# 日線儲存區的基準測試：python -m bench.bench_history_store  (不連網，用假的日線資料)
+import shutil
+import tempfile
+import time
+
+from history_store import HistoryStore
+from tests.fixtures import synthetic_download
+
+
+def main(symbols=200, rounds=20):
+    directory = tempfile.mkdtemp(prefix='history-')
+    try:
+        store = HistoryStore(directory, fetch=synthetic_download(), refresh_interval=3600)
+        names = [f"S{k:04d}" for k in range(symbols)]
+        start = time.perf_counter()
+        for name in names:
+            store.refresh(name)
+        backfill_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for name in names:
+                for period in ('1mo', '3mo', '1y'):
+                    store.window(name, period).series()
+        window_time = (time.perf_counter() - start) / (rounds * symbols * 3)
+        print(f"{symbols} 檔股票：首次寫入 {backfill_time / symbols * 1000:.2f} ms/檔，"
+              f"讀取區間 {window_time * 1e6:.1f} µs/次 (不需下載)")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
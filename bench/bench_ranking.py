@@ -0,0 +1,21 @@
+# 排行計算的微基準測試：python -m bench.bench_ranking
+# 用假的 Yahoo 漲幅榜資料，比較舊版 rank.py (兩次遮罩 + iterrows) 與 ranking 模組的速度。
+import timeit
+
+from ranking import rank_movers, render_gainers
+from tests.fixtures import synthetic_movers, legacy_gainers
+
+
+def main(rows=5000, top_n=500, repeat=20):
+    df = synthetic_movers(rows)
+    legacy_time = min(timeit.repeat(lambda: legacy_gainers(df, top_n), number=1, repeat=repeat))
+    current_time = min(timeit.repeat(
+        lambda: render_gainers(rank_movers(df, top_n=top_n, min_price=2, min_volume=500000)), number=1, repeat=repeat))
+    print(f"{rows} 筆資料，取前 {top_n} 名：")
+    print(f"  舊版 (兩次遮罩 + iterrows): {legacy_time * 1000:.2f} ms")
+    print(f"  新版 (單一遮罩 + 欄位走訪): {current_time * 1000:.2f} ms")
+    print(f"  加速 {legacy_time / current_time:.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
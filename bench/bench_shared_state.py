@@ -0,0 +1,32 @@
+# 共用後端的基準測試：python -m bench.bench_shared_state
+# 量測 SQLite 後端與 Redis 協定 (以 LocalKVServer 代替) 每次寫入 / 讀取 2 KB 值的時間。
+import os
+import time
+import tempfile
+
+from shared_state import SQLiteBackend, RedisBackend, LocalKVServer
+
+
+def main(operations=5000):
+    path = os.path.join(tempfile.mkdtemp(prefix='shared-state-'), 'state.db')
+    backends = {'sqlite': SQLiteBackend(path)}
+    try:
+        backends['redis (LocalKVServer)'] = RedisBackend(LocalKVServer().start().url)
+    except ImportError:
+        print("未安裝 redis 套件，略過 Redis 後端")
+
+    value = os.urandom(2048)
+    for name, backend in backends.items():
+        start = time.perf_counter()
+        for i in range(operations):
+            backend.set(f"key:{i % 200}", value, 60)
+        write_time = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(operations):
+            backend.get(f"key:{i % 200}")
+        read_time = time.perf_counter() - start
+        print(f"{name}: 寫入 {write_time / operations * 1e6:.0f} µs/次，讀取 {read_time / operations * 1e6:.0f} µs/次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# 代碼解析的基準測試：python -m bench.bench_stock_lookup
+# 隨機混合代碼、名稱、別名、名稱前半段與少打一個字的查詢，量測每次解析的平均時間。
+import random
+import time
+
+from stock_lookup import resolver
+
+
+def main(lookups=10000):
+    rng = random.Random(0)
+    listings = list(resolver.listings.values())
+    queries = []
+    for _ in range(lookups):
+        listing = rng.choice(listings)
+        kind = rng.random()
+        if kind < 0.4:
+            queries.append(listing.symbol.lower())
+        elif kind < 0.7:
+            queries.append(rng.choice([listing.name, *listing.aliases]))
+        elif kind < 0.85:
+            queries.append(listing.name[:max(3, len(listing.name) // 2)])
+        else:
+            name = listing.name
+            i = rng.randrange(len(name))
+            queries.append(name[:i] + name[i + 1:])  # 少打一個字
+
+    start = time.perf_counter()
+    resolved = sum(1 for query in queries if resolver.resolve(query).symbol)
+    elapsed = time.perf_counter() - start
+    print(f"{len(listings)} 檔股票，{lookups} 次查詢：")
+    print(f"  總耗時 {elapsed * 1000:.1f} ms，平均每次 {elapsed / lookups * 1e6:.1f} µs")
+    print(f"  成功解析 {resolved} 次 ({resolved / lookups:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# 追蹤的額外負擔量測：python -m bench.bench_tracing
+import time
+import logging
+
+from tracing import trace, span
+
+
+def main(rounds=100000):
+    logging.disable(logging.CRITICAL)
+
+    def bare():
+        pass
+
+    def traced():
+        with span('benchmark'):
+            pass
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        bare()
+    bare_time = time.perf_counter() - start
+
+    with trace('benchmark.trace') as current:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            traced()
+        traced_time = time.perf_counter() - start
+        current.spans.clear()
+    print(f"{rounds} 個 span：每個 span 額外耗時 {(traced_time - bare_time) / rounds * 1e6:.2f} µs")
+
+    start = time.perf_counter()
+    for _ in range(rounds // 10):
+        with trace('benchmark.trace'):
+            for _ in range(8):
+                traced()
+    elapsed = time.perf_counter() - start
+    print(f"每個事件 (1 個 trace + 8 個 span，不含日誌輸出) 額外耗時 {elapsed / (rounds // 10) * 1e6:.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
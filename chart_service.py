@@ -0,0 +1,178 @@
+# chart_service.py
+# 股價走勢圖服務：同一檔股票、同一區間、同一個交易日只畫一次，
+# 之後直接回傳已經畫好的 PNG (檔案由 chart_store 管理)。繪圖在獨立的行程池中執行，
+# 每個行程啟動時就先把 figure / axes / line 建好，之後只更新資料再存檔。
+# 歷史價格來自 history_store：已存的 K 棒不再重新下載，只補上最後一次更新之後的部分。
+import os
+import logging
+import datetime
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as RenderTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from quote_cache import TTLCache
+from shared_state import shared_state
+from chart_store import chart_store
+from tracing import span
+
+CHART_RENDER_PROCESSES = int(os.environ.get('CHART_RENDER_PROCESSES', 1))
+CHART_RENDER_TIMEOUT = float(os.environ.get('CHART_RENDER_TIMEOUT', 30))
+CHART_CACHE_TTL = float(os.environ.get('CHART_CACHE_TTL', 3600))
+CHART_MAX_AGE = int(os.environ.get('CHART_MAX_AGE', 3600))
+
+PERIOD_LABELS = {'1mo': '30-Day', '3mo': '3-Month', '6mo': '6-Month', '1y': '1-Year'}
+
+# (symbol, period, trading_day) -> 檔名；None 代表當天查無資料
+chart_cache = TTLCache(ttl=CHART_CACHE_TTL, maxsize=256, shared=shared_state, namespace='chart')
+
+
+def trading_day():
+    """以美東時間計算的交易日，圖表快取以這個日期為單位失效。"""
+    try:
+        from zoneinfo import ZoneInfo
+        now = datetime.datetime.now(ZoneInfo('America/New_York'))
+    except Exception:
+        now = datetime.datetime.utcnow() - datetime.timedelta(hours=5)
+    return now.date().isoformat()
+
+
+# =============================================================
+# 繪圖 (在子行程中執行)
+# =============================================================
+_figure = None
+_axes = None
+_line = None
+
+
+def _init_renderer():
+    """建立一組可重複使用的 figure，只在每個繪圖行程啟動時執行一次。"""
+    global _figure, _axes, _line
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    plt.style.use('dark_background')
+    fig, ax = plt.subplots(figsize=(12, 8))
+    line, = ax.plot([], [], color='lime', linewidth=2)
+    ax.xaxis_date()
+    ax.set_ylabel('Price (USD)', fontsize=14, color='white')
+    ax.tick_params(axis='x', colors='white', rotation=30)
+    ax.tick_params(axis='y', colors='white')
+    ax.grid(True, linestyle='--', alpha=0.5)
+    # 固定邊界取代每次都要重新量測文字的 tight_layout
+    fig.subplots_adjust(left=0.08, right=0.97, top=0.92, bottom=0.12)
+    _figure, _axes, _line = fig, ax, line
+
+
+def _render_png(symbol, period, dates, closes, filepath):
+    from matplotlib.dates import date2num
+
+    if _figure is None:
+        _init_renderer()
+    _line.set_data(date2num(dates), closes)
+    _axes.relim()
+    _axes.autoscale_view()
+    _axes.set_title(f'{symbol} - {PERIOD_LABELS.get(period, period)} Price Chart', fontsize=20, color='white')
+    _figure.savefig(filepath, format='png', facecolor='#1E1E1E')
+
+
+# =============================================================
+# 行程池
+# =============================================================
+_render_pool = None
+_render_pool_lock = threading.Lock()
+_inline_render_lock = threading.Lock()
+
+
+def _get_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            # 用 spawn 而不是 fork：web 行程裡已經有其他執行緒，fork 可能複製到被鎖住的狀態
+            _render_pool = ProcessPoolExecutor(max_workers=CHART_RENDER_PROCESSES,
+                                               mp_context=multiprocessing.get_context('spawn'),
+                                               initializer=_init_renderer)
+        return _render_pool
+
+
+def _reset_render_pool():
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False, cancel_futures=True)
+        _render_pool = None
+
+
+def _discard(filepath):
+    try:
+        os.remove(filepath)
+    except FileNotFoundError:
+        pass
+
+
+def _render(symbol, period, dates, closes, filepath):
+    if CHART_RENDER_PROCESSES > 0:
+        try:
+            future = _get_render_pool().submit(_render_png, symbol, period, dates, closes, filepath)
+            future.result(timeout=CHART_RENDER_TIMEOUT)
+            return
+        except RenderTimeoutError:
+            # 繪圖行程可能還在畫，等它畫完寫出檔案後再刪掉，不留下沒人收的暫存檔
+            if not future.cancel():
+                future.add_done_callback(lambda _: _discard(filepath))
+            raise
+        except BrokenProcessPool:
+            logging.warning("繪圖行程池已損毀，重新建立並改在目前行程繪圖")
+            _reset_render_pool()
+    with _inline_render_lock:
+        _render_png(symbol, period, dates, closes, filepath)
+
+
+# =============================================================
+# 對外介面
+# =============================================================
+def _fetch_history(symbol, period):
+    """回傳 (日期陣列, 收盤價陣列)；查無資料時回傳 None。"""
+    # history_store 會載入 numpy (下載時才載入 yfinance)，放在函式內引入，不拖慢啟動
+    from history_store import history_store
+
+    window = history_store.window(symbol, period)
+    if window is None:
+        return None
+    dates, closes = window.series('close')
+    return (dates, closes) if len(dates) else None
+
+
+def _build_chart(key):
+    symbol, period, _ = key
+    with span('chart.history'):
+        history = _fetch_history(symbol, period)
+    if history is None:
+        return None
+    dates, closes = history
+    temp_path = chart_store.new_temp_path()
+    try:
+        with span('chart.render'):
+            _render(symbol, period, dates, closes, temp_path)
+        return chart_store.put_file(temp_path)
+    finally:
+        _discard(temp_path)
+
+
+def render_chart(symbol, period='1mo'):
+    """
+    回傳畫好的圖表檔名 (位於 chart_store.directory)，失敗或查無資料時回傳 None。
+    同一個 (symbol, period, 交易日) 只會畫一次，同時間的重複請求會共用同一次繪圖。
+    """
+    key = (symbol.upper(), period, trading_day())
+    try:
+        filename = chart_cache.get_or_load(key, _build_chart)
+        if filename and not chart_store.ensure_local(filename):
+            # 圖檔已被儲存區清掉，重新畫一次
+            chart_cache.invalidate(key)
+            filename = chart_cache.get_or_load(key, _build_chart)
+        return filename
+    except Exception as e:
+        logging.error(f"圖表生成失敗 for symbol {symbol}: {e}", exc_info=True)
+        return None
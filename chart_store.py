@@ -0,0 +1,178 @@
+# chart_store.py
+# 圖表檔案儲存區：有容量與存活時間上限的本機目錄。
+# 檔名是圖檔內容的雜湊值，內容相同的圖只會存一份；
+# 背景清理執行緒定期刪掉過期的檔案，超過容量時從最久沒被讀取的開始刪。
+# 有設定共用後端時，新的圖檔內容也會寫一份到共用後端，其他 worker / 機器收到 /charts 請求時再取回本機。
+import os
+import uuid
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from shared_state import shared_state
+
+CHART_DIR = os.environ.get('CHART_DIR', 'tmp_charts')
+CHART_STORE_MAX_BYTES = int(os.environ.get('CHART_STORE_MAX_BYTES', 200 * 1024 * 1024))
+CHART_STORE_MAX_AGE = float(os.environ.get('CHART_STORE_MAX_AGE', 2 * 24 * 3600))
+CHART_SWEEP_INTERVAL = float(os.environ.get('CHART_SWEEP_INTERVAL', 300))
+
+# 寫到一半的暫存檔超過這個秒數仍未被收進來，就視為殘留檔案刪除
+_TEMP_FILE_GRACE = 600
+
+
+class ChartStore:
+
+    def __init__(self, directory=CHART_DIR, max_bytes=CHART_STORE_MAX_BYTES,
+                 max_age=CHART_STORE_MAX_AGE, sweep_interval=CHART_SWEEP_INTERVAL, shared=None):
+        self.directory = directory
+        self.shared = shared
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.sweep_interval = sweep_interval
+        self._index = OrderedDict()  # filename -> [size, created_at, last_access]，依最後讀取時間排序
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.bytes_stored = 0
+        self.writes = 0
+        self.deduplicated = 0
+        self.evictions = 0
+        self.shared_fetches = 0
+        self._load_index()
+
+    def _load_index(self):
+        """啟動時掃描既有檔案，以檔案修改時間當作建立與最後讀取時間。"""
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith('.png'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for mtime, name, size in sorted(entries):
+            self._index[name] = [size, mtime, mtime]
+            self.bytes_stored += size
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def new_temp_path(self):
+        """給繪圖程式寫入用的暫存路徑，寫完後交給 put_file()。"""
+        os.makedirs(self.directory, exist_ok=True)
+        return self.path(f".{uuid.uuid4().hex}.tmp")
+
+    def put_file(self, temp_path, share=True):
+        """把暫存檔收進儲存區，回傳以內容雜湊命名的檔名；share=True 時新圖檔也寫進共用後端。"""
+        # 圖檔只有幾十 KB，直接整個讀進來算雜湊，也方便上傳到共用後端
+        with open(temp_path, 'rb') as f:
+            data = f.read()
+        filename = f"{hashlib.sha256(data).hexdigest()[:32]}.png"
+        now = time.time()
+        with self._lock:
+            is_new = not (filename in self._index and os.path.exists(self.path(filename)))
+            if not is_new:
+                os.remove(temp_path)
+                self._index[filename][2] = now
+                self._index.move_to_end(filename)
+                self.deduplicated += 1
+            else:
+                os.replace(temp_path, self.path(filename))
+                self._index[filename] = [len(data), now, now]
+                self.bytes_stored += len(data)
+                self.writes += 1
+            over_budget = self.bytes_stored > self.max_bytes
+        if is_new and share and self.shared is not None:
+            self.shared.set(f"chart:{filename}", data, self.max_age)
+        self._ensure_sweeper()
+        if over_budget:
+            self.sweep()
+        return filename
+
+    def touch(self, filename):
+        """記錄一次讀取，讓 LRU 淘汰時排到後面。"""
+        with self._lock:
+            entry = self._index.get(filename)
+            if entry is not None:
+                entry[2] = time.time()
+                self._index.move_to_end(filename)
+
+    def contains(self, filename):
+        with self._lock:
+            return filename in self._index and os.path.exists(self.path(filename))
+
+    def ensure_local(self, filename):
+        """確認圖檔在本機；不在時從共用後端取回 (其他 worker 畫的圖)。都沒有時回傳 False。"""
+        if self.contains(filename):
+            return True
+        if self.shared is None:
+            return False
+        data = self.shared.get(f"chart:{filename}")
+        if data is None:
+            return False
+        temp_path = self.new_temp_path()
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            self.shared_fetches += 1
+        # 檔名就是內容雜湊，put_file 會得到同一個檔名
+        return self.put_file(temp_path, share=False) == filename
+
+    def _remove_locked(self, filename):
+        size = self._index.pop(filename)[0]
+        self.bytes_stored -= size
+        self.evictions += 1
+        try:
+            os.remove(self.path(filename))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self):
+        """刪除過期檔案，再依 LRU 順序刪到總容量回到上限以內。"""
+        now = time.time()
+        with self._lock:
+            expired = [name for name, (_, created_at, _) in self._index.items()
+                       if now - created_at > self.max_age]
+            for name in expired:
+                self._remove_locked(name)
+            while self.bytes_stored > self.max_bytes and self._index:
+                self._remove_locked(next(iter(self._index)))
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.tmp') and now - entry.stat().st_mtime > _TEMP_FILE_GRACE:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_loop, name='chart-sweeper', daemon=True)
+                self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"清理圖表檔案時發生錯誤: {e}", exc_info=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._index),
+                'bytes_stored': self.bytes_stored,
+                'max_bytes': self.max_bytes,
+                'writes': self.writes,
+                'deduplicated': self.deduplicated,
+                'evictions': self.evictions,
+                'shared_fetches': self.shared_fetches,
+            }
+
+
+# 全程式共用的圖表儲存區
+chart_store = ChartStore(shared=shared_state)
@@ -0,0 +1,97 @@
+# coldstart.py
+# 冷啟動檢查：用全新的 Python 行程 import main 數次，量測所需時間，
+# 並確認 pandas / matplotlib / yfinance / yahoo_fin / Gemini SDK / psycopg2 這些重量級套件
+# 沒有在啟動時被載入 (它們應該等到第一次用到對應功能時才引入)。
+# 超過預算或載入了不該載入的套件時以狀態碼 1 結束；tests/test_coldstart.py 會在 pytest 中執行同樣的檢查。
+#
+# 用法：
+#   python coldstart.py                 # 預設預算 COLD_START_BUDGET=1.5 秒
+#   python coldstart.py --budget 0.8 --runs 5
+#   python coldstart.py --top 15        # 另外列出 -X importtime 最慢的 15 個模組
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+COLD_START_BUDGET = float(os.environ.get('COLD_START_BUDGET', 1.5))
+
+# 不應該出現在啟動路徑上的模組
+HEAVY_MODULES = ['pandas', 'numpy', 'matplotlib', 'yfinance', 'yahoo_fin', 'google.generativeai', 'psycopg2']
+
+# 在子行程內執行：import main 並回報耗時與已載入的重量級模組
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{'seconds': elapsed, 'heavy': heavy}}))
+"""
+
+
+def _probe_env():
+    env = dict(os.environ)
+    # 只量 import 本身：不連 LINE / 資料庫，也不啟動背景預熱
+    env.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'coldstart')
+    env.setdefault('LINE_CHANNEL_SECRET', 'coldstart')
+    env['DB_SCHEMA_INIT'] = 'skip'
+    env['FUNDAMENTALS_PREFETCH'] = '0'
+    env['ALERTS_ENABLED'] = '0'
+    return env
+
+
+def measure(runs):
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    code = _PROBE.format(heavy=HEAVY_MODULES)
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], cwd=repo_dir, env=_probe_env(),
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def slowest_imports(top):
+    """回傳 -X importtime 中累計耗時最多的 top 個模組 [(毫秒, 模組名稱)]。"""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=repo_dir,
+                            env=_probe_env(), capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative) / 1000, name.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='量測 import main 的冷啟動時間')
+    parser.add_argument('--budget', type=float, default=COLD_START_BUDGET, help='中位數上限 (秒)')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=0, help='列出最慢的 N 個模組')
+    args = parser.parse_args(argv)
+
+    results = measure(args.runs)
+    timings = [result['seconds'] for result in results]
+    median = statistics.median(timings)
+    heavy = sorted({name for result in results for name in result['heavy']})
+    print(f"import main：中位數 {median * 1000:.0f} ms (最快 {min(timings) * 1000:.0f} ms，"
+          f"最慢 {max(timings) * 1000:.0f} ms，共 {args.runs} 次)，預算 {args.budget * 1000:.0f} ms")
+    for milliseconds, name in slowest_imports(args.top) if args.top else []:
+        print(f"  {milliseconds:8.1f} ms  {name}")
+
+    ok = True
+    if heavy:
+        print(f"啟動時載入了重量級套件：{', '.join(heavy)}")
+        ok = False
+    if median > args.budget:
+        print("冷啟動時間超過預算")
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
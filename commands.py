@@ -0,0 +1,64 @@
+# commands.py
+# 指令路由：訊息只做一次正規化與切字，再查預先建好的表格決定交給哪個處理函式。
+#   - 整句完全符合的關鍵字 (使用說明、我的最愛、gainers ...) 直接查 dict
+#   - 「<代碼> profile / news / chart」與「add <代碼>」這類動詞只比對頭尾的完整單字，
+#     公司名稱裡剛好含有 news 之類的字不會再被誤判
+#   - 其他訊息一律當成查詢股價
+import re
+from collections import namedtuple
+
+Route = namedtuple('Route', ['command', 'arg'])
+# 價格提醒的條件：direction 為 above (漲破)、below (跌破) 或 move (當日漲跌幅絕對值超過 threshold %)
+AlertSpec = namedtuple('AlertSpec', ['target', 'direction', 'threshold'])
+
+EXACT_COMMANDS = {
+    **dict.fromkeys(['使用說明', 'help', '查詢股價', 'stock', 'query'], 'help'),
+    **dict.fromkeys(['我的最愛', 'favorite', 'favorites'], 'favorites'),
+    **dict.fromkeys(['熱門股', 'hot stocks', 'hot'], 'hot'),
+    **dict.fromkeys(['熱門成交量', 'volume'], 'volume'),
+    **dict.fromkeys(['漲幅排名', 'gainers'], 'gainers'),
+    **dict.fromkeys(['我的提醒', 'alerts'], 'alerts'),
+}
+
+# 動詞放在代碼後面：「NVDA profile」
+SUFFIX_VERBS = {'profile': 'profile', 'news': 'news', 'chart': 'chart'}
+# 動詞放在代碼前面：「add NVDA」
+PREFIX_VERBS = {'add': 'add', 'alert': 'alert', '提醒': 'alert', 'unalert': 'unalert', '取消提醒': 'unalert'}
+
+# 「NVDA > 150」「NVDA < 120」「蘋果 5%」；全形符號也接受
+_ALERT_PATTERN = re.compile(
+    r'^(?P<target>.+?)\s*(?:(?P<op>[<>＜＞])=?\s*\$?(?P<price>\d+(?:\.\d+)?)|(?P<pct>\d+(?:\.\d+)?)\s*[%％])$')
+
+
+def route_message(text):
+    """回傳 Route(command, arg)；arg 為指令的參數 (保留使用者原本的大小寫)，沒有參數時為 None。"""
+    stripped = text.strip()
+    command = EXACT_COMMANDS.get(stripped.lower())
+    if command is not None:
+        return Route(command, None)
+    tokens = stripped.split()
+    if len(tokens) >= 2:
+        command = EXACT_COMMANDS.get(' '.join(tokens).lower())
+        if command is not None:
+            return Route(command, None)
+        command = SUFFIX_VERBS.get(tokens[-1].lower())
+        if command is not None:
+            return Route(command, ' '.join(tokens[:-1]))
+        command = PREFIX_VERBS.get(tokens[0].lower())
+        if command is not None:
+            return Route(command, ' '.join(tokens[1:]))
+    return Route('quote', stripped)
+
+
+def parse_alert(arg):
+    """解析 alert 指令的參數，回傳 AlertSpec；格式不對或門檻不是正數時回傳 None。"""
+    match = _ALERT_PATTERN.match((arg or '').strip())
+    if not match:
+        return None
+    if match['op']:
+        direction, threshold = ('above' if match['op'] in '>＞' else 'below'), float(match['price'])
+    else:
+        direction, threshold = 'move', float(match['pct'])
+    if threshold <= 0:
+        return None
+    return AlertSpec(match['target'].strip(), direction, threshold)
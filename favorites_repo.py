@@ -0,0 +1,389 @@
+# favorites_repo.py
+# 我的最愛資料存取層：以有上限的連線池取代每次呼叫都重新 psycopg2.connect。
+# DATABASE_URL 為 postgres:// 時連到 PostgreSQL；為 sqlite:///路徑 或 .db 檔時改用本機 SQLite
+# (例如專案內的 favorites.db)，方便測試時不需要真的 Postgres。
+import os
+import queue
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import span
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 2))
+DB_HEALTHCHECK_INTERVAL = float(os.environ.get('DB_HEALTHCHECK_INTERVAL', 30))
+
+
+# =============================================================
+# 不同資料庫的差異 (連線方式、建表語法、預備陳述式)
+# =============================================================
+# schema 依序執行，每一條都必須可以重複執行 (CREATE TABLE IF NOT EXISTS)。
+# 新增資料表時只往清單後面追加：既有的資料庫會在下次部署執行 python favorites_repo.py，
+# 或啟動時的 init_db (DB_SCHEMA_INIT=async / sync) 補上，不必另外跑遷移腳本；
+# 預備陳述式是用到時才 PREPARE，資料表補上之前也不會影響其他功能。
+class _PostgresDialect:
+    schema = ['''
+        CREATE TABLE IF NOT EXISTS favorites (
+            id SERIAL PRIMARY KEY,
+            user_id VARCHAR(255) NOT NULL,
+            stock_symbol VARCHAR(50) NOT NULL,
+            UNIQUE(user_id, stock_symbol)
+        );
+    ''', '''
+        CREATE TABLE IF NOT EXISTS price_alerts (
+            id SERIAL PRIMARY KEY,
+            user_id VARCHAR(255) NOT NULL,
+            stock_symbol VARCHAR(50) NOT NULL,
+            direction VARCHAR(8) NOT NULL,
+            threshold DOUBLE PRECISION NOT NULL,
+            triggered BOOLEAN NOT NULL DEFAULT FALSE,
+            UNIQUE(user_id, stock_symbol, direction, threshold)
+        );
+    ''']
+    # 每條連線第一次用到某個陳述式時才 PREPARE，之後只送 EXECUTE，省下每次解析與規劃 SQL 的成本；
+    # 不在建立連線時一次 PREPARE 全部，否則資料表還沒建立 (全新的資料庫、剛加了新資料表) 時每條連線都會失敗
+    statements = {
+        'fav_insert': ("INSERT INTO favorites (user_id, stock_symbol) VALUES ($1, $2)", ('text', 'text')),
+        'fav_select': ("SELECT stock_symbol FROM favorites WHERE user_id = $1 ORDER BY id", ('text',)),
+        'fav_symbols': ("SELECT DISTINCT stock_symbol FROM favorites", ()),
+        'alert_insert': ("INSERT INTO price_alerts (user_id, stock_symbol, direction, threshold) VALUES ($1, $2, $3, $4)",
+                         ('text', 'text', 'text', 'float8')),
+        'alert_select': ("SELECT stock_symbol, direction, threshold FROM price_alerts WHERE user_id = $1 ORDER BY id",
+                         ('text',)),
+        'alert_delete': ("DELETE FROM price_alerts WHERE user_id = $1 AND stock_symbol = $2", ('text', 'text')),
+        'alert_all': ("SELECT id, user_id, stock_symbol, direction, threshold, triggered FROM price_alerts", ()),
+        # 只改變狀態真的不同的列並回傳它們的 id：兩個行程同時掃描時，同一筆提醒只會有一個拿到
+        'alert_claim': ("UPDATE price_alerts SET triggered = TRUE WHERE id = ANY($1) AND NOT triggered RETURNING id",
+                        ('integer[]',)),
+        'alert_rearm': ("UPDATE price_alerts SET triggered = FALSE WHERE id = ANY($1) AND triggered RETURNING id",
+                        ('integer[]',)),
+    }
+
+    def __init__(self, url):
+        import psycopg2
+        import psycopg2.errors
+        import psycopg2.extensions
+
+        class PreparingConnection(psycopg2.extensions.connection):
+            """記錄這條連線上已經 PREPARE 過的陳述式。"""
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.prepared = set()
+
+        self._psycopg2 = psycopg2
+        self._connection_factory = PreparingConnection
+        self.url = url
+        self.integrity_error = psycopg2.IntegrityError
+        self._statement_missing = psycopg2.errors.InvalidSqlStatementName
+
+    def connect(self):
+        return self._psycopg2.connect(self.url, sslmode='require', connection_factory=self._connection_factory)
+
+    def _prepare(self, cursor, name):
+        sql, types = self.statements[name]
+        params = f" ({', '.join(types)})" if types else ''
+        cursor.execute(f"PREPARE {name}{params} AS {sql}")
+        # PREPARE 不受交易回滾影響，成功後這條連線就一直可以用
+        cursor.connection.prepared.add(name)
+
+    def execute(self, cursor, name, params=()):
+        placeholders = f" ({', '.join(['%s'] * len(params))})" if params else ''
+        if name not in cursor.connection.prepared:
+            self._prepare(cursor, name)
+        try:
+            cursor.execute(f"EXECUTE {name}{placeholders}", params)
+        except self._statement_missing:
+            # 預備陳述式不見了 (例如經過 pgbouncer 換了後端連線、或被 DEALLOCATE)：重新 PREPARE 後再試一次。
+            # 每次取用連線只執行一個陳述式，回滾不會丟掉其他寫入
+            cursor.connection.rollback()
+            cursor.connection.prepared.discard(name)
+            self._prepare(cursor, name)
+            cursor.execute(f"EXECUTE {name}{placeholders}", params)
+
+    def update_ids(self, cursor, name, ids):
+        """一次更新 ids 中的所有列，回傳真的被更新的 id。"""
+        self.execute(cursor, name, (list(ids),))
+        return [row[0] for row in cursor.fetchall()]
+
+
+class _SQLiteDialect:
+    schema = ['''
+        CREATE TABLE IF NOT EXISTS favorites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            stock_symbol TEXT NOT NULL,
+            UNIQUE(user_id, stock_symbol)
+        )
+    ''', '''
+        CREATE TABLE IF NOT EXISTS price_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            stock_symbol TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            threshold REAL NOT NULL,
+            triggered INTEGER NOT NULL DEFAULT 0,
+            UNIQUE(user_id, stock_symbol, direction, threshold)
+        )
+    ''']
+    # sqlite3 會依 SQL 字串自動快取編譯好的陳述式，固定字串即可重用
+    statements = {
+        'fav_insert': "INSERT INTO favorites (user_id, stock_symbol) VALUES (?, ?)",
+        'fav_select': "SELECT stock_symbol FROM favorites WHERE user_id = ? ORDER BY id",
+        'fav_symbols': "SELECT DISTINCT stock_symbol FROM favorites",
+        'alert_insert': "INSERT INTO price_alerts (user_id, stock_symbol, direction, threshold) VALUES (?, ?, ?, ?)",
+        'alert_select': "SELECT stock_symbol, direction, threshold FROM price_alerts WHERE user_id = ? ORDER BY id",
+        'alert_delete': "DELETE FROM price_alerts WHERE user_id = ? AND stock_symbol = ?",
+        'alert_all': "SELECT id, user_id, stock_symbol, direction, threshold, triggered FROM price_alerts",
+        'alert_claim': "UPDATE price_alerts SET triggered = 1 WHERE id = ? AND triggered = 0",
+        'alert_rearm': "UPDATE price_alerts SET triggered = 0 WHERE id = ? AND triggered = 1",
+    }
+    integrity_error = sqlite3.IntegrityError
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=DB_POOL_TIMEOUT, check_same_thread=False)
+
+    def execute(self, cursor, name, params=()):
+        cursor.execute(self.statements[name], params)
+
+    def update_ids(self, cursor, name, ids):
+        """逐筆更新 (同一個交易內)，回傳真的被更新的 id。"""
+        updated = []
+        for alert_id in ids:
+            cursor.execute(self.statements[name], (alert_id,))
+            if cursor.rowcount:
+                updated.append(alert_id)
+        return updated
+
+
+def _dialect_for(url):
+    if url.startswith('sqlite:///'):
+        return _SQLiteDialect(url[len('sqlite:///'):])
+    if url.endswith('.db') and '://' not in url:
+        return _SQLiteDialect(url)
+    return _PostgresDialect(url)
+
+
+# =============================================================
+# 連線池
+# =============================================================
+class ConnectionPool:
+    """
+    最多保留 maxsize 條連線的池子。
+    取出閒置過久的連線時先做 SELECT 1 健康檢查，壞掉就換一條新的；
+    池子用完且等待 timeout 秒仍拿不到時，臨時開一條池外連線，用完即關閉。
+    """
+
+    def __init__(self, connect, maxsize=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 healthcheck_interval=DB_HEALTHCHECK_INTERVAL):
+        self._connect = connect
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._idle = queue.LifoQueue()  # (conn, last_used)
+        self._opened = 0
+        self._lock = threading.Lock()
+        self.overflow_count = 0
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._opened -= 1
+
+    def _checkout(self):
+        """回傳 (conn, pooled)；pooled 為 False 表示是池外的臨時連線。"""
+        try:
+            conn, last_used = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_open = self._opened < self.maxsize
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    return self._connect(), True
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            try:
+                conn, last_used = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                self.overflow_count += 1
+                logging.warning(f"資料庫連線池已滿 ({self.maxsize})，改用臨時連線")
+                return self._connect(), False
+
+        if time.monotonic() - last_used > self.healthcheck_interval and not self._is_healthy(conn):
+            logging.warning("資料庫連線健康檢查失敗，重新建立連線")
+            self._discard(conn)
+            with self._lock:
+                self._opened += 1
+            try:
+                return self._connect(), True
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+        return conn, True
+
+    @contextmanager
+    def connection(self):
+        conn, pooled = self._checkout()
+        healthy = True
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                healthy = False
+            raise
+        finally:
+            if not pooled:
+                conn.close()
+            elif healthy:
+                self._idle.put((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+
+    def closeall(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        return {
+            'opened': self._opened,
+            'idle': self._idle.qsize(),
+            'maxsize': self.maxsize,
+            'overflow': self.overflow_count,
+        }
+
+
+# =============================================================
+# 我的最愛 Repository
+# =============================================================
+class FavoritesRepository:
+
+    def __init__(self, url, pool_size=DB_POOL_SIZE):
+        self.dialect = _dialect_for(url)
+        self.pool = ConnectionPool(self.dialect.connect, maxsize=pool_size)
+
+    def init_schema(self):
+        with span('db.init_schema'), self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for statement in self.dialect.schema:
+                cursor.execute(statement)
+            cursor.close()
+
+    def _run(self, name, params=(), fetch=False):
+        """
+        從連線池取得連線並執行預備陳述式 name；耗時 (含等待連線) 記錄為 db.<name>。
+        fetch=True 時回傳所有資料列，否則回傳影響的列數。
+        """
+        with span(f'db.{name}'), self.pool.connection() as conn:
+            cursor = conn.cursor()
+            self.dialect.execute(cursor, name, params)
+            results = cursor.fetchall() if fetch else cursor.rowcount
+            cursor.close()
+        return results
+
+    def add(self, user_id, stock_symbol):
+        """新增成功回傳 True；已經在清單中則回傳 False。"""
+        try:
+            self._run('fav_insert', (user_id, stock_symbol))
+            return True
+        except self.dialect.integrity_error:
+            return False
+
+    def list(self, user_id):
+        return [item[0] for item in self._run('fav_select', (user_id,), fetch=True)]
+
+    def all_symbols(self):
+        """所有使用者收藏過的不重複代碼。"""
+        return [item[0] for item in self._run('fav_symbols', fetch=True)]
+
+    # ---------- 價格提醒 ----------
+    def add_alert(self, user_id, stock_symbol, direction, threshold):
+        """新增成功回傳 True；同樣的提醒已經存在則回傳 False。"""
+        try:
+            self._run('alert_insert', (user_id, stock_symbol, direction, threshold))
+            return True
+        except self.dialect.integrity_error:
+            return False
+
+    def list_alerts(self, user_id):
+        """回傳 [(代碼, 方向, 門檻)]。"""
+        return [tuple(row) for row in self._run('alert_select', (user_id,), fetch=True)]
+
+    def remove_alerts(self, user_id, stock_symbol):
+        """刪除某位使用者對某檔股票的所有提醒，回傳刪除的筆數。"""
+        return self._run('alert_delete', (user_id, stock_symbol))
+
+    def all_alerts(self):
+        """提醒引擎用：回傳所有提醒 [(id, 使用者, 代碼, 方向, 門檻, 是否已觸發)]。"""
+        return self._run('alert_all', fetch=True)
+
+    def _update_alerts(self, name, ids):
+        if not ids:
+            return []
+        with span(f'db.{name}'), self.pool.connection() as conn:
+            cursor = conn.cursor()
+            updated = self.dialect.update_ids(cursor, name, ids)
+            cursor.close()
+        return updated
+
+    def claim_alerts(self, ids):
+        """把尚未觸發的提醒標記為已觸發，回傳這次呼叫真的改變的 id；只有這些需要通知。"""
+        return self._update_alerts('alert_claim', ids)
+
+    def rearm_alerts(self, ids):
+        """把已觸發的提醒重新啟用，回傳真的改變的 id。"""
+        return self._update_alerts('alert_rearm', ids)
+
+
+_repo = None
+_repo_lock = threading.Lock()
+
+
+def get_repository():
+    """回傳全程式共用的 FavoritesRepository；未設定 DATABASE_URL 時回傳 None。"""
+    global _repo
+    if _repo is None and DATABASE_URL:
+        with _repo_lock:
+            if _repo is None:
+                _repo = FavoritesRepository(DATABASE_URL)
+    return _repo
+
+
+# 部署時執行建表，既有的資料庫也會補上新的資料表 (搭配 DB_SCHEMA_INIT=skip)：python favorites_repo.py
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    repository = get_repository()
+    if repository is None:
+        raise SystemExit("尚未設定 DATABASE_URL")
+    repository.init_schema()
+    logging.info("資料表已建立或更新 (favorites、price_alerts)")
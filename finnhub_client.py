@@ -0,0 +1,173 @@
+# finnhub_client.py
+# Finnhub API 共用客戶端：所有對 Finnhub 的呼叫都經過這裡。
+#   - 共用一個有連線池的 requests.Session (keep-alive)
+#   - 全程式共用的 token bucket 限流，避免超過 Finnhub 每分鐘配額。FINNHUB_RATE_LIMIT 是整個執行個體的配額，
+#     gunicorn 有多個 worker (GUNICORN_WORKERS / WEB_CONCURRENCY) 時每個行程平分，加總不會超過；
+#     背景工作 (價格提醒、基本面預熱) 用另一個 bucket，只能用 FINNHUB_BACKGROUND_SHARE 比例的額度，
+#     掃描再多檔股票也不會把使用者查詢的額度用光
+#   - 遇到 429 / 5xx / 連線錯誤時以指數退避 + 隨機抖動重試
+#   - 依 endpoint 記錄延遲分布 (histogram)
+# FINNHUB_API_URL 可以指向本機的假伺服器，方便測試與壓測。
+import os
+import random
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tracing import LatencyHistogram, span
+
+FINNHUB_API_KEY = os.environ.get('FINNHUB_API_KEY')
+FINNHUB_API_URL = os.environ.get('FINNHUB_API_URL', 'https://finnhub.io/api/v1')
+FINNHUB_RATE_LIMIT = float(os.environ.get('FINNHUB_RATE_LIMIT', 60))  # 每分鐘可呼叫次數 (所有 worker 合計)
+FINNHUB_BURST = int(os.environ.get('FINNHUB_BURST', 10))
+# 共用同一份配額的行程數
+WORKER_PROCESSES = max(1, int(os.environ.get('GUNICORN_WORKERS') or os.environ.get('WEB_CONCURRENCY') or 1))
+FINNHUB_RATE_LIMIT_WAIT = float(os.environ.get('FINNHUB_RATE_LIMIT_WAIT', 5))
+FINNHUB_MAX_RETRIES = int(os.environ.get('FINNHUB_MAX_RETRIES', 2))
+# 重試前最多等幾秒；Finnhub 的 Retry-After 要求等更久時直接失敗，不讓使用者的請求卡住
+FINNHUB_MAX_BACKOFF = float(os.environ.get('FINNHUB_MAX_BACKOFF', 4))
+FINNHUB_POOL_SIZE = int(os.environ.get('FINNHUB_POOL_SIZE', 16))
+# 每分鐘配額中保留給背景工作的比例，其餘留給使用者的查詢
+FINNHUB_BACKGROUND_SHARE = float(os.environ.get('FINNHUB_BACKGROUND_SHARE', 0.25))
+
+class FinnhubError(Exception):
+    """呼叫 Finnhub 失敗 (限流等待逾時或重試後仍失敗)。"""
+
+
+class RateLimitError(FinnhubError):
+    """額度用完，在等待時間 (或呼叫端的期限) 內拿不到 token，請求沒有送出。"""
+
+
+class TokenBucket:
+    """執行緒安全的 token bucket：每秒補充 rate 個 token，最多累積 capacity 個。"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """取得一個 token；timeout 秒內拿不到就回傳 False。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class FinnhubClient:
+
+    def __init__(self, api_key=FINNHUB_API_KEY, base_url=FINNHUB_API_URL,
+                 rate_per_minute=FINNHUB_RATE_LIMIT / WORKER_PROCESSES, burst=max(1, FINNHUB_BURST // WORKER_PROCESSES),
+                 max_retries=FINNHUB_MAX_RETRIES, pool_size=FINNHUB_POOL_SIZE, background_share=FINNHUB_BACKGROUND_SHARE):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        if 0 < background_share < 1:
+            background_rate = rate_per_minute * background_share / 60.0
+            self.limiter = TokenBucket(rate_per_minute / 60.0 - background_rate, burst)
+            self.background_limiter = TokenBucket(background_rate, max(1, round(burst * background_share)))
+        else:
+            # 不保留額度：背景工作與使用者查詢共用同一個 bucket
+            self.limiter = self.background_limiter = TokenBucket(rate_per_minute / 60.0, burst)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # API key 放在 header，不再出現在網址 (也就不會出現在日誌裡)
+        if api_key:
+            self.session.headers['X-Finnhub-Token'] = api_key
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.throttled = 0
+
+    def _histogram(self, endpoint):
+        with self._lock:
+            histogram = self._histograms.get(endpoint)
+            if histogram is None:
+                histogram = self._histograms[endpoint] = LatencyHistogram()
+            return histogram
+
+    def _backoff(self, attempt, response=None):
+        """重試前要等的秒數；Retry-After 超過 FINNHUB_MAX_BACKOFF 時回傳 None，表示不重試。"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after) if float(retry_after) <= FINNHUB_MAX_BACKOFF else None
+        return min(FINNHUB_MAX_BACKOFF, 0.25 * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def get(self, endpoint, params=None, timeout=10, background=False, deadline=None):
+        """
+        呼叫 GET {base_url}{endpoint}，回傳解析後的 JSON；background=True 時使用背景工作的額度。
+        deadline 是呼叫端的截止時間 (time.monotonic())：等 token、重試都不會超過它，來不及時丟出 RateLimitError。
+        """
+        with span(f'finnhub{endpoint}'):
+            return self._get(endpoint, params, timeout, self.background_limiter if background else self.limiter,
+                             deadline)
+
+    def _get(self, endpoint, params, timeout, limiter, deadline=None):
+        histogram = self._histogram(endpoint)
+        url = f"{self.base_url}{endpoint}"
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            wait = FINNHUB_RATE_LIMIT_WAIT
+            if deadline is not None:
+                wait = max(0.0, min(wait, deadline - time.monotonic()))
+            if not limiter.acquire(timeout=wait):
+                with self._lock:
+                    self.throttled += 1
+                raise RateLimitError(f"Finnhub 呼叫次數已達上限，等待 {wait:.1f} 秒仍無法送出 {endpoint}")
+            response = None
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, params=params, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+            finally:
+                histogram.observe(time.monotonic() - start)
+
+            if response is not None:
+                if response.status_code != 429 and response.status_code < 500:
+                    response.raise_for_status()
+                    return response.json()
+                last_error = requests.HTTPError(f"{response.status_code} for {endpoint}", response=response)
+
+            if attempt < self.max_retries:
+                delay = self._backoff(attempt, response)
+                if delay is None:
+                    raise FinnhubError(f"Finnhub 要求 {response.headers['Retry-After']} 秒後再試 {endpoint}，"
+                                       f"超過上限 {FINNHUB_MAX_BACKOFF} 秒，不再重試")
+                if deadline is not None and time.monotonic() + delay > deadline:
+                    break
+                with self._lock:
+                    self.retries += 1
+                logging.warning(f"呼叫 Finnhub {endpoint} 失敗 ({last_error})，{delay:.2f} 秒後重試")
+                time.sleep(delay)
+        raise last_error
+
+    def stats(self):
+        with self._lock:
+            histograms = dict(self._histograms)
+            retries, throttled = self.retries, self.throttled
+        return {
+            'retries': retries,
+            'throttled': throttled,
+            'latency': {endpoint: histogram.snapshot() for endpoint, histogram in histograms.items()},
+        }
+
+
+# 全程式共用的 Finnhub 客戶端
+finnhub = FinnhubClient()
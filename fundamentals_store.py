@@ -0,0 +1,260 @@
+# fundamentals_store.py
+# 基本面資料快取：Finnhub /stock/metric 的估值數據一天最多變一次，
+# 依 (代碼, 最近一個已收盤的交易日) 存進本機 SQLite，同一個交易日 (含之後的週末、休市日) 重複查詢不必再連網。
+# 查無資料的空結果不存，避免一時查不到就整天都回「找不到」。
+# 收盤後由背景執行緒重新抓取所有使用者最愛清單中的代碼，隔天早上查詢時已經是新的資料：
+#   - 只在收盤後 (FUNDAMENTALS_REFRESH_HOUR 之後) 預熱，白天冷啟動不會一口氣抓所有代碼
+#   - 使用 Finnhub 的背景額度 (FINNHUB_BACKGROUND_SHARE)，不佔用使用者查詢的額度
+#   - 同一台機器的多個 worker 共用同一個 SQLite 檔，每個檢查週期只有搶到共用後端租約的行程會預熱
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import datetime
+import threading
+from functools import lru_cache
+
+from finnhub_client import FinnhubError, finnhub
+from tracing import span
+
+FUNDAMENTALS_DB = os.environ.get('FUNDAMENTALS_DB', 'fundamentals.db')
+# 美東時間幾點 (收盤後) 開始背景更新
+FUNDAMENTALS_REFRESH_HOUR = int(os.environ.get('FUNDAMENTALS_REFRESH_HOUR', 17))
+FUNDAMENTALS_CHECK_INTERVAL = float(os.environ.get('FUNDAMENTALS_CHECK_INTERVAL', 600))
+# 只保留最近幾天的資料
+FUNDAMENTALS_RETENTION_DAYS = int(os.environ.get('FUNDAMENTALS_RETENTION_DAYS', 7))
+
+
+def _eastern_now():
+    try:
+        from zoneinfo import ZoneInfo
+        return datetime.datetime.now(ZoneInfo('America/New_York'))
+    except Exception:
+        return datetime.datetime.utcnow() - datetime.timedelta(hours=5)
+
+
+def _observed(day):
+    """落在週末的國定假日改在前一個週五或下一個週一休市。"""
+    if day.weekday() == 5:
+        return day - datetime.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + datetime.timedelta(days=1)
+    return day
+
+
+def _nth_weekday(year, month, weekday, n):
+    """某月第 n 個星期幾 (weekday: 週一為 0)；n = -1 表示最後一個。"""
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _easter(year):
+    """復活節 (Anonymous Gregorian algorithm)，用來算耶穌受難日。"""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    w = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 19 * w) // 433
+    month = (h + w - 7 * m + 90) // 25
+    return datetime.date(year, month, (h + w - 7 * m + 33 * month + 19) % 32)
+
+
+@lru_cache(maxsize=8)
+def market_holidays(year):
+    """紐約證交所的全日休市日 (不含臨時休市)。"""
+    holidays = {
+        _nth_weekday(year, 1, 0, 3),                     # 馬丁路德金恩紀念日
+        _nth_weekday(year, 2, 0, 3),                     # 總統日
+        _easter(year) - datetime.timedelta(days=2),      # 耶穌受難日
+        _nth_weekday(year, 5, 0, -1),                    # 陣亡將士紀念日
+        _observed(datetime.date(year, 7, 4)),            # 獨立紀念日
+        _nth_weekday(year, 9, 0, 1),                     # 勞動節
+        _nth_weekday(year, 11, 3, 4),                    # 感恩節
+        _observed(datetime.date(year, 12, 25)),          # 聖誕節
+    }
+    # 元旦落在週六時不補假 (前一天是上一年度的最後一個交易日)
+    if datetime.date(year, 1, 1).weekday() != 5:
+        holidays.add(_observed(datetime.date(year, 1, 1)))
+    if year >= 2022:
+        holidays.add(_observed(datetime.date(year, 6, 19)))  # 六月節
+    return frozenset(holidays)
+
+
+def is_trading_day(day):
+    return day.weekday() < 5 and day not in market_holidays(day.year)
+
+
+def metrics_date(now=None):
+    """
+    基本面資料所屬的交易日：最近一個已收盤 (過了 FUNDAMENTALS_REFRESH_HOUR) 的交易日。
+    白天查詢會命中前一個交易日收盤後抓好的資料，週末與休市日沿用前一個交易日的資料，
+    交易日收盤後第一次查詢才會觸發更新。
+    """
+    now = now or _eastern_now()
+    day = now.date()
+    if now.hour < FUNDAMENTALS_REFRESH_HOUR:
+        day -= datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day -= datetime.timedelta(days=1)
+    return day.isoformat()
+
+
+def _is_empty(payload):
+    """Finnhub 對查無資料的代碼會回傳空的 metric。"""
+    return not payload or not payload.get('metric')
+
+
+def _fetch_metrics(symbol, background=False):
+    data = finnhub.get('/stock/metric', {'symbol': symbol, 'metric': 'valuation'}, timeout=10, background=background)
+    return data if data else {}
+
+
+class FundamentalsStore:
+
+    def __init__(self, path=FUNDAMENTALS_DB, fetch=_fetch_metrics):
+        self.path = path
+        self.fetch = fetch
+        self._conn = None
+        self._lock = threading.Lock()
+        self._refresher = None
+        self.hits = 0
+        self.misses = 0
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS fundamentals (
+                    symbol TEXT NOT NULL,
+                    metrics_date TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (symbol, metrics_date)
+                )
+            ''')
+            self._conn.commit()
+        return self._conn
+
+    def _load(self, symbol, day):
+        with span('db.fundamentals'), self._lock:
+            row = self._connection().execute(
+                "SELECT payload FROM fundamentals WHERE symbol = ? AND metrics_date = ?", (symbol, day)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save(self, symbol, day, payload):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO fundamentals (symbol, metrics_date, payload, fetched_at) VALUES (?, ?, ?, ?)",
+                         (symbol, day, json.dumps(payload, separators=(',', ':')), time.time()))
+            conn.commit()
+
+    def get(self, symbol):
+        """回傳 /stock/metric 的 JSON；這個交易日已經抓過就直接從本機讀取。"""
+        symbol = symbol.upper()
+        day = metrics_date()
+        payload = self._load(symbol, day)
+        if payload is not None:
+            self.hits += 1
+            return payload
+        self.misses += 1
+        payload = self.fetch(symbol)
+        if not _is_empty(payload):
+            self._save(symbol, day, payload)
+        return payload
+
+    def warm(self, symbols, deadline=None):
+        """
+        批次預熱：用背景額度把還沒有當天資料的代碼抓好存起來，回傳 (實際抓取的數量, 還沒抓到的數量)。
+        超過 deadline (time.monotonic()) 或背景額度用完時先停下來，下次再接著抓。
+        """
+        day = metrics_date()
+        fetched = 0
+        pending = [symbol for symbol in dict.fromkeys(symbol.upper() for symbol in symbols)
+                   if self._load(symbol, day) is None]
+        for position, symbol in enumerate(pending):
+            if deadline is not None and time.monotonic() >= deadline:
+                return fetched, len(pending) - position
+            try:
+                payload = self.fetch(symbol, background=True)
+                if not _is_empty(payload):
+                    self._save(symbol, day, payload)
+                fetched += 1
+            except FinnhubError as e:
+                logging.warning(f"預熱基本面資料暫停，背景額度不足: {e}")
+                return fetched, len(pending) - position
+            except Exception as e:
+                logging.error(f"預熱基本面資料時發生錯誤 for symbol {symbol}: {e}", exc_info=True)
+        return fetched, 0
+
+    def prune(self):
+        cutoff = (datetime.date.fromisoformat(metrics_date()) -
+                  datetime.timedelta(days=FUNDAMENTALS_RETENTION_DAYS)).isoformat()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM fundamentals WHERE metrics_date < ?", (cutoff,))
+            conn.commit()
+
+    def _acquire_lease(self, shared, ttl):
+        """同一台機器 (共用同一個 SQLite 檔) 的多個 worker，每個檢查週期只讓一個行程預熱。"""
+        if shared is None:
+            return True
+        return shared.add(f'fundamentals:warm:{socket.gethostname()}', str(os.getpid()).encode(), ttl)
+
+    def refresh_once(self, symbols_provider, shared=None, interval=FUNDAMENTALS_CHECK_INTERVAL):
+        """
+        收盤後、搶到租約時預熱一輪 (最多 interval 的九成時間，租約過期前停下來)，
+        回傳這一天是否已經全部預熱完成；不在收盤後或沒搶到租約時回傳 False。
+        """
+        if _eastern_now().hour < FUNDAMENTALS_REFRESH_HOUR:
+            return False
+        ttl = interval * 0.9
+        if not self._acquire_lease(shared, ttl):
+            return False
+        day = metrics_date()
+        symbols = symbols_provider()
+        fetched, remaining = self.warm(symbols, deadline=time.monotonic() + ttl)
+        if remaining:
+            logging.info(f"基本面資料預熱中 ({day})：這一輪抓取 {fetched} 檔，還有 {remaining} 檔")
+            return False
+        self.prune()
+        logging.info(f"基本面資料預熱完成 ({day})：{fetched}/{len(symbols)} 檔重新抓取")
+        return True
+
+    def start_refresher(self, symbols_provider, shared=None):
+        """
+        啟動背景執行緒：每天收盤後用 symbols_provider() 取得要更新的代碼 (例如所有使用者的最愛清單) 並預熱，
+        每 FUNDAMENTALS_CHECK_INTERVAL 秒檢查一次，這一天預熱完成後就等到下一個收盤。
+        """
+        if self._refresher is not None:
+            return
+
+        def loop():
+            done_day = None
+            while True:
+                day = metrics_date()
+                if day != done_day:
+                    try:
+                        if self.refresh_once(symbols_provider, shared):
+                            done_day = day
+                    except Exception as e:
+                        logging.error(f"背景更新基本面資料時發生錯誤: {e}", exc_info=True)
+                time.sleep(FUNDAMENTALS_CHECK_INTERVAL)
+
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=loop, name='fundamentals-refresher', daemon=True)
+                self._refresher.start()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+# 全程式共用的基本面資料快取
+fundamentals_store = FundamentalsStore()
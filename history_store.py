@@ -0,0 +1,352 @@
+# history_store.py
+# 日線歷史資料儲存區：每檔股票一個資料夾，每個欄位一個只會往後追加的二進位檔
+# (date / open / high / low / close / volume 與預先算好的 ma20 / ma50 / daily_return)，讀取時用 np.memmap 對應，
+#   - 第一次查詢時下載 HISTORY_BACKFILL_PERIOD 的資料，之後只下載最後一根已存 K 棒之後缺少的部分
+#   - 1mo / 3mo / 1y 等任意區間都是同一組 memmap 的切片，不會複製資料
+#   - 移動平均與日報酬在追加時用前面的收盤價接著算好，查詢時不必重算
+# 今天盤中的 K 棒還會變動，只放在記憶體中 (HistoryWindow.live)，收盤後的下一次更新才寫進檔案。
+# 價格不做股利還原 (auto_adjust=False)，過去的收盤價不會因為配息而改變，才能只往後追加；
+# 股票分割等事件會回溯調整過去的價格：每次更新都從最後一根已存的 K 棒開始下載，
+# 重疊的那一根對不上時重新下載完整歷史，寫成新的一代檔案後把 SYMBOL 捷徑原子地切換過去
+# (其他行程已經對應的舊檔案在它們換新之前仍然可以讀)。
+# 同一台機器的多個 worker 共用同一個資料夾，寫入時以 fcntl 檔案鎖 (SYMBOL.lock) 互斥；每台機器各自維護自己的一份。
+# 這個模組會載入 numpy，chart_service 只在第一次畫圖時才引入它。
+import os
+import re
+import time
+import fcntl
+import shutil
+import logging
+import datetime
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from tracing import span
+
+HISTORY_DIR = os.environ.get('HISTORY_DIR', 'history_data')
+# 第一次查詢某檔股票時下載多長的歷史 (要涵蓋最長的查詢區間加上 ma50 需要的天數)
+HISTORY_BACKFILL_PERIOD = os.environ.get('HISTORY_BACKFILL_PERIOD', '2y')
+# 同一檔股票多久檢查一次有沒有新的 K 棒
+HISTORY_REFRESH_INTERVAL = float(os.environ.get('HISTORY_REFRESH_INTERVAL', 900))
+# 同時保留 memmap 的股票數：每檔股票的每個欄位各佔一個檔案描述子 (mmap 會 dup 一份)，
+# 超過時最久沒用的那檔先放掉，避免畫過的股票一多就用完 ulimit (常見為 1024)
+HISTORY_OPEN_SYMBOLS = int(os.environ.get('HISTORY_OPEN_SYMBOLS', 32))
+
+PRICE_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+MA_WINDOWS = (20, 50)
+INDICATOR_COLUMNS = tuple(f'ma{window}' for window in MA_WINDOWS) + ('daily_return',)
+COLUMNS = ('date',) + PRICE_COLUMNS + INDICATOR_COLUMNS
+_DTYPES = {'date': np.dtype('<M8[D]'), **{column: np.dtype('<f8') for column in COLUMNS[1:]}}
+# 追加新資料時需要往前看的收盤價數量
+_LOOKBACK = max(MA_WINDOWS)
+
+_PERIOD_PATTERN = re.compile(r'^(\d+)(d|wk|mo|y)$')
+# 代碼會成為資料夾名稱，只接受 Yahoo 代碼會用到的字元
+_SYMBOL_PATTERN = re.compile(r'^[A-Z0-9.^=\-]{1,20}$')
+
+# 一根 K 棒：date 為 numpy.datetime64[D]，其他欄位為 float
+Bar = namedtuple('Bar', COLUMNS)
+
+
+class HistoryWindow(namedtuple('HistoryWindow', ('symbol',) + COLUMNS + ('live',))):
+    """某個區間的歷史資料，每個欄位都是 memmap 的切片；live 為今天盤中的 K 棒 (Bar) 或 None。"""
+    __slots__ = ()
+
+    def series(self, column='close'):
+        """回傳 (日期, 數值) 兩個陣列，有盤中 K 棒時接在最後面 (只有這時候會複製)。"""
+        dates, values = self.date, getattr(self, column)
+        if self.live is not None:
+            dates = np.append(dates, self.live.date)
+            values = np.append(values, getattr(self.live, column))
+        return dates, values
+
+
+def _eastern_today():
+    try:
+        from zoneinfo import ZoneInfo
+        now = datetime.datetime.now(ZoneInfo('America/New_York'))
+    except Exception:
+        now = datetime.datetime.utcnow() - datetime.timedelta(hours=5)
+    return np.datetime64(now.date(), 'D')
+
+
+def window_start(end, period):
+    """依 yfinance 的 period 寫法 (5d / 2wk / 1mo / 3mo / 1y / ytd / max) 算出區間的第一天；max 回傳 None。"""
+    if period == 'max':
+        return None
+    end_date = end.astype(datetime.date)
+    if period == 'ytd':
+        return np.datetime64(datetime.date(end_date.year, 1, 1), 'D')
+    match = _PERIOD_PATTERN.match(period)
+    if not match:
+        raise ValueError(f"不支援的區間: {period}")
+    count, unit = int(match[1]), match[2]
+    if unit in ('d', 'wk'):
+        return end - np.timedelta64(count * (7 if unit == 'wk' else 1), 'D')
+    months = count * (12 if unit == 'y' else 1)
+    year, month = divmod(end_date.year * 12 + end_date.month - 1 - months, 12)
+    # 月底往前推時落在較短的月份 (例如 3/31 -> 2/28)
+    day = end_date.day
+    while True:
+        try:
+            return np.datetime64(datetime.date(year, month + 1, day), 'D')
+        except ValueError:
+            day -= 1
+
+
+def compute_indicators(closes, previous):
+    """
+    計算 closes 這幾根 K 棒的移動平均與日報酬；previous 為它們之前已存的收盤價 (最多 _LOOKBACK 根)。
+    回傳 {欄位: 陣列}，前面資料不夠的移動平均為 NaN。
+    """
+    series = np.concatenate([previous, closes])
+    sums = np.concatenate([[0.0], np.cumsum(series)])
+    offset = len(previous)
+    positions = np.arange(offset, len(series))
+    indicators = {}
+    for window in MA_WINDOWS:
+        ma = np.full(len(closes), np.nan)
+        ready = positions >= window - 1
+        ends = positions[ready] + 1
+        ma[ready] = (sums[ends] - sums[ends - window]) / window
+        indicators[f'ma{window}'] = ma
+    returns = np.full(len(closes), np.nan)
+    has_previous = positions >= 1
+    prev_positions = positions[has_previous] - 1
+    returns[has_previous] = series[positions[has_previous]] / series[prev_positions] - 1
+    indicators['daily_return'] = returns
+    return indicators
+
+
+def _download(symbol, start=None):
+    """
+    向 yfinance 下載日線，start 為 None 時下載 HISTORY_BACKFILL_PERIOD。
+    回傳 (日期陣列, {open/high/low/close/volume: 陣列})；查無資料時回傳 None。
+    """
+    import yfinance as yf
+
+    ticker = yf.Ticker(symbol)
+    # 不做股利還原：auto_adjust=True 時每次配息都會改變所有過去的價格，和已存的資料基準不同
+    if start is None:
+        data = ticker.history(period=HISTORY_BACKFILL_PERIOD, interval='1d', auto_adjust=False)
+    else:
+        data = ticker.history(start=str(start), interval='1d', auto_adjust=False)
+    if data.empty:
+        return None
+    dates = np.array([timestamp.date() for timestamp in data.index], dtype='datetime64[D]')
+    return dates, {column: data[column.capitalize()].to_numpy(dtype=np.float64) for column in PRICE_COLUMNS}
+
+
+def _adjusted(arrays, dates, prices):
+    """下載的資料和最後一根已存 K 棒重疊的那一天收盤價不同，表示過去的價格被回溯調整過。"""
+    overlap = np.flatnonzero(dates == arrays['date'][-1])
+    if not len(overlap):
+        return False
+    return not np.isclose(prices['close'][overlap[0]], arrays['close'][-1], rtol=1e-6)
+
+
+class HistoryStore:
+
+    def __init__(self, directory=HISTORY_DIR, fetch=_download, refresh_interval=HISTORY_REFRESH_INTERVAL,
+                 max_open=HISTORY_OPEN_SYMBOLS):
+        self.directory = directory
+        self.fetch = fetch
+        self.refresh_interval = refresh_interval
+        self.max_open = max_open
+        self._lock = threading.Lock()
+        self._symbol_locks = {}
+        self._maps = OrderedDict()  # symbol -> (這一代資料夾的路徑, 列數, {欄位: memmap})，依最近使用排序
+        self._checked = {}   # symbol -> 上次檢查更新的 time.monotonic()
+        self._live = {}      # symbol -> 今天盤中的 Bar
+        self.downloads = 0
+        self.appended_bars = 0
+        self.rebuilds = 0
+        self.evictions = 0
+        self.windows = 0
+
+    # ---------- 檔案 ----------
+    def _symbol_dir(self, symbol):
+        """SYMBOL 是指向目前這一代資料夾 (.SYMBOL.<編號>) 的捷徑；舊版建立的則是一般資料夾。"""
+        return os.path.join(self.directory, symbol)
+
+    def _column_path(self, path, column):
+        return os.path.join(path, f'{column}.bin')
+
+    def _data_dir(self, symbol):
+        """目前這一代資料夾的路徑 (只讀一次捷徑，比 realpath 少很多次系統呼叫)。"""
+        current = self._symbol_dir(symbol)
+        try:
+            return os.path.join(self.directory, os.readlink(current))
+        except OSError:
+            return current
+
+    def _stored_rows(self, path):
+        """完整寫入的列數：各欄位檔案長度的最小值 (追加到一半中斷時多出來的部分不算)。"""
+        try:
+            return min(os.path.getsize(self._column_path(path, column)) // _DTYPES[column].itemsize
+                       for column in COLUMNS)
+        except FileNotFoundError:
+            return 0
+
+    def columns(self, symbol):
+        """
+        回傳 (列數, {欄位: 唯讀 memmap})；同一代的檔案只會往後追加，列數沒變就沿用上次的對應。
+        最多保留 max_open 檔股票的對應，被擠掉的那檔在沒有人使用它的區間後就會關閉檔案。
+        """
+        for _ in range(3):
+            path = self._data_dir(symbol)
+            rows = self._stored_rows(path)
+            with self._lock:
+                cached = self._maps.get(symbol)
+                if cached is not None and cached[:2] == (path, rows):
+                    self._maps.move_to_end(symbol)
+                    return rows, cached[2]
+            if rows == 0:
+                arrays = {column: np.empty(0, dtype=_DTYPES[column]) for column in COLUMNS}
+            else:
+                try:
+                    arrays = {column: np.memmap(self._column_path(path, column), dtype=_DTYPES[column],
+                                                mode='r', shape=(rows,)) for column in COLUMNS}
+                except FileNotFoundError:
+                    # 其他行程剛好切換到新的一代並刪掉舊檔案，重新解析捷徑
+                    continue
+            with self._lock:
+                self._maps[symbol] = (path, rows, arrays)
+                self._maps.move_to_end(symbol)
+                while len(self._maps) > self.max_open:
+                    self._maps.popitem(last=False)
+                    self.evictions += 1
+            return rows, arrays
+        return 0, {column: np.empty(0, dtype=_DTYPES[column]) for column in COLUMNS}
+
+    def _file_lock(self, symbol):
+        os.makedirs(self.directory, exist_ok=True)
+        lock_file = open(os.path.join(self.directory, f'{symbol}.lock'), 'w')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _write_columns(self, path, rows, values):
+        for column in COLUMNS:
+            with open(self._column_path(path, column), 'ab') as f:
+                # 上次追加到一半中斷時先切掉多出來的部分 (沒有人會對應到列數以外的範圍)
+                f.truncate(rows * _DTYPES[column].itemsize)
+                f.write(np.ascontiguousarray(values[column], dtype=_DTYPES[column]).tobytes())
+
+    def _replace(self, symbol, dates, prices):
+        """把完整的歷史寫成新的一代資料夾，再把 SYMBOL 捷徑原子地換過去；呼叫端要持有檔案鎖。"""
+        generation = os.path.join(self.directory, f'.{symbol}.{time.time_ns()}')
+        os.makedirs(generation)
+        self._write_columns(generation, 0, {'date': dates, **prices,
+                                            **compute_indicators(prices['close'], np.empty(0))})
+        current = self._symbol_dir(symbol)
+        previous = self._data_dir(symbol) if os.path.lexists(current) else None
+        if previous is not None and not os.path.islink(current):
+            # 舊版的一般資料夾要先搬開才能換成捷徑
+            previous = f'{generation}.old'
+            os.rename(current, previous)
+        link = f'{generation}.link'
+        os.symlink(os.path.basename(generation), link)
+        os.replace(link, current)
+        if previous is not None:
+            # 其他行程已經對應的舊檔案刪掉後仍然可以讀，直到它們發現捷徑換了
+            shutil.rmtree(previous, ignore_errors=True)
+        return len(dates)
+
+    def _append(self, symbol, dates, prices, rebuild=False):
+        """
+        在檔案鎖內把比已存資料新的 K 棒接到檔案尾端，回傳寫入的列數。
+        還沒有資料或 rebuild=True (過去的價格被回溯調整) 時改寫成新的一代。
+        """
+        with self._file_lock(symbol):
+            rows, arrays = self.columns(symbol)
+            if rebuild or not rows:
+                return self._replace(symbol, dates, prices) if len(dates) else 0
+            keep = dates > arrays['date'][-1]
+            dates, prices = dates[keep], {column: values[keep] for column, values in prices.items()}
+            if not len(dates):
+                return 0
+            indicators = compute_indicators(prices['close'], np.array(arrays['close'][-_LOOKBACK:]))
+            self._write_columns(self._data_dir(symbol), rows, {'date': dates, **prices, **indicators})
+            return len(dates)
+
+    # ---------- 更新 ----------
+    def _symbol_lock(self, symbol):
+        with self._lock:
+            return self._symbol_locks.setdefault(symbol, threading.Lock())
+
+    def refresh(self, symbol, force=False):
+        """
+        下載最後一根已存 K 棒之後的資料：今天之前的 K 棒追加到檔案，今天盤中的 K 棒放在記憶體。
+        距離上次檢查不到 refresh_interval 秒時不做任何事 (force=True 除外)。回傳追加的列數。
+        """
+        symbol = symbol.upper()
+        with self._symbol_lock(symbol):
+            checked = self._checked.get(symbol)
+            if not force and checked is not None and time.monotonic() - checked < self.refresh_interval:
+                return 0
+            rows, arrays = self.columns(symbol)
+            # 從最後一根已存的 K 棒開始下載 (重疊一根)，用來確認過去的價格沒有被回溯調整
+            start = arrays['date'][-1] if rows else None
+            with span('yfinance.history', symbol=symbol):
+                downloaded = self.fetch(symbol, start)
+            self.downloads += 1
+            self._checked[symbol] = time.monotonic()
+            if downloaded is None:
+                return 0
+            dates, prices = downloaded
+            rebuild = rows > 0 and _adjusted(arrays, dates, prices)
+            if rebuild:
+                logging.info(f"{symbol} 過去的價格已被調整 (例如股票分割)，重新下載完整歷史")
+                with span('yfinance.history', symbol=symbol, rebuild=True):
+                    downloaded = self.fetch(symbol, None)
+                self.downloads += 1
+                self.rebuilds += 1
+                if downloaded is None:
+                    return 0
+                dates, prices = downloaded
+            today = _eastern_today()
+            done = dates < today
+            appended = self._append(symbol, dates[done], {column: values[done] for column, values in prices.items()},
+                                    rebuild)
+            self.appended_bars += appended
+            self._live.pop(symbol, None)
+            if not done.all():
+                self._live[symbol] = self._live_bar(symbol, dates[-1], {c: v[-1] for c, v in prices.items()})
+            return appended
+
+    def _live_bar(self, symbol, day, price):
+        _, arrays = self.columns(symbol)
+        indicators = compute_indicators(np.array([price['close']]), np.array(arrays['close'][-_LOOKBACK:]))
+        return Bar(day, *(float(price[column]) for column in PRICE_COLUMNS),
+                   *(float(indicators[column][0]) for column in INDICATOR_COLUMNS))
+
+    # ---------- 查詢 ----------
+    def window(self, symbol, period='1mo', refresh=True):
+        """
+        回傳最近 period (yfinance 的寫法，例如 1mo / 3mo / 1y) 的 HistoryWindow；
+        完全沒有資料 (或代碼格式不對) 時回傳 None。區間是以今天 (美東) 往前推算，和 yfinance 的 period 相同。
+        """
+        symbol = symbol.upper()
+        if not _SYMBOL_PATTERN.match(symbol):
+            return None
+        if refresh:
+            self.refresh(symbol)
+        rows, arrays = self.columns(symbol)
+        live = self._live.get(symbol)
+        if rows == 0 and live is None:
+            return None
+        start = window_start(_eastern_today(), period)
+        first = 0 if start is None else int(np.searchsorted(arrays['date'], start))
+        self.windows += 1
+        return HistoryWindow(symbol, *(arrays[column][first:] for column in COLUMNS), live)
+
+    def stats(self):
+        return {'symbols': len(self._maps), 'evictions': self.evictions, 'downloads': self.downloads,
+                'appended_bars': self.appended_bars, 'rebuilds': self.rebuilds, 'windows': self.windows}
+
+
+# 全程式共用的歷史資料儲存區
+history_store = HistoryStore()
+
@@ -0,0 +1,511 @@
+# loadtest.py
+# /callback 壓力測試與延遲基準：把 LINE webhook 事件以指定的併發數打進 Flask app，
+# Finnhub / Yahoo / yfinance / Gemini / LINE 全部換成本機假服務 (可設定延遲)，
+# 最後依指令 (quote / chart / news / profile / favorites ...) 列出吞吐量與 p50 / p95 / p99。
+# 加上 --gunicorn-workers 時改成真的啟動 gunicorn (多個 worker 透過共用後端分享快取)，
+# 依序量測不同 worker 數的吞吐量，看是否隨 worker 數增加。
+#
+# 用法：
+#   python loadtest.py --requests 500 --concurrency 16
+#   python loadtest.py --payloads recorded.jsonl          # 重播錄下來的 webhook body (一行一個 JSON)
+#   python loadtest.py --finnhub-latency 0.2 --max-p95 3000   # p95 超過 3 秒就以非 0 結束，可放進 CI
+#   python loadtest.py --gunicorn-workers 1,2,4 --shared-state sqlite   # 多 worker 擴展性 (kv = 本機 Redis 替身)
+import os
+import sys
+import json
+import time
+import uuid
+import hmac
+import base64
+import random
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHANNEL_SECRET = 'loadtest-secret'
+METRICS_TOKEN = 'loadtest-metrics'
+
+DEFAULT_MIX = {
+    'quote': 50,
+    'favorites': 10,
+    'profile': 10,
+    'news': 10,
+    'chart': 5,
+    'hot': 5,
+    'gainers': 5,
+    'volume': 5,
+}
+SYMBOLS = ['AAPL', 'MSFT', 'NVDA', 'TSLA', 'AMZN', 'GOOGL', 'META', 'AMD', 'NFLX', 'INTC',
+           'JPM', 'KO', 'PEP', 'ORCL', 'CSCO', 'QCOM', 'ADBE', 'CRM', 'UBER', 'DIS']
+COMMAND_TEMPLATES = {
+    'quote': '{symbol}',
+    'favorites': '我的最愛',
+    'profile': '{symbol} profile',
+    'news': '{symbol} news',
+    'chart': '{symbol} chart',
+    'hot': '熱門股',
+    'gainers': '漲幅排名',
+    'volume': '熱門成交量',
+    'add': 'add {symbol}',
+    'help': '使用說明',
+}
+
+
+# =============================================================
+# 假服務
+# =============================================================
+def start_finnhub_stub(latency):
+    """在本機隨機 port 啟動假的 Finnhub API，回傳 base URL。"""
+
+    class FinnhubStubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            time.sleep(latency)
+            path = self.path.split('?')[0]
+            rng = random.Random(self.path)
+            if path.endswith('/quote'):
+                price = rng.uniform(10, 500)
+                body = {'c': price, 'd': rng.uniform(-5, 5), 'dp': rng.uniform(-3, 3),
+                        'h': price * 1.02, 'l': price * 0.98, 'o': price, 'pc': price}
+            elif path.endswith('/stock/metric'):
+                body = {'metric': {'peTTM': rng.uniform(5, 60), 'pbTTM': rng.uniform(1, 20),
+                                   'psTTM': rng.uniform(1, 30), 'dividendYieldIndicatedAnnual': rng.uniform(0, 4)}}
+            elif path.endswith('/company-news'):
+                body = [{'headline': f'Headline {k}', 'summary': 'Summary', 'url': f'https://example.com/{k}'}
+                        for k in rng.sample(range(8), 3)]
+            else:
+                body = {}
+            payload = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FinnhubStubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='finnhub-stub', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+class MessageRecorder:
+    """記錄每位使用者收到訊息的次數與最後一次的時間 (reply token 就是使用者 ID，見 make_event())。"""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.last_message_at = {}
+        self._lock = threading.Lock()
+
+    def record(self, user_id):
+        with self._lock:
+            self.counts[user_id] += 1
+            self.last_message_at[user_id] = time.perf_counter()
+
+
+class StubLineApi:
+    """同一個行程內取代 LineBotApi。"""
+
+    def __init__(self, latency, recorder):
+        self.latency = latency
+        self.recorder = recorder
+
+    def reply_message(self, reply_token, messages, *args, **kwargs):
+        time.sleep(self.latency)
+        self.recorder.record(reply_token)
+
+    def push_message(self, to, messages, *args, **kwargs):
+        time.sleep(self.latency)
+        self.recorder.record(to)
+
+
+def start_line_stub(latency, recorder):
+    """假的 LINE Messaging API (gunicorn worker 用真的 LineBotApi 打過來)，回傳 endpoint URL。"""
+
+    class LineStubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            time.sleep(latency)
+            recorder.record(body.get('replyToken') or body.get('to'))
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LineStubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='line-stub', daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def _synthetic_movers(latency):
+    import pandas as pd
+
+    def fetch():
+        time.sleep(latency)
+        rng = random.Random(0)
+        return pd.DataFrame({
+            'Symbol': SYMBOLS,
+            'Name': SYMBOLS,
+            'Price (Intraday)': [rng.uniform(5, 500) for _ in SYMBOLS],
+            '% Change': [rng.uniform(-10, 10) for _ in SYMBOLS],
+            'Volume': [rng.randint(100000, 50000000) for _ in SYMBOLS],
+        })
+    return fetch
+
+
+def _synthetic_history(latency):
+    """代替 yfinance 的日線下載 (history_store.fetch)，同一檔股票每次產生的數字都一樣。"""
+    from tests.fixtures import synthetic_download
+
+    download = synthetic_download()
+
+    def fetch(symbol, start=None):
+        time.sleep(latency)
+        return download(symbol, start)
+    return fetch
+
+
+def app_environment(args, workdir, finnhub_url, shared_state_url='memory://'):
+    """受測 app 的環境變數；延遲設定放在 LOADTEST_LATENCIES，gunicorn worker 也讀得到。"""
+    return {
+        'LINE_CHANNEL_SECRET': CHANNEL_SECRET,
+        'LINE_CHANNEL_ACCESS_TOKEN': 'loadtest-token',
+        'FINNHUB_API_KEY': 'loadtest-key',
+        'FINNHUB_API_URL': finnhub_url,
+        'FINNHUB_RATE_LIMIT': '1000000',
+        'FINNHUB_BURST': '100000',
+        'LLM_BACKEND': 'stub',
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'favorites.db')}",
+        'NEWS_SUMMARY_DB': os.path.join(workdir, 'news_summaries.db'),
+        'FUNDAMENTALS_DB': os.path.join(workdir, 'fundamentals.db'),
+        'CHART_DIR': os.path.join(workdir, 'charts'),
+        'HISTORY_DIR': os.path.join(workdir, 'history'),
+        'SHARED_STATE_URL': shared_state_url,
+        'SERVICE_PUBLIC_URL': 'http://loadtest.local',
+        'METRICS_TOKEN': METRICS_TOKEN,
+        # 壓測時一次摘要三則新聞，走批次摘要的路徑
+        'NEWS_TOP_N': '3',
+        'FUNDAMENTALS_PREFETCH': '0',
+        # 背景的價格提醒會送出額外的 push，干擾訊息計數
+        'ALERTS_ENABLED': '0',
+        'DB_SCHEMA_INIT': 'sync',
+        'WEBHOOK_WORKERS': str(args.workers),
+        'WEBHOOK_QUEUE_SIZE': str(max(100, args.requests)),
+        'LOADTEST_VERBOSE': '1' if args.verbose else '0',
+        'LOADTEST_LATENCIES': json.dumps({'yahoo': args.yahoo_latency, 'yfinance': args.yfinance_latency,
+                                          'gemini': args.gemini_latency}),
+    }
+
+
+def install_stubs(line_api):
+    """import main 並把 Yahoo / yfinance / Gemini / LINE 換成假的 (Finnhub 已經由 FINNHUB_API_URL 指向假伺服器)。"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    latencies = json.loads(os.environ['LOADTEST_LATENCIES'])
+
+    import main
+    import ai_utils
+    from market_movers import movers
+    from history_store import history_store
+
+    ai_utils.set_llm_backend(ai_utils.StubBackend(latency=latencies['gemini']))
+    movers.fetchers = {kind: _synthetic_movers(latencies['yahoo']) for kind in movers.fetchers}
+    history_store.fetch = _synthetic_history(latencies['yfinance'])
+    main.line_bot_api = line_api
+    if os.environ.get('LOADTEST_VERBOSE') != '1':
+        logging.getLogger().setLevel(logging.WARNING)
+    return main
+
+
+def stub_app():
+    """給 gunicorn 載入的 app：gunicorn 'loadtest:stub_app()'，LINE API 改打 LOADTEST_LINE_URL 的假伺服器。"""
+    from linebot import LineBotApi
+    return install_stubs(LineBotApi('loadtest-token', endpoint=os.environ['LOADTEST_LINE_URL'])).app
+
+
+# =============================================================
+# 事件產生與發送
+# =============================================================
+def make_event(text, user_id):
+    return {
+        'type': 'message',
+        'mode': 'active',
+        'timestamp': int(time.time() * 1000),
+        'source': {'type': 'user', 'userId': user_id},
+        # 用使用者 ID 當 reply token，MessageRecorder 才能把 reply 對應回事件
+        'replyToken': user_id,
+        'webhookEventId': uuid.uuid4().hex,
+        'deliveryContext': {'isRedelivery': False},
+        'message': {'type': 'text', 'id': uuid.uuid4().hex, 'text': text},
+    }
+
+
+def sign(body):
+    digest = hmac.new(CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+
+def synthetic_payloads(count, mix, seed=0):
+    """回傳 [(指令, webhook body)]，每個事件用不同的使用者 ID 以便追蹤完成時間。"""
+    rng = random.Random(seed)
+    commands, weights = zip(*mix.items())
+    payloads = []
+    for _ in range(count):
+        command = rng.choices(commands, weights)[0]
+        text = COMMAND_TEMPLATES[command].format(symbol=rng.choice(SYMBOLS))
+        event = make_event(text, f"U{uuid.uuid4().hex}")
+        payloads.append((command, json.dumps({'destination': 'Uloadtest', 'events': [event]})))
+    return payloads
+
+
+def recorded_payloads(path):
+    """讀取錄下來的 webhook body，每個事件換成唯一的使用者 ID 與最新的時間戳記。"""
+    from commands import route_message
+
+    payloads = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for event in json.loads(line).get('events', []):
+                text = event.get('message', {}).get('text')
+                if event.get('type') != 'message' or text is None:
+                    continue
+                fresh = make_event(text, f"U{uuid.uuid4().hex}")
+                payloads.append((route_message(text).command,
+                                 json.dumps({'destination': 'Uloadtest', 'events': [fresh]})))
+    return payloads
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def make_payloads(args):
+    if args.payloads:
+        return recorded_payloads(args.payloads)
+    mix = json.loads(args.mix) if args.mix else DEFAULT_MIX
+    return synthetic_payloads(args.requests, mix, args.seed)
+
+
+def seed_favorites(repo, payloads):
+    """預先幫查詢最愛的使用者加幾檔股票，讓 favorites 指令有資料可查。"""
+    for command, body in payloads:
+        if command == 'favorites':
+            user_id = json.loads(body)['events'][0]['source']['userId']
+            for symbol in random.Random(user_id).sample(SYMBOLS, 5):
+                repo.add(user_id, symbol)
+
+
+def send_all(payloads, concurrency, post_one):
+    """以 concurrency 條執行緒送出所有事件，回傳 (開始時間, {使用者: (指令, 送出時間)}, ack 延遲, HTTP 狀態統計)。"""
+    sent_at = {}
+    ack_latencies = []
+    status_counts = defaultdict(int)
+    lock = threading.Lock()
+
+    def post(item):
+        command, body = item
+        user_id = json.loads(body)['events'][0]['source']['userId']
+        start = time.perf_counter()
+        status = post_one(body, {'X-Line-Signature': sign(body), 'Content-Type': 'application/json'})
+        with lock:
+            sent_at[user_id] = (command, start)
+            ack_latencies.append(time.perf_counter() - start)
+            status_counts[status] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(post, payloads))
+    return started, sent_at, ack_latencies, status_counts
+
+
+def collect_latencies(sent_at, recorder):
+    latencies = defaultdict(list)
+    for user_id, (command, start) in sent_at.items():
+        finished = recorder.last_message_at.get(user_id)
+        if finished is not None:
+            latencies[command].append(finished - start)
+    return latencies
+
+
+def run(args):
+    """在同一個行程內用 Flask test client 壓測。"""
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    os.environ.update(app_environment(args, workdir, start_finnhub_stub(args.finnhub_latency)))
+    recorder = MessageRecorder()
+    main = install_stubs(StubLineApi(args.line_latency, recorder))
+    payloads = make_payloads(args)
+    seed_favorites(main.get_repository(), payloads)
+
+    local = threading.local()
+
+    def post_one(body, headers):
+        if not hasattr(local, 'client'):
+            local.client = main.app.test_client()
+        return local.client.post('/callback', data=body, headers=headers).status_code
+
+    started, sent_at, ack_latencies, status_counts = send_all(payloads, args.concurrency, post_one)
+    main.event_dispatcher.join()
+    elapsed = time.perf_counter() - started
+    latencies = collect_latencies(sent_at, recorder)
+    return elapsed, ack_latencies, latencies, status_counts, main.event_dispatcher.stats()
+
+
+# =============================================================
+# 多 worker 模式：真的啟動 gunicorn
+# =============================================================
+def _free_port():
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_workers(base_url, workers, timeout=60):
+    """等到每個 worker 都至少回應過一次 /metrics (用 pid 分辨)。"""
+    import requests
+
+    pids = set()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and len(pids) < workers:
+        try:
+            pids.add(requests.get(f"{base_url}/metrics", timeout=2,
+                                  headers={'Authorization': f"Bearer {METRICS_TOKEN}"}).json()['pid'])
+        except (requests.RequestException, ValueError, KeyError):
+            time.sleep(0.2)
+    return len(pids) >= workers
+
+
+def run_gunicorn(args, workers, finnhub_url, shared_state_url):
+    import requests
+    from favorites_repo import FavoritesRepository
+
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    if args.shared_state == 'sqlite':
+        shared_state_url = f"sqlite:///{os.path.join(workdir, 'shared_state.db')}"
+    recorder = MessageRecorder()
+    env = {**os.environ, **app_environment(args, workdir, finnhub_url, shared_state_url),
+           'LOADTEST_LINE_URL': start_line_stub(args.line_latency, recorder), 'GUNICORN_WORKERS': str(workers)}
+    payloads = make_payloads(args)
+    repo = FavoritesRepository(env['DATABASE_URL'])
+    repo.init_schema()
+    seed_favorites(repo, payloads)
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--threads', str(args.threads),
+         '--bind', f"127.0.0.1:{port}", '--log-level', 'warning', 'loadtest:stub_app()'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    try:
+        if not _wait_for_workers(base_url, workers):
+            raise RuntimeError(f"gunicorn ({workers} workers) 沒有在時間內啟動")
+        local = threading.local()
+
+        def post_one(body, headers):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            return local.session.post(f"{base_url}/callback", data=body.encode('utf-8'), headers=headers).status_code
+
+        started, sent_at, ack_latencies, status_counts = send_all(payloads, args.concurrency, post_one)
+        # 圖表指令會收到兩則訊息 (請稍候 + 圖片)，其他指令一則
+        expected = {user_id: 2 if command == 'chart' else 1 for user_id, (command, _) in sent_at.items()}
+        deadline = time.monotonic() + args.drain_timeout
+        while time.monotonic() < deadline and any(recorder.counts[user_id] < count for user_id, count in expected.items()):
+            time.sleep(0.05)
+        latencies = collect_latencies(sent_at, recorder)
+        elapsed = max(recorder.last_message_at.values(), default=started) - started
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return elapsed, ack_latencies, latencies, status_counts, {'gunicorn_workers': workers, 'threads': args.threads}
+
+
+def run_scaling(args):
+    finnhub_url = start_finnhub_stub(args.finnhub_latency)
+    shared_state_url = 'memory://'
+    if args.shared_state == 'kv':
+        from shared_state import LocalKVServer
+        shared_state_url = LocalKVServer().start().url
+    summary = []
+    for workers in [int(count) for count in args.gunicorn_workers.split(',')]:
+        print(f"\n===== gunicorn {workers} workers x {args.threads} threads，共用後端 {args.shared_state} =====")
+        result = run_gunicorn(args, workers, finnhub_url, shared_state_url)
+        worst_p95 = report(*result)
+        elapsed, _, latencies, _, _ = result
+        done = sorted(value for values in latencies.values() for value in values)
+        summary.append((workers, len(done) / elapsed if elapsed else 0.0,
+                        percentile(done, 50) * 1000, percentile(done, 95) * 1000, worst_p95))
+
+    print(f"\n{'workers':>8}{'事件/秒':>10}{'p50 ms':>10}{'p95 ms':>10}{'倍數':>8}")
+    base = summary[0][1] or 1.0
+    for workers, throughput, p50, p95, _ in summary:
+        print(f"{workers:>8}{throughput:>10.1f}{p50:>10.1f}{p95:>10.1f}{throughput / base:>8.2f}")
+    return max(worst for *_, worst in summary)
+
+
+def report(elapsed, ack_latencies, latencies, status_counts, dispatcher_stats):
+    total = sum(len(values) for values in latencies.values())
+    print(f"完成 {total} 個事件，耗時 {elapsed:.2f} 秒，吞吐量 {total / elapsed:.1f} 事件/秒")
+    print(f"HTTP 狀態: {dict(status_counts)}  佇列: {dispatcher_stats}")
+    print(f"{'指令':<12}{'數量':>8}{'事件/秒':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    rows = [('(webhook ack)', ack_latencies)] + sorted(latencies.items())
+    worst_p95 = 0.0
+    for command, values in rows:
+        values = sorted(values)
+        p50, p95, p99 = (percentile(values, p) * 1000 for p in (50, 95, 99))
+        if command != '(webhook ack)':
+            worst_p95 = max(worst_p95, p95)
+        print(f"{command:<12}{len(values):>8}{len(values) / elapsed:>10.1f}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}")
+    return worst_p95
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='/callback webhook 壓力測試')
+    parser.add_argument('--requests', type=int, default=300, help='合成事件數量')
+    parser.add_argument('--concurrency', type=int, default=8, help='同時送出 webhook 的執行緒數')
+    parser.add_argument('--workers', type=int, default=4, help='背景事件處理執行緒數 (WEBHOOK_WORKERS)')
+    parser.add_argument('--payloads', help='重播錄下來的 webhook body (JSON lines)')
+    parser.add_argument('--mix', help='指令比例，JSON 格式，例如 {"quote": 80, "chart": 20}')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--finnhub-latency', type=float, default=0.05)
+    parser.add_argument('--yahoo-latency', type=float, default=0.3)
+    parser.add_argument('--yfinance-latency', type=float, default=0.2)
+    parser.add_argument('--gemini-latency', type=float, default=0.8)
+    parser.add_argument('--line-latency', type=float, default=0.02)
+    parser.add_argument('--gunicorn-workers', help='以 gunicorn 多 worker 壓測，逗號分隔的 worker 數，例如 1,2,4')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn 每個 worker 的執行緒數')
+    parser.add_argument('--shared-state', choices=['memory', 'sqlite', 'kv'], default='sqlite',
+                        help='多 worker 模式的共用後端 (kv 為本機的 Redis 替身)')
+    parser.add_argument('--drain-timeout', type=float, default=120, help='送完後等待所有回覆的秒數上限')
+    parser.add_argument('--verbose', action='store_true', help='顯示 INFO 等級的日誌')
+    parser.add_argument('--max-p95', type=float, help='任一指令 p95 (毫秒) 超過此值時以狀態碼 1 結束')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    worst_p95 = run_scaling(args) if args.gunicorn_workers else report(*run(args))
+    if args.max_p95 is not None and worst_p95 > args.max_p95:
+        print(f"p95 {worst_p95:.1f} ms 超過上限 {args.max_p95:.1f} ms")
+        sys.exit(1)
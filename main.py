@@ -4,35 +4,44 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from flask import Flask, request, abort, send_from_directory
-import uuid
+from flask import Flask, request, abort, send_from_directory, jsonify
 import logging
 import sys
+import threading
 
 from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
+from linebot.exceptions import InvalidSignatureError, LineBotApiError
 from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage,
     QuickReply, QuickReplyButton, MessageAction,
     ImageSendMessage
 )
-import requests
 import os
+import hmac
 import datetime
-import psycopg2
 import time
-import pandas as pd
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import yfinance as yf
-from ai_utils import ask_gemini_for_news
-from yahoo_fin import stock_info as si
+from functools import lru_cache
+from ai_utils import summarize_news_batch, summary_cache
 
 # 匯入我們自己的模組
-from stock_lookup import get_stock_code 
+from stock_lookup import resolver, looks_like_ticker
+from commands import route_message, parse_alert
 from rank import get_top_gainers
 from vol import get_top_volume_stocks
+from market_movers import movers, format_age
+from quotes import (
+    Quote, QuoteNotFoundError, get_quote, get_quotes,
+    format_quote, format_quote_brief, format_quote_error
+)
+from favorites_repo import get_repository
+from finnhub_client import RateLimitError, finnhub
+from fundamentals_store import fundamentals_store
+from webhook_queue import EventDispatcher
+from chart_service import render_chart, chart_cache, CHART_MAX_AGE
+from chart_store import chart_store
+from quote_cache import quote_cache
+from tracing import trace, span, set_attribute, stage_metrics, pseudonym
+from shared_state import shared_state
 
 # 強制設定日誌記錄器
 logging.basicConfig(
@@ -48,9 +57,19 @@ logging.basicConfig(
 LINE_CHANNEL_ACCESS_TOKEN = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN')
 LINE_CHANNEL_SECRET = os.environ.get('LINE_CHANNEL_SECRET')
 FINNHUB_API_KEY = os.environ.get('FINNHUB_API_KEY')
-FINNHUB_API_URL = "https://finnhub.io/api/v1"
-DATABASE_URL = os.environ.get('DATABASE_URL')
 SERVICE_PUBLIC_URL = os.environ.get('SERVICE_PUBLIC_URL')
+# LINE 的 reply token 大約一分鐘內有效，保守一點超過這個秒數就直接改用 push
+REPLY_TOKEN_TTL = float(os.environ.get('REPLY_TOKEN_TTL', 50))
+FUNDAMENTALS_PREFETCH = os.environ.get('FUNDAMENTALS_PREFETCH', '1') == '1'
+# 建表方式：async (預設，啟動後在背景執行)、sync (啟動時等它完成)、skip (部署時已經跑過 python favorites_repo.py)
+DB_SCHEMA_INIT = os.environ.get('DB_SCHEMA_INIT', 'async')
+# 價格提醒：是否在背景定期掃描，以及每位使用者最多幾筆提醒
+ALERTS_ENABLED = os.environ.get('ALERTS_ENABLED', '1') == '1'
+ALERTS_MAX_PER_USER = int(os.environ.get('ALERTS_MAX_PER_USER', 20))
+# /metrics 需要帶 Authorization: Bearer <METRICS_TOKEN>；沒有設定時 /metrics 關閉 (回 404)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# 新聞指令摘要最新的幾則 (多則時一次送給 AI 批次摘要；每多一則 AI 的 token 用量也跟著增加)
+NEWS_TOP_N = int(os.environ.get('NEWS_TOP_N', 1))
 
 app = Flask(__name__)
 line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
@@ -59,65 +78,114 @@ handler = WebhookHandler(LINE_CHANNEL_SECRET)
 # =============================================================
 # 資料庫初始化
 # =============================================================
+# 資料表 (包含後來新增的 price_alerts) 確定存在後才設定；價格提醒引擎等它完成才開始掃描
+schema_ready = threading.Event()
+
 def init_db():
     try:
-        conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS favorites (
-                id SERIAL PRIMARY KEY,
-                user_id VARCHAR(255) NOT NULL,
-                stock_symbol VARCHAR(50) NOT NULL,
-                UNIQUE(user_id, stock_symbol)
-            );
-        ''')
-        conn.commit()
-        cursor.close()
-        conn.close()
+        favorites_repo = get_repository()
+        if favorites_repo is None:
+            logging.warning("尚未設定 DATABASE_URL，我的最愛功能將無法使用。")
+            return
+        favorites_repo.init_schema()
+        schema_ready.set()
     except Exception as e:
         logging.error(f"資料庫初始化失敗: {e}", exc_info=True)
 
-init_db()
+# 建表要連線到資料庫，不能卡住啟動；CREATE TABLE IF NOT EXISTS 重複執行也沒關係，
+# 舊的資料庫也是靠這一步補上新的資料表
+if DB_SCHEMA_INIT == 'sync':
+    init_db()
+elif DB_SCHEMA_INIT != 'skip':
+    threading.Thread(target=init_db, name='init-db', daemon=True).start()
+else:
+    schema_ready.set()
+
+def favorite_symbols():
+    favorites_repo = get_repository()
+    return favorites_repo.all_symbols() if favorites_repo else []
+
+# 收盤後在背景預先抓好所有最愛股票的基本面資料
+if FINNHUB_API_KEY and FUNDAMENTALS_PREFETCH:
+    fundamentals_store.start_refresher(favorite_symbols, shared=shared_state)
+
+# =============================================================
+# 價格提醒引擎
+# =============================================================
+alert_engine = None
+
+def _push_text(user_id, text):
+    line_bot_api.push_message(user_id, TextSendMessage(text=text))
+
+def _multicast_text(user_ids, text):
+    line_bot_api.multicast(user_ids, TextSendMessage(text=text))
+
+def start_alert_engine():
+    global alert_engine
+    try:
+        favorites_repo = get_repository()
+        if favorites_repo is None:
+            return
+        # 建表失敗時不啟動：init_db 已經記錄錯誤，每一輪掃描都失敗只會洗版
+        schema_ready.wait()
+        # alerts 會載入 numpy，放在背景執行緒引入，不拖慢啟動
+        from alerts import AlertEngine
+        alert_engine = AlertEngine(favorites_repo.all_alerts, favorites_repo.claim_alerts, favorites_repo.rearm_alerts,
+                                   _push_text, _multicast_text, shared=shared_state)
+        alert_engine.start()
+    except Exception as e:
+        logging.error(f"啟動價格提醒引擎失敗: {e}", exc_info=True)
+
+if FINNHUB_API_KEY and ALERTS_ENABLED:
+    threading.Thread(target=start_alert_engine, name='alerts-start', daemon=True).start()
 
 # =============================================================
 # 所有功能函式 (除了 rank 和 vol)
 # =============================================================
 def get_stock_price(symbol):
     if not FINNHUB_API_KEY: return "錯誤：尚未設定 Finnhub API Key。"
-    url = f"https://finnhub.io/api/v1/quote?symbol={symbol.upper()}&token={FINNHUB_API_KEY}"
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        if not data or data.get('c') == 0: return f"找不到股票代碼 '{symbol.upper()}' 的資料。"
-        current_price, price_change, percent_change = data.get('c', 0), data.get('d', 0), data.get('dp', 0)
-        high_price, low_price = data.get('h', 0), data.get('l', 0)
-        emoji = "📈" if (price_change is not None and price_change >= 0) else "📉"
-        return (f"{emoji} {symbol.upper()} 的即時股價資訊：\n"
-                f"--------------------------\n"
-                f"當前價格: ${current_price:,.2f}\n漲跌: ${price_change:,.2f}\n"
-                f"漲跌幅: {percent_change:.2f}%\n最高價: ${high_price:,.2f}\n"
-                f"最低價: ${low_price:,.2f}\n--------------------------")
+        return format_quote(get_quote(symbol))
+    except QuoteNotFoundError as e:
+        return format_quote_error(symbol, e)
     except Exception as e:
         logging.error(f"查詢股價時發生錯誤 for symbol {symbol}: {e}", exc_info=True)
-        return "查詢股價時發生錯誤。"
+        return format_quote_error(symbol, e)
+
+def get_stock_prices(symbols):
+    """
+    同時查詢多檔股票，回傳 ({代碼: 報價文字}, 略過的代碼)，順序與傳入的 symbols 相同。
+    整批期限內等不到 Finnhub 額度或沒查完的代碼放在略過清單，不佔用回覆的篇幅。
+    """
+    if not FINNHUB_API_KEY: return {symbol: "錯誤：尚未設定 Finnhub API Key。" for symbol in symbols}, []
+    price_infos, skipped = {}, []
+    for symbol, result in get_quotes(symbols).items():
+        if isinstance(result, (RateLimitError, TimeoutError)):
+            skipped.append(symbol)
+        else:
+            price_infos[symbol] = format_quote(result) if isinstance(result, Quote) else format_quote_error(symbol, result)
+    return price_infos, skipped
+
+def format_suggestions(symbols):
+    if not symbols: return ""
+    names = [f"{symbol} ({resolver.company_name(symbol)})" for symbol in symbols]
+    return "\n\n您是不是要找：\n" + "\n".join(names)
 
 def get_hot_stocks():
     try:
         reply_text = "🔥 --- 美股即時交易量 Top 10 --- 🔥"
-        most_active = si.get_day_most_active()
+        most_active, fetched_at = movers.get('most_active')
+        if most_active is None: return "抱歉，目前無法取得熱門股資料，請稍後再試。"
         top_10_symbols = most_active['Symbol'].head(10).tolist()
 
+        quotes = get_quotes(top_10_symbols) if FINNHUB_API_KEY else {}
         for symbol in top_10_symbols:
-            price_info = get_stock_price(symbol)
-            try:
-                lines = price_info.split('\n')
-                price_line = lines[2]
-                change_line = lines[4]
-                reply_text += f"\n- **{symbol}**: {price_line.split(':')[1].strip()} ({change_line.split(':')[1].strip()})"
-            except (IndexError, AttributeError):
+            quote = quotes.get(symbol)
+            if isinstance(quote, Quote):
+                reply_text += f"\n- **{symbol}**: {format_quote_brief(quote)}"
+            else:
                 reply_text += f"\n- **{symbol}**: (無法取得報價)"
-        
+        reply_text += f"\n\n{format_age(fetched_at)}"
         return reply_text.strip()
     except Exception as e:
         logging.error(f"獲取熱門股時發生錯誤: {e}", exc_info=True)
@@ -125,11 +193,8 @@ def get_hot_stocks():
 
 def get_company_profile(symbol):
     if not FINNHUB_API_KEY: return "錯誤：尚未設定 Finnhub API Key。"
-    url = f"https://finnhub.io/api/v1/stock/metric?symbol={symbol.upper()}&metric=valuation&token={FINNHUB_API_KEY}"
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = fundamentals_store.get(symbol)
         if not data or 'metric' not in data or not data['metric']: return f"找不到 {symbol.upper()} 的基本面資料。"
         metrics = data['metric']
         pe_ratio = metrics.get('peTTM', 0)
@@ -147,23 +212,19 @@ def get_company_profile(symbol):
 def get_company_news(symbol):
     if not FINNHUB_API_KEY: return "錯誤：尚未設定 Finnhub API Key。"
     today, one_week_ago = datetime.date.today(), datetime.date.today() - datetime.timedelta(days=7)
-    url = f"https://finnhub.io/api/v1/company-news?symbol={symbol.upper()}&from={one_week_ago.strftime('%Y-%m-%d')}&to={today.strftime('%Y-%m-%d')}&token={FINNHUB_API_KEY}"
+    params = {'symbol': symbol.upper(), 'from': one_week_ago.strftime('%Y-%m-%d'), 'to': today.strftime('%Y-%m-%d')}
     try:
-        response = requests.get(url, timeout=15)
-        response.raise_for_status()
-        news_list = response.json()
+        news_list = finnhub.get('/company-news', params, timeout=15)
         if not news_list: return f"找不到 {symbol.upper()} 在過去一週的相關新聞。"
-        
-        news_item = news_list[0]
-        headline = news_item.get('headline', '無標題')
-        summary = news_item.get('summary', '無摘要')
-        news_url = news_item.get('url', '#')
-
-        ai_response = ask_gemini_for_news(headline, summary)
-        reply_text = (f"📰 {symbol.upper()} 的 AI 智慧新聞摘要：\n\n"
-                      f"{ai_response}\n\n"
-                      f"🔗 原文連結：\n{news_url}")
-        
+
+        articles = [(item.get('headline', '無標題'), item.get('summary', '無摘要'), item.get('url', '#'))
+                    for item in news_list[:NEWS_TOP_N]]
+        # 最新的幾則一次送給 AI，已經摘要過的新聞直接用快取
+        ai_responses = summarize_news_batch(articles)
+        sections = [f"{ai_response}\n\n🔗 原文連結：\n{news_url}"
+                    for ai_response, (_, _, news_url) in zip(ai_responses, articles)]
+        reply_text = f"📰 {symbol.upper()} 的 AI 智慧新聞摘要：\n\n" + "\n\n".join(sections)
+
         return reply_text.strip()
     except Exception as e:
         logging.error(f"處理新聞資料時發生錯誤 for symbol {symbol}: {e}", exc_info=True)
@@ -171,56 +232,85 @@ def get_company_news(symbol):
 
 def add_to_favorites(user_id, stock_symbol):
     try:
-        conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO favorites (user_id, stock_symbol) VALUES (%s, %s)", (user_id, stock_symbol))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        favorites_repo = get_repository()
+        if favorites_repo is None: return "錯誤：尚未設定資料庫。"
+        if not favorites_repo.add(user_id, stock_symbol):
+            return f"{stock_symbol} 已經在您的最愛清單中了喔！ 😉"
         return f"已將 {stock_symbol} 加入您的最愛清單！ ❤️"
-    except psycopg2.IntegrityError:
-        conn.close()
-        return f"{stock_symbol} 已經在您的最愛清單中了喔！ 😉"
     except Exception as e:
         logging.error(f"新增最愛時發生錯誤 for user {user_id}, symbol {stock_symbol}: {e}", exc_info=True)
         return "新增最愛時發生錯誤。"
 
+ALERT_DESCRIPTIONS = {
+    'above': lambda threshold: f"漲破 ${threshold:,.2f}",
+    'below': lambda threshold: f"跌破 ${threshold:,.2f}",
+    'move': lambda threshold: f"當日漲跌超過 ±{threshold:g}%",
+}
+
+ALERT_USAGE = ("設定價格提醒的方式：\n"
+               "alert NVDA > 150 (漲破時通知)\n"
+               "alert NVDA < 120 (跌破時通知)\n"
+               "alert NVDA 5% (當日漲跌超過 5% 時通知)\n"
+               "輸入「我的提醒」查看，「unalert NVDA」取消。")
+
+def add_price_alert(user_id, stock_symbol, direction, threshold):
+    try:
+        favorites_repo = get_repository()
+        if favorites_repo is None: return "錯誤：尚未設定資料庫。"
+        if len(favorites_repo.list_alerts(user_id)) >= ALERTS_MAX_PER_USER:
+            return f"每人最多設定 {ALERTS_MAX_PER_USER} 筆提醒，請先用「unalert <代碼>」取消一些。"
+        if stock_symbol not in resolver.listings:
+            # 清單外的代碼先確認 Finnhub 查得到，打錯的代碼不會存進去、每輪佔用提醒引擎的報價額度
+            try:
+                get_quote(stock_symbol)
+            except QuoteNotFoundError:
+                return f"找不到 {stock_symbol} 的報價，無法設定提醒，請確認股票代碼。"
+        description = ALERT_DESCRIPTIONS[direction](threshold)
+        if not favorites_repo.add_alert(user_id, stock_symbol, direction, threshold):
+            return f"{stock_symbol} {description} 的提醒已經設定過了喔！ 😉"
+        # 有設定提醒的股票一併放進最愛清單，已經在清單中時 add 回傳 False，不影響結果
+        favorites_repo.add(user_id, stock_symbol)
+        return f"已設定提醒：{stock_symbol} {description} 時通知您！ 🔔"
+    except Exception as e:
+        logging.error(f"設定價格提醒時發生錯誤 for user {user_id}, symbol {stock_symbol}: {e}", exc_info=True)
+        return "設定價格提醒時發生錯誤。"
+
+def get_price_alerts(user_id):
+    try:
+        favorites_repo = get_repository()
+        if favorites_repo is None: return "錯誤：尚未設定資料庫。"
+        alerts = favorites_repo.list_alerts(user_id)
+        if not alerts:
+            return "您還沒有設定任何價格提醒。\n\n" + ALERT_USAGE
+        lines = [f"- {symbol} {ALERT_DESCRIPTIONS[direction](threshold)}" for symbol, direction, threshold in alerts]
+        return "--- 您的價格提醒 🔔 ---\n" + "\n".join(lines)
+    except Exception as e:
+        logging.error(f"獲取價格提醒時發生錯誤 for user {user_id}: {e}", exc_info=True)
+        return "獲取價格提醒時發生錯誤。"
+
+def remove_price_alerts(user_id, stock_symbol):
+    try:
+        favorites_repo = get_repository()
+        if favorites_repo is None: return "錯誤：尚未設定資料庫。"
+        removed = favorites_repo.remove_alerts(user_id, stock_symbol)
+        if not removed:
+            return f"您沒有設定 {stock_symbol} 的價格提醒。"
+        return f"已取消 {stock_symbol} 的 {removed} 筆價格提醒。"
+    except Exception as e:
+        logging.error(f"取消價格提醒時發生錯誤 for user {user_id}, symbol {stock_symbol}: {e}", exc_info=True)
+        return "取消價格提醒時發生錯誤。"
+
 def get_favorites(user_id):
     try:
-        conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-        cursor = conn.cursor()
-        cursor.execute("SELECT stock_symbol FROM favorites WHERE user_id = %s", (user_id,))
-        results = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        return [item[0] for item in results]
+        favorites_repo = get_repository()
+        if favorites_repo is None: return []
+        return favorites_repo.list(user_id)
     except Exception as e:
         logging.error(f"獲取最愛列表時發生錯誤 for user {user_id}: {e}", exc_info=True)
         return []
 
 def generate_stock_chart(symbol):
-    try:
-        ticker = yf.Ticker(symbol)
-        data = ticker.history(period='1mo')
-        if data.empty: return None
-        plt.style.use('dark_background')
-        fig, ax = plt.subplots(figsize=(12, 8))
-        ax.plot(data.index, data['Close'], color='lime', linewidth=2) 
-        ax.set_title(f'{symbol.upper()} - 30-Day Price Chart', fontsize=20, color='white')
-        ax.set_ylabel('Price (USD)', fontsize=14, color='white')
-        ax.tick_params(axis='x', colors='white', rotation=30)
-        ax.tick_params(axis='y', colors='white')
-        ax.grid(True, linestyle='--', alpha=0.5)
-        plt.tight_layout()
-        if not os.path.exists('tmp_charts'): os.makedirs('tmp_charts')
-        filename = f"{uuid.uuid4()}.png"
-        filepath = os.path.join('tmp_charts', filename)
-        plt.savefig(filepath, facecolor='#1E1E1E')
-        plt.close(fig)
-        return filename
-    except Exception as e:
-        logging.error(f"圖表生成失敗 for symbol {symbol}: {e}", exc_info=True)
-        return None
+    return render_chart(symbol)
 
 # =============================================================
 # Webhook 路由
@@ -230,108 +320,241 @@ def callback():
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
     try:
-        handler.handle(body, signature)
+        events = handler.parser.parse(body, signature)
     except InvalidSignatureError:
         abort(400)
+    # 驗證完簽章就丟進背景佇列並立刻回 200，避免慢的查詢卡住其他使用者。
+    # 一批事件全部放入或全部拒絕：回 503 時 LINE 會重送整批，不能有一部分已經在處理
+    if not event_dispatcher.submit_all([(_event_user_key(event), event) for event in events]):
+        abort(503)
     return 'OK'
 
 @app.route('/charts/<filename>')
 def serve_chart(filename):
-    return send_from_directory('tmp_charts', filename)
+    # 檔名是圖檔內容的雜湊值，同一個網址的內容永遠不會變，可以放心讓 LINE 與瀏覽器快取
+    # 圖可能是別的 worker / 機器畫的，本機沒有時先從共用後端取回
+    if not chart_store.ensure_local(filename):
+        abort(404)
+    chart_store.touch(filename)
+    response = send_from_directory(chart_store.directory, filename, max_age=CHART_MAX_AGE, etag=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def _history_stats():
+    # history_store 會載入 numpy，還沒畫過圖 (沒有載入過) 時不為了統計而載入
+    history_store = sys.modules.get('history_store')
+    return history_store.history_store.stats() if history_store else None
+
+@app.route('/metrics')
+def metrics():
+    # 各階段的延遲分布 (tracing) 加上各元件自己的計數器；多 worker 時每個 worker 各自統計。
+    # 內容包含使用者代碼與內部狀態，只提供給帶著 METRICS_TOKEN 的監控程式
+    if not METRICS_TOKEN:
+        abort(404)
+    authorization = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        abort(401)
+    favorites_repo = get_repository()
+    return jsonify({
+        'stages': stage_metrics.snapshot(),
+        'webhook_queue': event_dispatcher.stats(),
+        'quote_cache': quote_cache.stats(),
+        'chart_cache': chart_cache.stats(),
+        'chart_store': chart_store.stats(),
+        'history': _history_stats(),
+        'finnhub': finnhub.stats(),
+        'movers': movers.stats(),
+        'news_summaries': summary_cache.stats(),
+        'fundamentals': fundamentals_store.stats(),
+        'db_pool': favorites_repo.pool.stats() if favorites_repo else None,
+        'shared_state': shared_state.stats() if shared_state else None,
+        'alerts': alert_engine.stats() if alert_engine else None,
+        'pid': os.getpid(),
+    })
 
 # =============================================================
-# 核心訊息處理邏輯 (已整合 rank, vol 的 yahoo_fin 免費版)
+# 回覆範本 (啟動時建立一次，每則訊息直接重用)
 # =============================================================
-@handler.add(MessageEvent, message=TextMessage)
-def handle_message(event):
-    user_id = event.source.user_id
-    user_message_original = event.message.text
-    user_message = user_message_original.lower()
-    reply_object = None
-    
-    # 定義通用的快速回覆按鈕
-    common_quick_reply_buttons = QuickReply(items=[
+HELP_TEXT = ("請直接輸入您想查詢的美股公司名稱 (如：蘋果) 或代碼 (如: NVDA)，或點擊下方選單功能。\n"
+             "想在股價到價時收到通知，可以輸入「alert NVDA > 150」。")
+
+# 通用的快速回覆按鈕
+COMMON_QUICK_REPLY = QuickReply(items=[
+    QuickReplyButton(action=MessageAction(label="漲幅排名 🚀", text="漲幅排名")),
+    QuickReplyButton(action=MessageAction(label="熱門成交量 📈", text="熱門成交量")),
+    QuickReplyButton(action=MessageAction(label="我的最愛 ❤️", text="我的最愛")),
+    QuickReplyButton(action=MessageAction(label="使用說明 📝", text="使用說明"))
+])
+
+HELP_REPLY = TextSendMessage(text=HELP_TEXT, quick_reply=COMMON_QUICK_REPLY)
+
+@lru_cache(maxsize=1024)
+def symbol_quick_reply(stock_symbol):
+    """查到股價後附上的個股按鈕，同一檔股票只建立一次。"""
+    return QuickReply(items=[
+        QuickReplyButton(action=MessageAction(label="股價走勢圖 📈", text=f"{stock_symbol} chart")),
+        QuickReplyButton(action=MessageAction(label="基本面 📊", text=f"{stock_symbol} profile")),
+        QuickReplyButton(action=MessageAction(label="最新新聞 📰", text=f"{stock_symbol} news")),
+        QuickReplyButton(action=MessageAction(label="加入我的最愛 ❤️", text=f"add {stock_symbol}")),
         QuickReplyButton(action=MessageAction(label="漲幅排名 🚀", text="漲幅排名")),
         QuickReplyButton(action=MessageAction(label="熱門成交量 📈", text="熱門成交量")),
-        QuickReplyButton(action=MessageAction(label="我的最愛 ❤️", text="我的最愛")),
-        QuickReplyButton(action=MessageAction(label="使用說明 📝", text="使用說明"))
     ])
 
-    if user_message in ['使用說明', 'help', '查詢股價', 'stock', 'query']:
-        reply_text = "請直接輸入您想查詢的美股公司名稱 (如：蘋果) 或代碼 (如: NVDA)，或點擊下方選單功能。"
-        reply_object = TextSendMessage(text=reply_text, quick_reply=common_quick_reply_buttons)
-        
-    elif user_message in ['我的最愛', 'favorite', 'favorites']:
-        stock_list = get_favorites(user_id)
-        if not stock_list:
-            reply_text = "您的最愛清單是空的喔！快去新增吧！"
-        else:
-            reply_text = "--- 您的最愛清單 ✨ ---\n"
-            for symbol in stock_list:
-                reply_text += f"\n{get_stock_price(symbol)}\n"
-        reply_object = TextSendMessage(text=reply_text.strip(), quick_reply=common_quick_reply_buttons)
-        
-    elif user_message in ['熱門股', 'hot stocks', 'hot']:
-        reply_object = TextSendMessage(text=get_hot_stocks(), quick_reply=common_quick_reply_buttons)
-        
-    elif user_message in ['熱門成交量', 'volume']:
-        # 改為呼叫 vol.py 中使用 yahoo_fin 的函式，不再需要 API 金鑰
-        reply_text = get_top_volume_stocks()
-        reply_object = TextSendMessage(text=reply_text, quick_reply=common_quick_reply_buttons)
-        
-    elif user_message in ['漲幅排名', 'gainers']:
-        # 改為呼叫 rank.py 中使用 yahoo_fin 的函式，不再需要 API 金鑰
-        reply_text = get_top_gainers()
-        reply_object = TextSendMessage(text=reply_text, quick_reply=common_quick_reply_buttons)
-        
-    elif 'profile' in user_message:
-        stock_symbol = user_message.split(" ")[0].upper()
-        reply_object = TextSendMessage(text=get_company_profile(stock_symbol), quick_reply=common_quick_reply_buttons)
-        
-    elif 'news' in user_message:
-        stock_symbol = user_message.split(" ")[0].upper()
-        reply_object = TextSendMessage(text=get_company_news(stock_symbol), quick_reply=common_quick_reply_buttons)
-        
-    elif 'add ' in user_message:
-        stock_symbol = user_message.split(" ")[1].upper()
-        reply_object = TextSendMessage(text=add_to_favorites(user_id, stock_symbol), quick_reply=common_quick_reply_buttons)
-        
-    elif 'chart' in user_message:
-        stock_symbol = user_message.split(" ")[0].upper()
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"正在為您產生 {stock_symbol} 的股價走勢圖，請稍候..."))
-        filename = generate_stock_chart(stock_symbol)
-        if filename and SERVICE_PUBLIC_URL:
-            image_url = f"{SERVICE_PUBLIC_URL}/charts/{filename}"
-            line_bot_api.push_message(user_id, ImageSendMessage(original_content_url=image_url, preview_image_url=image_url))
-        else:
-            line_bot_api.push_message(user_id, TextSendMessage(text=f"抱歉，無法產生 {stock_symbol} 的圖表。"))
-        return
-        
+def _text_reply(text):
+    return TextSendMessage(text=text, quick_reply=COMMON_QUICK_REPLY)
+
+def _resolve_symbol(arg):
+    """指令參數可以是代碼或公司名稱 (如：蘋果 news)，對不到名稱時直接當成代碼。"""
+    return resolver.resolve(arg).symbol or arg.upper()
+
+# =============================================================
+# 核心訊息處理邏輯 (已整合 rank, vol 的 yahoo_fin 免費版)
+# =============================================================
+def reply_help(event, arg):
+    return HELP_REPLY
+
+def reply_favorites(event, arg):
+    stock_list = get_favorites(event.source.user_id)
+    if not stock_list:
+        reply_text = "您的最愛清單是空的喔！快去新增吧！"
     else:
-        stock_symbol = get_stock_code(user_message_original)
-        
-        if not stock_symbol:
-            stock_symbol = user_message_original.upper()
-        else:
-            logging.info(f"成功將 '{user_message_original}' 轉換為股票代碼 '{stock_symbol}'")
+        reply_text = "--- 您的最愛清單 ✨ ---\n"
+        price_infos, skipped = get_stock_prices(stock_list)
+        for symbol in stock_list:
+            if symbol in price_infos:
+                reply_text += f"\n{price_infos[symbol]}\n"
+        if skipped:
+            reply_text += (f"\n⏳ 查詢太頻繁，另外 {len(skipped)} 檔暫時略過：{', '.join(skipped)}\n"
+                           f"請稍後再輸入「我的最愛」查看。\n")
+    return _text_reply(reply_text.strip())
 
-        reply_text = get_stock_price(stock_symbol)
-        
-        if "找不到" in reply_text or "錯誤" in reply_text:
-            reply_object = TextSendMessage(text=reply_text, quick_reply=common_quick_reply_buttons)
-        else:
-            quick_reply_buttons = QuickReply(items=[
-                QuickReplyButton(action=MessageAction(label="股價走勢圖 📈", text=f"{stock_symbol} chart")),
-                QuickReplyButton(action=MessageAction(label="基本面 📊", text=f"{stock_symbol} profile")),
-                QuickReplyButton(action=MessageAction(label="最新新聞 📰", text=f"{stock_symbol} news")),
-                QuickReplyButton(action=MessageAction(label="加入我的最愛 ❤️", text=f"add {stock_symbol}")),
-                QuickReplyButton(action=MessageAction(label="漲幅排名 🚀", text="漲幅排名")),
-                QuickReplyButton(action=MessageAction(label="熱門成交量 📈", text="熱門成交量")),
-            ])
-            reply_object = TextSendMessage(text=reply_text, quick_reply=quick_reply_buttons)
+def reply_hot(event, arg):
+    return _text_reply(get_hot_stocks())
+
+def reply_volume(event, arg):
+    # 改為呼叫 vol.py 中使用 yahoo_fin 的函式，不再需要 API 金鑰
+    return _text_reply(get_top_volume_stocks())
+
+def reply_gainers(event, arg):
+    # 改為呼叫 rank.py 中使用 yahoo_fin 的函式，不再需要 API 金鑰
+    return _text_reply(get_top_gainers())
+
+def reply_profile(event, arg):
+    return _text_reply(get_company_profile(_resolve_symbol(arg)))
+
+def reply_news(event, arg):
+    return _text_reply(get_company_news(_resolve_symbol(arg)))
+
+def reply_add(event, arg):
+    return _text_reply(add_to_favorites(event.source.user_id, _resolve_symbol(arg)))
+
+def reply_alert(event, arg):
+    spec = parse_alert(arg)
+    if spec is None:
+        return _text_reply(ALERT_USAGE)
+    resolution = resolver.resolve(spec.target)
+    stock_symbol = resolution.symbol or (spec.target.upper() if looks_like_ticker(spec.target) else None)
+    if not stock_symbol:
+        reply_text = f"找不到「{spec.target}」對應的美股代碼。"
+        return _text_reply((reply_text + format_suggestions(resolution.alternatives)).strip())
+    return _text_reply(add_price_alert(event.source.user_id, stock_symbol, spec.direction, spec.threshold))
+
+def reply_alerts(event, arg):
+    return _text_reply(get_price_alerts(event.source.user_id))
+
+def reply_unalert(event, arg):
+    return _text_reply(remove_price_alerts(event.source.user_id, _resolve_symbol(arg)))
+
+def reply_chart(event, arg):
+    user_id = event.source.user_id
+    stock_symbol = _resolve_symbol(arg)
+    reply_or_push(event, TextSendMessage(text=f"正在為您產生 {stock_symbol} 的股價走勢圖，請稍候..."))
+    filename = generate_stock_chart(stock_symbol)
+    if filename and SERVICE_PUBLIC_URL:
+        image_url = f"{SERVICE_PUBLIC_URL}/charts/{filename}"
+        message = ImageSendMessage(original_content_url=image_url, preview_image_url=image_url)
+    else:
+        message = TextSendMessage(text=f"抱歉，無法產生 {stock_symbol} 的圖表。")
+    with span('line.push'):
+        line_bot_api.push_message(user_id, message)
+    return None
+
+def reply_quote(event, arg):
+    resolution = resolver.resolve(arg)
+    stock_symbol = resolution.symbol
     
+    if stock_symbol:
+        logging.info(f"成功將 '{arg}' 轉換為股票代碼 '{stock_symbol}'")
+    elif looks_like_ticker(arg):
+        # 清單沒有收錄所有美股，看起來像代碼的輸入仍然交給 Finnhub 查詢
+        stock_symbol = arg.upper()
+
+    if not stock_symbol:
+        # 明顯不是代碼也對不到公司名稱，不必浪費一次報價查詢
+        reply_text = f"找不到「{arg}」對應的美股代碼。"
+        return _text_reply((reply_text + format_suggestions(resolution.alternatives)).strip())
+
+    reply_text = get_stock_price(stock_symbol)
+    if "找不到" in reply_text or "錯誤" in reply_text:
+        return _text_reply((reply_text + format_suggestions(resolution.alternatives)).strip())
+    return TextSendMessage(text=reply_text, quick_reply=symbol_quick_reply(stock_symbol))
+
+# commands.route_message() 的指令名稱 -> 處理函式
+COMMAND_HANDLERS = {
+    'help': reply_help,
+    'favorites': reply_favorites,
+    'hot': reply_hot,
+    'volume': reply_volume,
+    'gainers': reply_gainers,
+    'profile': reply_profile,
+    'news': reply_news,
+    'add': reply_add,
+    'chart': reply_chart,
+    'alert': reply_alert,
+    'alerts': reply_alerts,
+    'unalert': reply_unalert,
+    'quote': reply_quote,
+}
+
+@handler.add(MessageEvent, message=TextMessage)
+def handle_message(event):
+    with span('route'):
+        route = route_message(event.message.text)
+    set_attribute('command', route.command)
+    with span(f'command.{route.command}'):
+        reply_object = COMMAND_HANDLERS[route.command](event, route.arg)
     if reply_object:
-        line_bot_api.reply_message(event.reply_token, messages=reply_object)
+        reply_or_push(event, reply_object)
+
+# =============================================================
+# 背景事件處理
+# =============================================================
+def _event_user_key(event):
+    source = getattr(event, 'source', None)
+    return getattr(source, 'user_id', None) or 'anonymous'
+
+def reply_or_push(event, messages):
+    """reply token 還在有效期內就用 reply_message，否則 (或 reply 失敗時) 改用 push_message。"""
+    event_age = time.time() - event.timestamp / 1000
+    if event_age < REPLY_TOKEN_TTL:
+        try:
+            with span('line.reply'):
+                line_bot_api.reply_message(event.reply_token, messages)
+            return
+        except LineBotApiError as e:
+            logging.warning(f"reply_message 失敗，改用 push_message: {e}")
+    with span('line.push'):
+        line_bot_api.push_message(event.source.user_id, messages)
+
+def dispatch_event(event):
+    if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
+        # 一個事件一個 trace；queue_ms 是從 LINE 送出事件到背景執行緒開始處理的時間，使用者只記代號
+        with trace('webhook.event', user=pseudonym(_event_user_key(event)),
+                   queue_ms=round(time.time() * 1000 - event.timestamp)):
+            handle_message(event)
+
+event_dispatcher = EventDispatcher(dispatch_event)
 
 # =============================================================
 # 程式的啟動點
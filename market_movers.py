@@ -0,0 +1,165 @@
+# market_movers.py
+# 市場排行快照：背景執行緒每隔固定秒數向 Yahoo 抓一次漲幅排行與成交量排行，
+# rank / vol / 熱門股 三個指令都直接讀這份快照，不再每次請求都去爬 Yahoo。
+# 抓取失敗時保留上一份資料繼續服務 (stale-while-revalidate)。
+# 有設定共用後端時，每一輪只有搶到租約的 worker 去抓 Yahoo，其他 worker 直接讀它存進共用後端的快照。
+import os
+import pickle
+import logging
+import threading
+import time
+
+from tracing import span
+from shared_state import shared_state
+
+MOVERS_REFRESH_INTERVAL = float(os.environ.get('MOVERS_REFRESH_INTERVAL', 120))
+
+
+def _fetch_gainers():
+    from yahoo_fin import stock_info as si
+    return si.get_day_gainers()
+
+
+def _fetch_most_active():
+    from yahoo_fin import stock_info as si
+    return si.get_day_most_active()
+
+
+FETCHERS = {
+    'gainers': _fetch_gainers,
+    'most_active': _fetch_most_active,
+}
+
+
+class MoversSnapshot:
+
+    def __init__(self, fetchers=FETCHERS, interval=MOVERS_REFRESH_INTERVAL, shared=None):
+        self.fetchers = fetchers
+        self.interval = interval
+        self.shared = shared
+        self._data = {}  # kind -> (DataFrame, fetched_at)
+        self._lock = threading.Lock()
+        self._refresh_locks = {kind: threading.Lock() for kind in fetchers}
+        self._refresher = None
+        self.refreshes = 0
+        self.failures = 0
+        self.shared_pulls = 0
+
+    def refresh(self, kind, wait=False):
+        """
+        重新抓取一種排行；同一種排行同時只會有一個抓取在跑。失敗時保留舊資料並回傳 False。
+        wait=True 用在還沒有任何資料時：若別的執行緒正在抓，就等它抓完直接沿用。
+        """
+        lock = self._refresh_locks[kind]
+        if not lock.acquire(blocking=wait):
+            return False
+        try:
+            if wait:
+                with self._lock:
+                    if kind in self._data:
+                        return True
+            with span(f'yahoo.{kind}'):
+                df = self.fetchers[kind]()
+            if df is None or df.empty:
+                raise ValueError(f"{kind} 回傳空的資料")
+            entry = (df, time.time())
+            with self._lock:
+                self._data[kind] = entry
+                self.refreshes += 1
+            if self.shared is not None:
+                self.shared.set(f"movers:{kind}", pickle.dumps(entry), self.interval * 10)
+            return True
+        except Exception as e:
+            with self._lock:
+                self.failures += 1
+            logging.error(f"更新市場排行 {kind} 時發生錯誤，繼續使用舊資料: {e}", exc_info=True)
+            return False
+        finally:
+            lock.release()
+
+    def pull_shared(self, kind):
+        """從共用後端取回其他 worker 抓好的快照；比本機的新才採用，有採用時回傳 True。"""
+        if self.shared is None:
+            return False
+        raw = self.shared.get(f"movers:{kind}")
+        if raw is None:
+            return False
+        df, fetched_at = pickle.loads(raw)
+        with self._lock:
+            current = self._data.get(kind)
+            if current is not None and current[1] >= fetched_at:
+                return False
+            self._data[kind] = (df, fetched_at)
+            self.shared_pulls += 1
+        return True
+
+    def refresh_all(self):
+        for kind in self.fetchers:
+            # 共用模式下每一輪只有一個 worker 搶得到租約去抓 Yahoo
+            if self.shared is None or self.shared.add(f"movers:lease:{kind}", str(os.getpid()).encode(),
+                                                      self.interval * 0.9):
+                self.refresh(kind)
+            else:
+                self.pull_shared(kind)
+
+    def _refresh_loop(self):
+        while True:
+            self.refresh_all()
+            time.sleep(self.interval)
+
+    def start(self):
+        """啟動背景更新執行緒 (第一次讀取時會自動呼叫)。"""
+        if self._refresher is not None:
+            return
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._refresh_loop, name='movers-refresher', daemon=True)
+                self._refresher.start()
+
+    def get(self, kind):
+        """
+        回傳 (DataFrame, fetched_at)。還沒有任何資料時會同步抓一次；
+        資料過舊 (背景更新落後) 時先回傳舊資料，再另開執行緒更新。
+        兩者都沒有時回傳 (None, None)。
+        """
+        self.start()
+        with self._lock:
+            entry = self._data.get(kind)
+        if entry is None or time.time() - entry[1] > self.interval:
+            # 背景更新這一輪可能是別的 worker 抓的
+            if self.pull_shared(kind):
+                with self._lock:
+                    entry = self._data.get(kind)
+        if entry is None:
+            self.refresh(kind, wait=True)
+            with self._lock:
+                entry = self._data.get(kind)
+            if entry is None:
+                return None, None
+        elif time.time() - entry[1] > self.interval * 2:
+            threading.Thread(target=self.refresh, args=(kind,), daemon=True).start()
+        return entry
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+                'shared_pulls': self.shared_pulls,
+                'age_seconds': {kind: round(now - fetched_at, 1) for kind, (_, fetched_at) in self._data.items()},
+            }
+
+
+def format_age(fetched_at):
+    """把資料時間轉成「🕒 資料更新於 N 分鐘前」這類提示文字。"""
+    age = max(0, time.time() - fetched_at)
+    if age < 60:
+        return "🕒 資料剛剛更新"
+    if age < 3600:
+        return f"🕒 資料更新於 {int(age // 60)} 分鐘前"
+    return f"🕒 資料更新於 {int(age // 3600)} 小時前"
+
+
+# 全程式共用的排行快照
+movers = MoversSnapshot(shared=shared_state)
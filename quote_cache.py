@@ -0,0 +1,149 @@
+# quote_cache.py
+# 報價快取：依股票代碼快取 Finnhub 報價，帶有 TTL、LRU 容量上限，
+# 並把同一代碼同時間的多個查詢合併成一次上游呼叫 (single-flight)。
+# 有設定共用後端 (shared_state) 時，本機未命中會先查其他 worker 是否已經查過。
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from shared_state import shared_state
+
+QUOTE_CACHE_TTL = float(os.environ.get('QUOTE_CACHE_TTL', 15))
+QUOTE_CACHE_MAXSIZE = int(os.environ.get('QUOTE_CACHE_MAXSIZE', 512))
+
+
+class _InFlight:
+    """正在向上游查詢中的請求，讓其他執行緒等待同一個結果。"""
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    執行緒安全的 TTL + LRU 快取。
+    get_or_load() 在快取未命中時呼叫 loader(key)，同一個 key 同時只會有一個 loader 在跑。
+    loader 丟出的例外不會被快取，會原封不動傳給所有等待中的呼叫者。
+    shared 為共用後端時，本機快取是第一層、共用後端是第二層，namespace 用來區分不同快取的 key。
+    """
+
+    def __init__(self, ttl=QUOTE_CACHE_TTL, maxsize=QUOTE_CACHE_MAXSIZE, shared=None, namespace=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.shared = shared
+        self.namespace = namespace
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.shared_hits = 0
+
+    def get(self, key):
+        """只查快取，不觸發上游查詢；未命中或過期時回傳 None。"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            pending = self._inflight.get(key)
+            if pending is not None:
+                self.coalesced += 1
+                is_leader = False
+            else:
+                pending = _InFlight()
+                self._inflight[key] = pending
+                self.misses += 1
+                is_leader = True
+
+        if not is_leader:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            value, ttl = self._load(key, loader)
+        except Exception as e:
+            pending.error = e
+            raise
+        else:
+            pending.value = value
+            self.set(key, value, ttl)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            pending.event.set()
+
+    def _shared_key(self, key):
+        return f"{self.namespace}:{key!r}"
+
+    def _load(self, key, loader):
+        """回傳 (value, 剩餘秒數)：先查共用後端，都沒有才呼叫 loader，並把結果寫回共用後端。"""
+        if self.shared is None:
+            return loader(key), self.ttl
+        raw = self.shared.get(self._shared_key(key))
+        if raw is not None:
+            expires_at, value = pickle.loads(raw)
+            remaining = expires_at - time.time()
+            if remaining > 0:
+                with self._lock:
+                    self.shared_hits += 1
+                # 本機只保留到共用資料原本的到期時間，避免資料被延長成兩倍 TTL
+                return value, remaining
+        value = loader(key)
+        self.shared.set(self._shared_key(key), pickle.dumps((time.time() + self.ttl, value)), self.ttl)
+        return value, self.ttl
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete(self._shared_key(key))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """回傳命中/未命中/合併次數等計數，方便確認快取是否有效。"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'shared_hits': self.shared_hits,
+                'size': len(self._data),
+                'ttl': self.ttl,
+                'maxsize': self.maxsize,
+            }
+
+
+# 全程式共用的報價快取
+quote_cache = TTLCache(shared=shared_state, namespace='quote')
@@ -0,0 +1,107 @@
+# quotes.py
+# 報價資料層：向 Finnhub 取得即時報價並轉成精簡的 Quote 紀錄，
+# 快取、批次查詢與排名都直接使用數字，文字格式由下方的 format_* 負責。
+import os
+import time
+import logging
+from functools import partial
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from quote_cache import quote_cache
+from finnhub_client import RateLimitError, finnhub
+from tracing import bind
+
+QUOTE_REQUEST_TIMEOUT = float(os.environ.get('QUOTE_REQUEST_TIMEOUT', 5))
+QUOTE_BATCH_DEADLINE = float(os.environ.get('QUOTE_BATCH_DEADLINE', 8))
+QUOTE_BATCH_WORKERS = int(os.environ.get('QUOTE_BATCH_WORKERS', 8))
+
+# namedtuple 本身沒有 __dict__，每筆報價只佔一個 tuple 的空間
+Quote = namedtuple('Quote', ['symbol', 'price', 'change', 'pct', 'high', 'low'])
+
+
+class QuoteNotFoundError(LookupError):
+    """Finnhub 沒有這個代碼的報價 (回傳的價格為 0)。"""
+
+
+_quote_executor = ThreadPoolExecutor(max_workers=QUOTE_BATCH_WORKERS, thread_name_prefix='quote')
+
+
+def parse_quote(symbol, data):
+    """把 Finnhub /quote 的 JSON 轉成 Quote；查無資料時回傳 None。"""
+    if not data or not data.get('c'):
+        return None
+    return Quote(symbol, float(data['c']), float(data.get('d') or 0), float(data.get('dp') or 0),
+                 float(data.get('h') or 0), float(data.get('l') or 0))
+
+
+def _fetch_quote(symbol, background=False, deadline=None):
+    """向 Finnhub 查詢單一代碼，由報價快取在未命中時呼叫。查無資料的結果 (None) 也會被快取。"""
+    return parse_quote(symbol, finnhub.get('/quote', {'symbol': symbol}, timeout=QUOTE_REQUEST_TIMEOUT,
+                                           background=background, deadline=deadline))
+
+
+def get_quote(symbol, background=False, deadline=None):
+    """
+    回傳 Quote；查無資料時丟出 QuoteNotFoundError，上游錯誤則原樣丟出。background=True 時使用背景工作的額度。
+    deadline (time.monotonic()) 之前等不到 Finnhub 額度時丟出 RateLimitError。
+    """
+    symbol = symbol.upper()
+    quote = quote_cache.get_or_load(symbol, partial(_fetch_quote, background=background, deadline=deadline))
+    if quote is None:
+        raise QuoteNotFoundError(symbol)
+    return quote
+
+
+def get_quotes(symbols, deadline=QUOTE_BATCH_DEADLINE, executor=None, background=False):
+    """
+    同時查詢多檔股票，回傳 {代碼: Quote 或 Exception}，順序與傳入的 symbols 相同。
+    每檔最多等 QUOTE_REQUEST_TIMEOUT 秒，整批最多等 deadline 秒；
+    失敗的代碼對應到它的例外 (逾時為 TimeoutError，期限內等不到 Finnhub 額度為 RateLimitError)，其他代碼照常回傳。
+    背景工作傳入自己的 executor 並設定 background=True，不佔用使用者查詢的執行緒與 Finnhub 額度。
+    """
+    ordered = list(dict.fromkeys(symbols))
+    executor = executor or _quote_executor
+    # 每個查詢等額度的時間都不超過整批的期限，額度不夠時後面的代碼直接放棄，不會卡住執行緒
+    batch_deadline = time.monotonic() + deadline
+    futures = {symbol: executor.submit(bind(get_quote), symbol, background, batch_deadline) for symbol in ordered}
+    done, _ = wait(futures.values(), timeout=deadline)
+    results = {}
+    for symbol in ordered:
+        future = futures[symbol]
+        if future in done:
+            error = future.exception()
+            if error is not None and not isinstance(error, (QuoteNotFoundError, RateLimitError)):
+                logging.error(f"查詢股價時發生錯誤 for symbol {symbol}: {error}", exc_info=error)
+            results[symbol] = error if error is not None else future.result()
+        else:
+            future.cancel()
+            logging.warning(f"批次查詢股價逾時 for symbol {symbol}")
+            results[symbol] = TimeoutError(symbol)
+    return results
+
+
+# =============================================================
+# 文字呈現
+# =============================================================
+def format_quote(quote):
+    emoji = "📈" if quote.change >= 0 else "📉"
+    return (f"{emoji} {quote.symbol} 的即時股價資訊：\n"
+            f"--------------------------\n"
+            f"當前價格: ${quote.price:,.2f}\n漲跌: ${quote.change:,.2f}\n"
+            f"漲跌幅: {quote.pct:.2f}%\n最高價: ${quote.high:,.2f}\n"
+            f"最低價: ${quote.low:,.2f}\n--------------------------")
+
+
+def format_quote_brief(quote):
+    return f"${quote.price:,.2f} ({quote.pct:.2f}%)"
+
+
+def format_quote_error(symbol, error):
+    if isinstance(error, QuoteNotFoundError):
+        return f"找不到股票代碼 '{symbol.upper()}' 的資料。"
+    if isinstance(error, TimeoutError):
+        return "查詢股價逾時，請稍後再試。"
+    if isinstance(error, RateLimitError):
+        return "查詢太頻繁，請稍後再試。"
+    return "查詢股價時發生錯誤。"
@@ -1,37 +1,35 @@
 # rank.py (新版 - 使用 yahoo_fin)
+import os
 import logging
-from yahoo_fin import stock_info as si
-import pandas as pd
+from market_movers import movers, format_age
+
+# 篩選掉股價低於 $2 且成交量小於 500k 的股票，讓排名更有參考價值
+GAINERS_MIN_PRICE = float(os.environ.get('GAINERS_MIN_PRICE', 2))
+GAINERS_MIN_VOLUME = float(os.environ.get('GAINERS_MIN_VOLUME', 500000))
+GAINERS_TOP_N = int(os.environ.get('GAINERS_TOP_N', 5))
+# 空字串代表沿用 Yahoo 原本的排序
+GAINERS_SORT_BY = os.environ.get('GAINERS_SORT_BY') or None
 
 def get_top_gainers() -> str:
     """
     使用 yahoo_fin 獲取當日漲幅最大的股票排名 (免費)。
     """
+    # ranking 會載入 pandas / numpy，等第一次查排行時才引入，不拖慢啟動
+    from ranking import rank_movers, render_gainers
     try:
-        # get_day_gainers() 會回傳一個 pandas DataFrame
-        gainers_df = si.get_day_gainers()
+        # 從背景更新的排行快照取得 get_day_gainers() 的 DataFrame
+        gainers_df, fetched_at = movers.get('gainers')
         
         # 檢查 DataFrame 是否為空
-        if gainers_df.empty:
+        if gainers_df is None or gainers_df.empty:
             return "抱歉，目前無法從 Yahoo Finance 取得漲幅排名資料。"
 
-        # 篩選掉股價低於 $2 且成交量小於 500k 的股票，讓排名更有參考價值
-        gainers_df = gainers_df[gainers_df['Price (Intraday)'] > 2]
-        gainers_df = gainers_df[gainers_df['Volume'] > 500000]
-
-        # 取前 5 名
-        top_5_gainers = gainers_df.head(5)
+        top_gainers = rank_movers(gainers_df, top_n=GAINERS_TOP_N, sort_by=GAINERS_SORT_BY,
+                                  min_price=GAINERS_MIN_PRICE, min_volume=GAINERS_MIN_VOLUME)
 
         reply_text = "🚀 **熱門漲幅排名 (via Yahoo)** 🚀\n\n"
-        for index, row in top_5_gainers.iterrows():
-            symbol = row.get('Symbol', 'N/A')
-            price = row.get('Price (Intraday)', 0)
-            change_percent = row.get('% Change', 0)
-            
-            reply_text += f"▪️ **{symbol}**\n"
-            reply_text += f"   - 價格：${price:.2f}\n"
-            reply_text += f"   - 漲幅：+{change_percent:.2f}%\n\n"
-            
+        reply_text += render_gainers(top_gainers)
+        reply_text += format_age(fetched_at)
         return reply_text.strip()
 
     except Exception as e:
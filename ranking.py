@@ -0,0 +1,72 @@
+# ranking.py
+# 排行計算：rank.py 與 vol.py 共用的篩選、排序與輸出格式。
+# 只取需要的欄位、一開始就轉成數值型態，所有條件合成一個布林遮罩一次篩完，
+# 輸出時直接走訪欄位陣列，不使用 iterrows。
+import numpy as np
+import pandas as pd
+
+SYMBOL = 'Symbol'
+PRICE = 'Price (Intraday)'
+CHANGE = '% Change'
+VOLUME = 'Volume'
+
+_NUMERIC_COLUMNS = (PRICE, CHANGE, VOLUME)
+_SUFFIX_MULTIPLIERS = {'K': 1e3, 'M': 1e6, 'B': 1e9, 'T': 1e12}
+
+
+def _to_numeric(series):
+    """把 '1.2M'、'+3.45%'、'1,234' 這類文字轉成數字，無法轉換的變成 NaN。"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64')
+    text = series.astype(str).str.strip().str.replace(r'[,%+]', '', regex=True)
+    suffix = text.str[-1].str.upper()
+    multiplier = suffix.map(_SUFFIX_MULTIPLIERS).fillna(1.0)
+    number = pd.to_numeric(text.where(~suffix.isin(_SUFFIX_MULTIPLIERS.keys()), text.str[:-1]), errors='coerce')
+    return number * multiplier
+
+
+def prepare_movers(df):
+    """只保留排行需要的四個欄位並轉好型態；缺少的欄位以 'N/A' 或 0 補上。"""
+    prepared = pd.DataFrame(index=df.index)
+    prepared[SYMBOL] = df[SYMBOL].astype(str) if SYMBOL in df else 'N/A'
+    for column in _NUMERIC_COLUMNS:
+        prepared[column] = _to_numeric(df[column]).fillna(0.0) if column in df else 0.0
+    return prepared
+
+
+def rank_movers(df, top_n=10, sort_by=None, ascending=False, min_price=None, min_volume=None):
+    """
+    篩選並排序排行資料。
+    min_price / min_volume 為嚴格大於的門檻；sort_by 為 None 時保留 Yahoo 原本的順序。
+    """
+    prepared = prepare_movers(df)
+    mask = np.ones(len(prepared), dtype=bool)
+    if min_price is not None:
+        mask &= prepared[PRICE].to_numpy() > min_price
+    if min_volume is not None:
+        mask &= prepared[VOLUME].to_numpy() > min_volume
+    ranked = prepared[mask]
+    if sort_by is not None:
+        ranked = ranked.nsmallest(top_n, sort_by) if ascending else ranked.nlargest(top_n, sort_by)
+    return ranked.head(top_n)
+
+
+def render_gainers(ranked):
+    return "".join(
+        f"▪️ **{symbol}**\n"
+        f"   - 價格：${price:.2f}\n"
+        f"   - 漲幅：+{change:.2f}%\n\n"
+        for symbol, price, change in zip(ranked[SYMBOL].to_numpy(), ranked[PRICE].to_numpy(), ranked[CHANGE].to_numpy()))
+
+
+def render_volume(ranked):
+    changes = ranked[CHANGE].to_numpy()
+    emojis = np.where(changes >= 0, "🔼", "🔽")
+    volumes = ranked[VOLUME].to_numpy() / 1000000  # 轉換為百萬股
+    return "".join(
+        f"▪️ **{symbol}** {emoji}\n"
+        f"   - 價格：${price:.2f}\n"
+        f"   - 漲跌：{change:.2f}%\n"
+        f"   - 成交量：{volume:.1f} 百萬股\n\n"
+        for symbol, emoji, price, change, volume
+        in zip(ranked[SYMBOL].to_numpy(), emojis, ranked[PRICE].to_numpy(), changes, volumes))
@@ -0,0 +1,281 @@
+# shared_state.py
+# 多個 gunicorn worker / 多台機器共用的快取後端，由 SHARED_STATE_URL 決定：
+#   memory://             (預設) 不共用，各行程只用自己記憶體中的快取 (單一 worker 時的行為)
+#   sqlite:///路徑         同一台機器的 worker 共用一個 SQLite 檔 (WAL + mmap)
+#   redis://host:port/0   多台機器共用 Redis (需要 redis 套件)；測試與壓測可用 LocalKVServer 代替
+# 報價、排行快照、新聞摘要、圖表快取與圖檔內容都透過這裡共用。
+# 快取的值以 pickle 儲存，後端只能放在自己信任的環境中。
+# 共用後端故障時只記錄警告並當作未命中，各 worker 退回自己的記憶體快取繼續服務。
+import os
+import time
+import sqlite3
+import logging
+import threading
+import socketserver
+
+SHARED_STATE_URL = os.environ.get('SHARED_STATE_URL', 'memory://')
+SHARED_STATE_PREFIX = os.environ.get('SHARED_STATE_PREFIX', 'line-stock-bot:')
+SHARED_STATE_TIMEOUT = float(os.environ.get('SHARED_STATE_TIMEOUT', 0.5))
+# SQLite 後端用 mmap 讀取的大小上限
+SHARED_STATE_MMAP_SIZE = int(os.environ.get('SHARED_STATE_MMAP_SIZE', 256 * 1024 * 1024))
+
+# 每寫入這麼多次清一次 SQLite 中過期的資料
+_PURGE_EVERY = 500
+
+
+class SharedState:
+    """共用後端的共同介面：值一律是 bytes，ttl 單位為秒。子類別實作 _get / _set / _add / _delete。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    def _failed(self, action, key, error):
+        with self._lock:
+            self.errors += 1
+        logging.warning(f"共用快取 {action} {key} 失敗，改用本機快取: {error}")
+
+    def get(self, key):
+        try:
+            value = self._get(key)
+        except Exception as e:
+            self._failed('讀取', key, e)
+            return None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value, ttl):
+        try:
+            self._set(key, value, ttl)
+        except Exception as e:
+            self._failed('寫入', key, e)
+            return
+        with self._lock:
+            self.writes += 1
+
+    def add(self, key, value, ttl):
+        """只有在 key 不存在 (或已過期) 時才寫入並回傳 True，可當作跨 worker 的簡單鎖。"""
+        try:
+            return self._add(key, value, ttl)
+        except Exception as e:
+            self._failed('寫入', key, e)
+            return False
+
+    def delete(self, key):
+        try:
+            self._delete(key)
+        except Exception as e:
+            self._failed('刪除', key, e)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': type(self).__name__, 'hits': self.hits, 'misses': self.misses,
+                    'writes': self.writes, 'errors': self.errors}
+
+
+class SQLiteBackend(SharedState):
+    """單機多 worker：每條執行緒各自開連線 (fork 之後重新連線)，WAL 模式下讀寫互不阻塞。"""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._writes_since_purge = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=SHARED_STATE_TIMEOUT * 10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA mmap_size={SHARED_STATE_MMAP_SIZE}')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS shared_state (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def _get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM shared_state WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def _set(self, key, value, ttl):
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                     (key, value, time.time() + ttl))
+        self._maybe_purge(conn)
+
+    def _add(self, key, value, ttl):
+        now = time.time()
+        cursor = self._connection().execute(
+            "INSERT INTO shared_state (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+            "WHERE shared_state.expires_at <= ?", (key, value, now + ttl, now))
+        return cursor.rowcount == 1
+
+    def _delete(self, key):
+        self._connection().execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    def _maybe_purge(self, conn):
+        with self._lock:
+            self._writes_since_purge += 1
+            if self._writes_since_purge < _PURGE_EVERY:
+                return
+            self._writes_since_purge = 0
+        conn.execute("DELETE FROM shared_state WHERE expires_at <= ?", (time.time(),))
+
+
+class RedisBackend(SharedState):
+    """多台機器共用 Redis (或相容的服務)；redis-py 的連線池本身就會在 fork 後重建連線。"""
+
+    def __init__(self, url, prefix=SHARED_STATE_PREFIX):
+        super().__init__()
+        import redis
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url, socket_timeout=SHARED_STATE_TIMEOUT,
+                                           socket_connect_timeout=SHARED_STATE_TIMEOUT)
+
+    def _get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def _set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, px=max(1, int(ttl * 1000)))
+
+    def _add(self, key, value, ttl):
+        return bool(self.client.set(self.prefix + key, value, px=max(1, int(ttl * 1000)), nx=True))
+
+    def _delete(self, key):
+        self.client.delete(self.prefix + key)
+
+
+def open_backend(url):
+    """依網址建立共用後端；memory:// (或空字串) 回傳 None，代表不共用。"""
+    if not url or url.startswith('memory://'):
+        return None
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    raise ValueError(f"不支援的 SHARED_STATE_URL: {url}")
+
+
+# 全程式共用的共用快取後端 (memory:// 時為 None)
+shared_state = open_backend(SHARED_STATE_URL)
+
+
+# =============================================================
+# 本機替身：只實作 Redis 協定中用得到的指令 (GET / SET EX PX NX / DEL / PING / HELLO)，
+# 測試與壓測時用來代替真正的 Redis，不要用在正式環境。
+# =============================================================
+class _KVError(Exception):
+    pass
+
+
+class _KVRequestHandler(socketserver.StreamRequestHandler):
+    protocol = 2
+
+    def _read_command(self):
+        header = self.rfile.readline()
+        if not header:
+            return None
+        if not header.startswith(b'*'):
+            return header.split()
+        args = []
+        for _ in range(int(header[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def _encode(self, value):
+        if value is None:
+            return b'_\r\n' if self.protocol == 3 else b'$-1\r\n'
+        if isinstance(value, _KVError):
+            return b'-ERR %s\r\n' % str(value).encode('utf-8')
+        if isinstance(value, str):
+            return b'+%s\r\n' % value.encode('utf-8')
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, dict):
+            prefix = b'%' if self.protocol == 3 else b'*'
+            count = len(value) if self.protocol == 3 else len(value) * 2
+            return prefix + b'%d\r\n' % count + b''.join(
+                self._encode(k) + self._encode(v) for k, v in value.items())
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def handle(self):
+        while True:
+            args = self._read_command()
+            if not args:
+                return
+            if args[0].upper() == b'HELLO':
+                # redis-py 新版預設以 RESP3 連線
+                self.protocol = int(args[1]) if len(args) > 1 else self.protocol
+                reply = {b'server': b'local-kv', b'proto': self.protocol}
+            else:
+                reply = self.server.execute(args)
+            self.wfile.write(self._encode(reply))
+
+
+class LocalKVServer(socketserver.ThreadingTCPServer):
+    """在本機啟動一個相容 Redis 協定的小型 KV 伺服器，url 屬性可直接給 RedisBackend 使用。"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0):
+        super().__init__((host, port), _KVRequestHandler)
+        self._data = {}  # key -> (value, expires_at 或 None)
+        self._data_lock = threading.Lock()
+        self.url = f"redis://{host}:{self.server_address[1]}/0"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='local-kv', daemon=True).start()
+        return self
+
+    def _live(self, key, now):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def execute(self, args):
+        """執行一個指令，回傳 None / bytes / str (簡單字串) / int / _KVError，由連線端編碼。"""
+        command = args[0].upper()
+        now = time.time()
+        with self._data_lock:
+            if command == b'GET':
+                entry = self._live(args[1], now)
+                return entry[0] if entry else None
+            if command == b'SET':
+                key, value, options = args[1], args[2], [arg.upper() for arg in args[3:]]
+                expires_at = None
+                if b'EX' in options:
+                    expires_at = now + int(options[options.index(b'EX') + 1])
+                elif b'PX' in options:
+                    expires_at = now + int(options[options.index(b'PX') + 1]) / 1000
+                if b'NX' in options and self._live(key, now) is not None:
+                    return None
+                self._data[key] = (value, expires_at)
+                return 'OK'
+            if command == b'DEL':
+                return sum(1 for key in args[1:] if self._data.pop(key, None) is not None)
+            if command == b'PING':
+                return 'PONG'
+            if command == b'FLUSHDB':
+                self._data.clear()
+                return 'OK'
+            if command in (b'CLIENT', b'SELECT'):
+                return 'OK'
+        return _KVError(f"unknown command {command.decode('utf-8', 'replace')}")
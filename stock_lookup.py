@@ -1,45 +1,157 @@
 # stock_lookup.py
 
 # 這是一個專門用來存放和查詢股票代號的模組
+# 啟動時從 data/us_listings.csv 載入美股清單 (代碼、英文名稱、中英文別名)，預先建好三種索引：
+#   1. 完全比對：忽略大小寫後的代碼 / 名稱 / 別名 -> 代碼 (dict，O(1))
+#   2. 前綴比對：排序好的名稱列表，用二分搜尋找出以輸入開頭的名稱
+#   3. 模糊比對：名稱的三字元組 (trigram) 倒排索引，處理打錯字
+import os
+import re
+import csv
+import bisect
+from collections import namedtuple, defaultdict
+
+LISTINGS_PATH = os.environ.get('STOCK_LISTINGS_PATH',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'us_listings.csv'))
+
+# 模糊比對分數 (Jaccard 相似度) 達到這個門檻才直接採用，低於門檻只列為候選
+FUZZY_ACCEPT_SCORE = 0.5
+FUZZY_SUGGEST_SCORE = 0.3
+
+Listing = namedtuple('Listing', ['symbol', 'name', 'aliases'])
+Resolution = namedtuple('Resolution', ['symbol', 'score', 'alternatives'])
+
+# 看起來像美股代碼：1-5 個英文字母，可帶 .A / -B 這類股別
+_TICKER_RE = re.compile(r'^[A-Za-z]{1,5}([.\-][A-Za-z]{1,2})?$')
+# 公司名稱常見的後綴，建索引時多加一個去掉後綴的版本
+_NAME_SUFFIX_RE = re.compile(r'[\s,]+(inc|corp|corporation|company|co|ltd|plc|group|holdings?|n\.?v|s\.?a)\.?$')
+
+
+def _normalize(text):
+    return ' '.join(text.casefold().replace('’', "'").split())
+
+
+def _strip_suffixes(name):
+    key = _normalize(name)
+    if key.startswith('the '):
+        key = key[4:]
+    while True:
+        stripped = _NAME_SUFFIX_RE.sub('', key)
+        if stripped == key:
+            return key
+        key = stripped
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def looks_like_ticker(text):
+    return bool(_TICKER_RE.match(text.strip()))
+
+
+class SymbolResolver:
+
+    def __init__(self, listings):
+        self.listings = {listing.symbol: listing for listing in listings}
+        self._exact = {}
+        names = {}
+        for listing in listings:
+            keys = [listing.name, *listing.aliases]
+            for key in keys:
+                for variant in (_normalize(key), _strip_suffixes(key)):
+                    if variant:
+                        self._exact.setdefault(variant, listing.symbol)
+                        names.setdefault(variant, listing.symbol)
+        # 代碼本身優先於其他公司的名稱
+        for listing in listings:
+            self._exact[_normalize(listing.symbol)] = listing.symbol
+
+        self._prefix_keys = sorted(names)
+        self._prefix_symbols = [names[key] for key in self._prefix_keys]
+        self._trigram_index = defaultdict(list)
+        self._trigram_counts = []
+        self._trigram_symbols = []
+        for key in self._prefix_keys:
+            grams = _trigrams(key)
+            entry_id = len(self._trigram_symbols)
+            self._trigram_symbols.append(names[key])
+            self._trigram_counts.append(len(grams))
+            for gram in grams:
+                self._trigram_index[gram].append(entry_id)
+
+    @classmethod
+    def from_csv(cls, path=LISTINGS_PATH):
+        with open(path, encoding='utf-8', newline='') as f:
+            rows = csv.DictReader(line for line in f if not line.startswith('#'))
+            listings = [Listing(row['symbol'], row['name'], [alias for alias in row['aliases'].split('|') if alias])
+                        for row in rows]
+        return cls(listings)
+
+    def _prefix_matches(self, key, limit):
+        start = bisect.bisect_left(self._prefix_keys, key)
+        matches = []
+        for i in range(start, len(self._prefix_keys)):
+            if not self._prefix_keys[i].startswith(key):
+                break
+            symbol = self._prefix_symbols[i]
+            if symbol not in matches:
+                matches.append(symbol)
+                if len(matches) >= limit:
+                    break
+        return matches
+
+    def _fuzzy_matches(self, key, limit):
+        grams = _trigrams(key)
+        shared = defaultdict(int)
+        for gram in grams:
+            for entry_id in self._trigram_index.get(gram, ()):
+                shared[entry_id] += 1
+        scored = {}
+        for entry_id, count in shared.items():
+            score = count / (len(grams) + self._trigram_counts[entry_id] - count)
+            symbol = self._trigram_symbols[entry_id]
+            if score >= FUZZY_SUGGEST_SCORE and score > scored.get(symbol, 0):
+                scored[symbol] = score
+        return sorted(scored.items(), key=lambda item: -item[1])[:limit]
+
+    def resolve(self, text, limit=5):
+        """
+        回傳 Resolution(symbol, score, alternatives)。
+        symbol 為最佳且足夠可信的代碼 (完全比對、唯一前綴或高分模糊比對)，否則為 None；
+        alternatives 是其他可能的代碼，可以拿來提示使用者。
+        """
+        key = _normalize(text)
+        if not key:
+            return Resolution(None, 0.0, [])
+        symbol = self._exact.get(key)
+        if symbol is not None:
+            return Resolution(symbol, 1.0, [])
+
+        prefixed = self._prefix_matches(key, limit + 1)
+        if len(prefixed) == 1 and not looks_like_ticker(text):
+            return Resolution(prefixed[0], 0.9, [])
+        if prefixed:
+            return Resolution(None, 0.0, prefixed[:limit])
+
+        fuzzy = self._fuzzy_matches(key, limit + 1)
+        if fuzzy and fuzzy[0][1] >= FUZZY_ACCEPT_SCORE and not looks_like_ticker(text):
+            return Resolution(fuzzy[0][0], fuzzy[0][1], [symbol for symbol, _ in fuzzy[1:limit + 1]])
+        return Resolution(None, 0.0, [symbol for symbol, _ in fuzzy[:limit]])
+
+    def company_name(self, symbol):
+        listing = self.listings.get(symbol)
+        return listing.name if listing else None
+
+
+resolver = SymbolResolver.from_csv()
 
-stock_dict = {
-    "Apple": "AAPL", "蘋果": "AAPL",
-    "Microsoft": "MSFT", "微軟": "MSFT",
-    "Amazon": "AMZN", "亞馬遜": "AMZN",
-    "Alphabet": "GOOGL", "谷歌": "GOOGL",
-    "Meta": "META", "臉書": "META",
-    "Tesla": "TSLA", "特斯拉": "TSLA",
-    "NVIDIA": "NVDA", "輝達": "NVDA",
-    "Netflix": "NFLX", "網飛": "NFLX",
-    "Intel": "INTC", "英特爾": "INTC",
-    "AMD": "AMD", "超微": "AMD",
-    "Qualcomm": "QCOM", "高通": "QCOM",
-    "Adobe": "ADBE", "奧多比": "ADBE",
-    "Oracle": "ORCL", "甲骨文": "ORCL",
-    "Cisco": "CSCO", "思科": "CSCO",
-    "IBM": "IBM", "國際商業機器": "IBM",
-    "PayPal": "PYPL", "貝寶": "PYPL",
-    "Visa": "V", "維薩": "V",
-    "Mastercard": "MA", "萬事達": "MA",
-    "JP Morgan": "JPM", "摩根大通": "JPM",
-    "Goldman Sachs": "GS", "高盛": "GS",
-    "Bank of America": "BAC", "美國銀行": "BAC",
-    "Coca-Cola": "KO", "可口可樂": "KO",
-    "PepsiCo": "PEP", "百事可樂": "PEP"
-}
 
 def get_stock_code(name: str):
     """
-    根據公司名稱（英文或中文），回傳對應的股票代號。
-    忽略大小寫進行比對。
+    根據公司名稱（英文或中文）或代碼，回傳對應的股票代號。
+    忽略大小寫進行比對，也接受名稱開頭或些微打錯的名稱。
     如果找不到，則回傳 None。
     """
-    # 遍歷字典中的每一個鍵 (公司名稱)
-    for key in stock_dict:
-        # 將輸入的名稱和字典中的鍵都轉成小寫來比對
-        if key.lower() == name.lower():
-            # 如果找到符合的，回傳對應的股票代號
-            return stock_dict[key]
-    
-    # 如果整個字典都找完了還是沒有，回傳 None
-    return None
\ No newline at end of file
+    return resolver.resolve(name).symbol
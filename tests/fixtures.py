@@ -0,0 +1,113 @@
+# 測試、效能量測 (bench/) 與壓力測試 (loadtest.py) 共用的假資料，全部不連網、每次產生的數字都一樣
+import numpy as np
+import pandas as pd
+
+from alerts import DIRECTIONS, ABOVE, BELOW, AlertEngine
+from history_store import _eastern_today
+from quotes import Quote
+from ranking import SYMBOL, PRICE, CHANGE, VOLUME
+
+
+# =============================================================
+# 漲幅榜 (ranking)
+# =============================================================
+def synthetic_movers(rows=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        SYMBOL: [f"SYM{i}" for i in range(rows)],
+        'Name': [f"Company {i}" for i in range(rows)],
+        PRICE: rng.uniform(0.5, 500, rows),
+        'Change': rng.normal(0, 3, rows),
+        CHANGE: rng.normal(0, 8, rows),
+        VOLUME: rng.integers(10000, 50000000, rows),
+        'Avg Vol (3 month)': rng.integers(10000, 50000000, rows),
+        'Market Cap': rng.uniform(1e7, 1e12, rows),
+        'PE Ratio (TTM)': rng.uniform(1, 80, rows),
+    })
+
+
+def legacy_gainers(gainers_df, top_n):
+    """舊版 rank.py 的寫法，只用來比較速度與輸出。"""
+    gainers_df = gainers_df[gainers_df[PRICE] > 2]
+    gainers_df = gainers_df[gainers_df[VOLUME] > 500000]
+    reply_text = ""
+    for index, row in gainers_df.head(top_n).iterrows():
+        reply_text += f"▪️ **{row.get(SYMBOL, 'N/A')}**\n"
+        reply_text += f"   - 價格：${row.get(PRICE, 0):.2f}\n"
+        reply_text += f"   - 漲幅：+{row.get(CHANGE, 0):.2f}%\n\n"
+    return reply_text
+
+
+# =============================================================
+# 價格提醒 (alerts)
+# =============================================================
+class SyntheticMarket:
+    """假的提醒資料與報價：rows 是資料庫裡的提醒，state 是寫回的觸發狀態，moves 是各股漲跌幅 (%)。"""
+
+    def __init__(self, users=100000, symbols=10000, alerts_per_user=3, seed=7):
+        self.rng = np.random.default_rng(seed)
+        rng = self.rng
+        self.names = [f"S{k:05d}" for k in range(symbols)]
+        self.base = rng.uniform(5, 500, symbols)
+        count = users * alerts_per_user
+        self.symbol_of = rng.integers(0, symbols, count)
+        directions = rng.integers(0, len(DIRECTIONS), count)
+        base = self.base[self.symbol_of]
+        thresholds = np.where(directions == ABOVE, base * rng.uniform(1.0, 1.1, count),
+                              np.where(directions == BELOW, base * rng.uniform(0.9, 1.0, count),
+                                       rng.uniform(1, 10, count).round(1)))
+        self.rows = [(i, f"U{i // alerts_per_user:06d}", self.names[self.symbol_of[i]], DIRECTIONS[directions[i]],
+                      float(thresholds[i]), False) for i in range(count)]
+        self.state = {}
+        self.moves = rng.normal(0, 4, symbols)
+        self.calls = {'push': 0, 'multicast': 0, 'recipients': 0}
+
+    def fetch_quotes(self, batch, deadline=None):
+        lookup = {name: k for k, name in enumerate(self.names)}
+        quotes = {}
+        for symbol in batch:
+            k = lookup[symbol]
+            quotes[symbol] = Quote(symbol, self.base[k] * (1 + self.moves[k] / 100), 0.0, self.moves[k], 0.0, 0.0)
+        return quotes
+
+    def load_rows(self):
+        return [row[:5] + (self.state.get(row[0], False),) for row in self.rows]
+
+    def claim(self, ids):
+        claimed = [alert_id for alert_id in ids if not self.state.get(alert_id, False)]
+        self.state.update((alert_id, True) for alert_id in claimed)
+        return claimed
+
+    def rearm(self, ids):
+        self.state.update((alert_id, False) for alert_id in ids)
+
+    def push(self, user_id, text):
+        self.calls['push'] += 1
+        self.calls['recipients'] += 1
+
+    def multicast(self, user_ids, text):
+        self.calls['multicast'] += 1
+        self.calls['recipients'] += len(user_ids)
+
+    def engine(self):
+        return AlertEngine(self.load_rows, self.claim, self.rearm, self.push, self.multicast,
+                           fetch_quotes=self.fetch_quotes, cached_quote=lambda symbol: None,
+                           quote_budget=len(self.names), push_rate=1e9)
+
+
+# =============================================================
+# 日線歷史 (history_store)
+# =============================================================
+def synthetic_download(days=520, seed=3):
+    """產生到今天為止 days 天的假日線 (跳過週末)，同一檔股票每次產生的數字都一樣。"""
+    def fetch(symbol, start=None):
+        today = _eastern_today()
+        dates = np.arange(today - np.timedelta64(days, 'D'), today + np.timedelta64(1, 'D'))
+        dates = dates[np.is_busday(dates)]
+        rng = np.random.default_rng([seed, sum(symbol.encode())])
+        closes = 100 * np.cumprod(1 + rng.normal(0, 0.02, len(dates)))
+        prices = {'open': closes * 0.99, 'high': closes * 1.01, 'low': closes * 0.98, 'close': closes,
+                  'volume': rng.integers(1e5, 1e7, len(dates)).astype(np.float64)}
+        keep = dates >= start if start is not None else np.ones(len(dates), dtype=bool)
+        return dates[keep], {column: values[keep] for column, values in prices.items()}
+    return fetch
@@ -0,0 +1,40 @@
+# 新聞摘要的測試：多則新聞合併成一次 AI 呼叫、已摘要過的直接用快取、舊摘要會被清掉
+import time
+
+import pytest
+
+import ai_utils
+from ai_utils import StubBackend, SummaryCache, summarize_news_batch
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(ai_utils, 'summary_cache', SummaryCache(str(tmp_path / 'news.db')))
+    backend = StubBackend()
+    monkeypatch.setattr(ai_utils, '_backend', backend)
+    return backend
+
+
+ARTICLES = [(f'Headline {k}', 'Summary', f'https://example.com/{k}') for k in range(3)]
+
+
+def test_batch_is_one_call_then_cached(backend):
+    results = summarize_news_batch(ARTICLES)
+    assert backend.calls == 1
+    assert [result.splitlines()[1] for result in results] == [headline for headline, _, _ in ARTICLES]
+    assert summarize_news_batch(ARTICLES) == results
+    assert backend.calls == 1
+
+
+def test_only_uncached_articles_are_sent(backend):
+    summarize_news_batch(ARTICLES[:1])
+    summarize_news_batch(ARTICLES)
+    assert backend.calls == 2
+
+
+def test_prune_removes_old_summaries(tmp_path):
+    cache = SummaryCache(str(tmp_path / 'news.db'))
+    cache.set('new', 'fresh')
+    cache._connection().execute("INSERT INTO news_summaries VALUES ('old', 'stale', ?)", (time.time() - 30 * 86400,))
+    assert cache.prune(max_age_days=14) == 1
+    assert cache.get('old') is None and cache.get('new') == 'fresh'
@@ -0,0 +1,112 @@
+# 價格提醒的測試：向量化判斷要和逐筆判斷一致，同樣的價格不重複通知，價格回穩後重新啟用
+import math
+
+import numpy as np
+
+from alerts import ALERTS_MAX_STALENESS, ALERTS_TARGET_SYMBOLS, AlertIndex, batch_notifications
+from tests.fixtures import SyntheticMarket
+
+
+def test_evaluate_matches_per_alert_loop():
+    market = SyntheticMarket(users=2000, symbols=300)
+    index = AlertIndex(market.load_rows())
+    prices, pcts = market.engine()._price_arrays(index.symbols)
+    fire, _ = index.evaluate(prices, pcts)
+    lookup = {s: k for k, s in enumerate(index.symbols)}
+    position = {int(alert_id): k for k, alert_id in enumerate(index.ids)}
+    for alert_id, _, symbol, direction, threshold, _ in market.rows:
+        price, pct = prices[lookup[symbol]], pcts[lookup[symbol]]
+        expected = {'above': price >= threshold, 'below': price <= threshold, 'move': abs(pct) >= threshold}[direction]
+        assert fire[position[alert_id]] == expected
+    assert len(index.users_for(market.names[0])) == int((market.symbol_of == 0).sum())
+    assert index.users_for('NOPE') == []
+
+
+def test_missing_quotes_never_fire():
+    index = AlertIndex([(1, 'U1', 'AAA', 'above', 10.0, False), (2, 'U1', 'BBB', 'move', 1.0, False)])
+    fire, rearm = index.evaluate(np.array([np.nan, np.nan]), np.array([np.nan, np.nan]))
+    assert not fire.any() and not rearm.any()
+
+
+def test_no_duplicate_notifications_and_rearm():
+    market = SyntheticMarket(users=2000, symbols=300)
+    engine = market.engine()
+    assert engine.tick() > 0
+    sent = dict(market.calls)
+    assert engine.tick() == 0, "同樣的價格不應該重複通知"
+    assert market.calls == sent
+    market.moves[:] = 0
+    engine.tick()
+    assert any(not triggered for triggered in market.state.values())
+    market.moves[:] = market.rng.normal(0, 4, len(market.names))
+    assert engine.tick() > 0
+
+
+def test_overlapping_ticks_notify_once():
+    # 租約過期時兩個行程可能讀到同一份「尚未觸發」的資料，只有標記成功的那一個會通知
+    market = SyntheticMarket(users=2000, symbols=300)
+    stale_rows = market.load_rows()
+    late = market.engine()
+    late.load_rows = lambda: stale_rows
+    assert market.engine().tick() > 0
+    sent = dict(market.calls)
+    assert late.tick() == 0
+    assert market.calls == sent
+
+
+def test_batch_notifications_groups_identical_text():
+    notifications = {f"U{i}": 'same' for i in range(1203)}
+    notifications['solo'] = 'other'
+    batches = batch_notifications(notifications, limit=500)
+    assert sorted(len(users) for users, text in batches if text == 'same') == [203, 500, 500]
+    assert (['solo'], 'other') in batches
+
+
+def test_quote_budget_rotates_through_symbols():
+    # 額度只夠每輪查 40 檔時，300 檔股票要在幾輪內全部檢查過，不能永遠只查排序在前面的
+    market = SyntheticMarket(users=2000, symbols=300)
+    fetched = []
+
+    def fetch_quotes(batch, deadline=None):
+        fetched.append(list(batch))
+        return market.fetch_quotes(batch, deadline)
+
+    engine = market.engine()
+    engine.fetch_quotes, engine.quote_budget = fetch_quotes, 40
+    engine.tick()
+    assert engine.stats()['unevaluated'] == len(AlertIndex(market.load_rows()).symbols) - 40
+    for _ in range(7):
+        engine.tick()
+    assert all(len(batch) == 40 for batch in fetched)
+    assert len({symbol for batch in fetched for symbol in batch}) == 300
+
+
+def test_full_cycle_at_target_symbol_count():
+    # 額度剛好符合設計目標時，目標數量的股票 (都不在快取裡) 要在 ALERTS_MAX_STALENESS 內全部檢查過一次
+    market = SyntheticMarket(users=ALERTS_TARGET_SYMBOLS, symbols=ALERTS_TARGET_SYMBOLS, alerts_per_user=1)
+    seen = set()
+
+    def fetch_quotes(batch, deadline=None):
+        seen.update(batch)
+        return market.fetch_quotes(batch, deadline)
+
+    engine = market.engine()
+    engine.fetch_quotes = fetch_quotes
+    engine.quote_budget = math.ceil(ALERTS_TARGET_SYMBOLS * engine.interval / ALERTS_MAX_STALENESS)
+    symbols = len(AlertIndex(market.load_rows()).symbols)
+    ticks = 0
+    while len(seen) < symbols:
+        engine.tick()
+        ticks += 1
+    assert ticks * engine.interval == engine.stats()['worst_case_staleness']
+    assert ticks * engine.interval <= engine.worst_case_staleness(ALERTS_TARGET_SYMBOLS) <= ALERTS_MAX_STALENESS
+
+
+def test_cached_quotes_do_not_use_the_budget():
+    market = SyntheticMarket(users=200, symbols=20)
+    cached = market.fetch_quotes(market.names)
+    engine = market.engine()
+    engine.cached_quote, engine.quote_budget = cached.get, 1
+    engine.fetch_quotes = lambda batch, deadline=None: {}
+    engine.tick()
+    assert engine.stats()['unevaluated'] == 0
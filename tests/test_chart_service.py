@@ -0,0 +1,63 @@
+# 圖表服務的測試：繪圖逾時時回傳 None，繪圖行程晚一點寫出的暫存檔也要清掉 (不連網、不開子行程)
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import chart_service
+from chart_store import ChartStore
+from quote_cache import TTLCache
+
+
+@pytest.fixture
+def slow_renderer(tmp_path, monkeypatch):
+    """用執行緒池代替繪圖行程池，繪圖要等 release 才寫出檔案。"""
+    release = threading.Event()
+    finished = threading.Event()
+
+    def render_png(symbol, period, dates, closes, filepath):
+        release.wait(5)
+        with open(filepath, 'wb') as f:
+            f.write(b'png')
+        finished.set()
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    dates = np.array(['2024-01-02', '2024-01-03'], dtype='datetime64[D]')
+    monkeypatch.setattr(chart_service, 'CHART_RENDER_PROCESSES', 1)
+    monkeypatch.setattr(chart_service, 'CHART_RENDER_TIMEOUT', 0.2)
+    monkeypatch.setattr(chart_service, '_get_render_pool', lambda: pool)
+    monkeypatch.setattr(chart_service, '_render_png', render_png)
+    monkeypatch.setattr(chart_service, '_fetch_history', lambda symbol, period: (dates, np.array([1.0, 2.0])))
+    monkeypatch.setattr(chart_service, 'chart_store', ChartStore(str(tmp_path), sweep_interval=3600))
+    monkeypatch.setattr(chart_service, 'chart_cache', TTLCache(ttl=60, maxsize=10))
+    yield release, finished
+    release.set()
+    pool.shutdown(wait=True)
+
+
+def test_render_timeout_returns_none_and_removes_the_late_file(tmp_path, slow_renderer):
+    release, finished = slow_renderer
+    started = time.monotonic()
+    assert chart_service.render_chart('AAPL') is None
+    assert time.monotonic() - started < 2
+
+    # 繪圖在逾時之後才寫出檔案，寫完就要被刪掉，不能留在圖表目錄
+    release.set()
+    assert finished.wait(5)
+    deadline = time.monotonic() + 2
+    while os.listdir(tmp_path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert os.listdir(tmp_path) == []
+    # 逾時不會被快取，下一次請求會重新繪圖
+    assert chart_service.chart_cache.get(('AAPL', '1mo', chart_service.trading_day())) is None
+
+
+def test_render_stores_the_chart_by_content(slow_renderer):
+    release, _ = slow_renderer
+    release.set()
+    filename = chart_service.render_chart('AAPL')
+    assert filename and filename.endswith('.png')
+    assert chart_service.chart_store.contains(filename)
@@ -0,0 +1,78 @@
+# 圖表儲存區的測試：內容相同只存一份、從共用後端取回本機、過期與超過容量時的清理
+import os
+import time
+
+from chart_store import ChartStore
+from shared_state import SQLiteBackend
+
+
+def _put(store, data):
+    temp_path = store.new_temp_path()
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    return store.put_file(temp_path)
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = ChartStore(str(tmp_path), sweep_interval=3600)
+    first = _put(store, b'png-a')
+    second = _put(store, b'png-a')
+    other = _put(store, b'png-b')
+    assert first == second != other
+    assert sorted(os.listdir(tmp_path)) == sorted([first, other])
+    stats = store.stats()
+    assert stats['writes'] == 2 and stats['deduplicated'] == 1 and stats['bytes_stored'] == 10
+
+
+def test_ensure_local_fetches_from_the_shared_backend(tmp_path):
+    shared = SQLiteBackend(str(tmp_path / 'state.db'))
+    first = ChartStore(str(tmp_path / 'worker1'), sweep_interval=3600, shared=shared)
+    second = ChartStore(str(tmp_path / 'worker2'), sweep_interval=3600, shared=shared)
+    filename = _put(first, b'png-from-worker1')
+
+    assert not second.contains(filename)
+    assert second.ensure_local(filename)
+    with open(second.path(filename), 'rb') as f:
+        assert f.read() == b'png-from-worker1'
+    assert second.stats()['shared_fetches'] == 1
+    # 已經在本機就不再查共用後端
+    assert second.ensure_local(filename) and second.stats()['shared_fetches'] == 1
+    assert not second.ensure_local('0' * 32 + '.png')
+
+
+def test_ensure_local_without_shared_backend(tmp_path):
+    store = ChartStore(str(tmp_path), sweep_interval=3600)
+    assert not store.ensure_local('missing.png')
+
+
+def test_sweep_evicts_least_recently_read_when_over_budget(tmp_path):
+    store = ChartStore(str(tmp_path), max_bytes=25, sweep_interval=3600)
+    oldest = _put(store, b'a' * 10)
+    middle = _put(store, b'b' * 10)
+    store.touch(oldest)               # oldest 剛被讀過，超過容量時先刪 middle
+    newest = _put(store, b'c' * 10)   # 30 bytes > 25，put_file 會觸發清理
+    assert store.contains(oldest) and store.contains(newest)
+    assert not store.contains(middle) and not os.path.exists(store.path(middle))
+    assert store.stats()['bytes_stored'] == 20 and store.stats()['evictions'] == 1
+
+
+def test_sweep_removes_expired_files_and_stale_temp_files(tmp_path):
+    store = ChartStore(str(tmp_path), max_age=60, sweep_interval=3600)
+    expired = _put(store, b'old')
+    fresh = _put(store, b'new')
+    store._index[expired][1] -= 120   # 建立時間推到 2 分鐘前
+    stale_temp = store.new_temp_path()
+    open(stale_temp, 'wb').close()
+    os.utime(stale_temp, (time.time() - 3600, time.time() - 3600))
+    pending_temp = store.new_temp_path()
+    open(pending_temp, 'wb').close()
+
+    store.sweep()
+    assert not store.contains(expired) and store.contains(fresh)
+    assert not os.path.exists(stale_temp) and os.path.exists(pending_temp)
+
+
+def test_existing_files_are_indexed_on_start(tmp_path):
+    filename = _put(ChartStore(str(tmp_path), sweep_interval=3600), b'persisted')
+    reopened = ChartStore(str(tmp_path), sweep_interval=3600)
+    assert reopened.contains(filename) and reopened.stats()['bytes_stored'] == len(b'persisted')
@@ -0,0 +1,12 @@
+# 冷啟動預算：import main 的中位數不能超過 COLD_START_BUDGET，也不能載入重量級套件
+import statistics
+
+import coldstart
+
+
+def test_cold_start_within_budget():
+    results = coldstart.measure(3)
+    heavy = sorted({name for result in results for name in result['heavy']})
+    assert heavy == [], f"啟動時載入了重量級套件：{', '.join(heavy)}"
+    median = statistics.median(result['seconds'] for result in results)
+    assert median <= coldstart.COLD_START_BUDGET, f"冷啟動 {median:.2f} 秒超過預算 {coldstart.COLD_START_BUDGET} 秒"
@@ -0,0 +1,69 @@
+# 指令路由表與價格提醒解析的測試
+import pytest
+
+from commands import Route, AlertSpec, route_message, parse_alert
+
+ROUTING_EXAMPLES = [
+    ('使用說明', Route('help', None)),
+    ('help', Route('help', None)),
+    ('HELP', Route('help', None)),
+    ('查詢股價', Route('help', None)),
+    ('stock', Route('help', None)),
+    ('query', Route('help', None)),
+    ('我的最愛', Route('favorites', None)),
+    ('favorite', Route('favorites', None)),
+    ('favorites', Route('favorites', None)),
+    ('熱門股', Route('hot', None)),
+    ('hot', Route('hot', None)),
+    ('hot  stocks', Route('hot', None)),
+    ('熱門成交量', Route('volume', None)),
+    ('volume', Route('volume', None)),
+    ('漲幅排名', Route('gainers', None)),
+    ('gainers', Route('gainers', None)),
+    ('NVDA profile', Route('profile', 'NVDA')),
+    ('nvda Profile', Route('profile', 'nvda')),
+    ('TSLA news', Route('news', 'TSLA')),
+    ('蘋果 news', Route('news', '蘋果')),
+    ('AAPL chart', Route('chart', 'AAPL')),
+    ('Bank of America chart', Route('chart', 'Bank of America')),
+    ('add MSFT', Route('add', 'MSFT')),
+    ('ADD msft', Route('add', 'msft')),
+    ('NVDA', Route('quote', 'NVDA')),
+    ('輝達', Route('quote', '輝達')),
+    ('News Corp', Route('quote', 'News Corp')),
+    ('newsmax', Route('quote', 'newsmax')),
+    ('addus', Route('quote', 'addus')),
+    ('chart', Route('quote', 'chart')),
+    ('  AAPL  ', Route('quote', 'AAPL')),
+    ('我的提醒', Route('alerts', None)),
+    ('alerts', Route('alerts', None)),
+    ('alert NVDA > 150', Route('alert', 'NVDA > 150')),
+    ('提醒 蘋果 5%', Route('alert', '蘋果 5%')),
+    ('unalert NVDA', Route('unalert', 'NVDA')),
+    ('取消提醒 NVDA', Route('unalert', 'NVDA')),
+    ('alert', Route('quote', 'alert')),
+]
+
+ALERT_EXAMPLES = [
+    ('NVDA > 150', AlertSpec('NVDA', 'above', 150.0)),
+    ('NVDA>150.5', AlertSpec('NVDA', 'above', 150.5)),
+    ('NVDA >= $150', AlertSpec('NVDA', 'above', 150.0)),
+    ('TSLA < 120', AlertSpec('TSLA', 'below', 120.0)),
+    ('TSLA ＜ 120', AlertSpec('TSLA', 'below', 120.0)),
+    ('蘋果 5%', AlertSpec('蘋果', 'move', 5.0)),
+    ('Bank of America 2.5 %', AlertSpec('Bank of America', 'move', 2.5)),
+    ('NVDA', None),
+    ('NVDA > 0', None),
+    ('> 150', None),
+    ('', None),
+]
+
+
+@pytest.mark.parametrize('text, expected', ROUTING_EXAMPLES)
+def test_route_message(text, expected):
+    assert route_message(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', ALERT_EXAMPLES)
+def test_parse_alert(text, expected):
+    assert parse_alert(text) == expected
@@ -0,0 +1,77 @@
+# 資料存取層的測試：SQLite 實際跑一遍；PostgreSQL 只檢查預備陳述式的時機 (不需要資料庫伺服器)
+import pytest
+
+from favorites_repo import FavoritesRepository, _PostgresDialect
+
+
+@pytest.fixture
+def repository(tmp_path):
+    repository = FavoritesRepository(f"sqlite:///{tmp_path / 'favorites.db'}")
+    repository.init_schema()
+    return repository
+
+
+def test_favorites_and_alerts(repository):
+    assert repository.add('U1', 'AAPL') and not repository.add('U1', 'AAPL')
+    assert repository.list('U1') == ['AAPL']
+    assert repository.add_alert('U1', 'AAPL', 'above', 200.0)
+    assert not repository.add_alert('U1', 'AAPL', 'above', 200.0)
+    assert repository.list_alerts('U1') == [('AAPL', 'above', 200.0)]
+    assert repository.remove_alerts('U1', 'AAPL') == 1
+
+
+def test_claim_only_returns_alerts_it_changed(repository):
+    for threshold in (1.0, 2.0, 3.0):
+        repository.add_alert('U1', 'AAPL', 'above', threshold)
+    ids = [row[0] for row in repository.all_alerts()]
+    assert repository.claim_alerts(ids[:2]) == ids[:2]
+    assert repository.claim_alerts(ids) == ids[2:]
+    assert repository.claim_alerts(ids) == []
+    assert repository.rearm_alerts([ids[0]]) == [ids[0]]
+    assert repository.claim_alerts(ids) == [ids[0]]
+
+
+class _Connection:
+    def __init__(self):
+        self.prepared = set()
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class _Cursor:
+    def __init__(self, connection, fail_once=None):
+        self.connection = connection
+        self.sql = []
+        self.fail_once = fail_once   # 第一次執行這個開頭的 SQL 時丟出的例外 (開頭, 例外)
+
+    def execute(self, sql, params=()):
+        if self.fail_once and sql.startswith(self.fail_once[0]):
+            error, self.fail_once = self.fail_once[1], None
+            raise error
+        self.sql.append(sql)
+
+
+@pytest.fixture
+def postgres():
+    pytest.importorskip('psycopg2')
+    return _PostgresDialect('postgres://unused')
+
+
+def test_postgres_prepares_on_first_use(postgres):
+    connection = _Connection()
+    cursor = _Cursor(connection)
+    postgres.execute(cursor, 'fav_select', ('U1',))
+    postgres.execute(cursor, 'fav_select', ('U2',))
+    assert [sql.split()[0] for sql in cursor.sql] == ['PREPARE', 'EXECUTE', 'EXECUTE']
+    assert connection.prepared == {'fav_select'}
+
+
+def test_postgres_reprepares_missing_statement(postgres):
+    connection = _Connection()
+    connection.prepared.add('fav_select')
+    cursor = _Cursor(connection, fail_once=('EXECUTE', postgres._statement_missing()))
+    postgres.execute(cursor, 'fav_select', ('U1',))
+    assert [sql.split()[0] for sql in cursor.sql] == ['PREPARE', 'EXECUTE']
+    assert connection.rollbacks == 1
@@ -0,0 +1,76 @@
+# Finnhub 客戶端的測試：Retry-After 太長時直接失敗，不卡住請求
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from finnhub_client import FINNHUB_MAX_BACKOFF, FinnhubClient, FinnhubError, RateLimitError, TokenBucket
+
+
+@pytest.fixture
+def server():
+    """依序回應 responses 裡的 (狀態碼, Retry-After)，用完之後回 200。"""
+    responses = []
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            status, retry_after = responses.pop(0) if responses else (200, None)
+            self.send_response(status)
+            if retry_after is not None:
+                self.send_header('Retry-After', retry_after)
+            self.end_headers()
+            self.wfile.write(json.dumps({'c': 1.0}).encode())
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}", responses, requests_seen
+    httpd.shutdown()
+
+
+def test_long_retry_after_fails_fast(server):
+    url, responses, seen = server
+    responses.append((429, str(int(FINNHUB_MAX_BACKOFF) + 60)))
+    client = FinnhubClient(api_key='test', base_url=url, rate_per_minute=6000, burst=10)
+    start = time.monotonic()
+    with pytest.raises(FinnhubError):
+        client.get('/quote', {'symbol': 'AAPL'})
+    assert time.monotonic() - start < 1
+    assert len(seen) == 1 and client.stats()['retries'] == 0
+
+
+def test_short_retry_after_is_honoured(server):
+    url, responses, seen = server
+    responses.append((429, '0'))
+    client = FinnhubClient(api_key='test', base_url=url, rate_per_minute=6000, burst=10)
+    assert client.get('/quote', {'symbol': 'AAPL'}) == {'c': 1.0}
+    assert len(seen) == 2 and client.stats()['retries'] == 1
+
+
+def test_rate_limit_wait_respects_the_caller_deadline(server):
+    # 額度用完時只等到呼叫端的期限，不會等滿 FINNHUB_RATE_LIMIT_WAIT
+    url, responses, seen = server
+    client = FinnhubClient(api_key='test', base_url=url, rate_per_minute=1, burst=1, background_share=0)
+    assert client.get('/quote', {'symbol': 'AAPL'}) == {'c': 1.0}
+    start = time.monotonic()
+    with pytest.raises(RateLimitError):
+        client.get('/quote', {'symbol': 'MSFT'}, deadline=time.monotonic() + 0.2)
+    assert time.monotonic() - start < 0.5
+    assert len(seen) == 1 and client.stats()['throttled'] == 1
+
+
+def test_backoff_never_exceeds_cap():
+    client = FinnhubClient(api_key='test', base_url='http://unused')
+    assert all(client._backoff(attempt) <= FINNHUB_MAX_BACKOFF for attempt in range(10) for _ in range(20))
+
+
+def test_token_bucket_times_out():
+    bucket = TokenBucket(rate=1, capacity=1)
+    assert bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0.1)
@@ -0,0 +1,86 @@
+# 基本面預熱的測試：只在收盤後、只有一個行程、用背景額度，額度不足時下次接著抓
+import datetime
+
+import pytest
+
+import fundamentals_store
+from finnhub_client import FinnhubError
+from fundamentals_store import FundamentalsStore, metrics_date
+from shared_state import open_backend
+
+
+class _Fetch:
+    def __init__(self, limit=None):
+        self.calls = []
+        self.limit = limit
+
+    def __call__(self, symbol, background=False):
+        if self.limit is not None and len(self.calls) >= self.limit:
+            raise FinnhubError('throttled')
+        self.calls.append((symbol, background))
+        return {'metric': {'peTTM': 10}}
+
+
+@pytest.fixture
+def after_close(monkeypatch):
+    now = datetime.datetime(2026, 3, 2, fundamentals_store.FUNDAMENTALS_REFRESH_HOUR + 1)
+    monkeypatch.setattr(fundamentals_store, '_eastern_now', lambda: now)
+    return now
+
+
+def test_warm_uses_background_budget_and_resumes(tmp_path, after_close):
+    fetch = _Fetch(limit=2)
+    store = FundamentalsStore(str(tmp_path / 'f.db'), fetch=fetch)
+    assert store.warm(['aapl', 'msft', 'nvda']) == (2, 1)
+    assert all(background for _, background in fetch.calls)
+    fetch.limit = None
+    assert store.warm(['aapl', 'msft', 'nvda']) == (1, 0)
+    assert [symbol for symbol, _ in fetch.calls] == ['AAPL', 'MSFT', 'NVDA']
+
+
+def test_no_warm_before_close(tmp_path, monkeypatch):
+    monkeypatch.setattr(fundamentals_store, '_eastern_now', lambda: datetime.datetime(2026, 3, 2, 9))
+    fetch = _Fetch()
+    store = FundamentalsStore(str(tmp_path / 'f.db'), fetch=fetch)
+    assert not store.refresh_once(lambda: ['AAPL'])
+    assert fetch.calls == []
+
+
+def test_only_one_worker_warms(tmp_path, after_close):
+    shared = open_backend(f"sqlite:///{tmp_path / 'shared.db'}")
+    fetches = [_Fetch(), _Fetch()]
+    stores = [FundamentalsStore(str(tmp_path / 'f.db'), fetch=fetch) for fetch in fetches]
+    results = [store.refresh_once(lambda: ['AAPL', 'MSFT'], shared) for store in stores]
+    assert results == [True, False]
+    assert len(fetches[0].calls) == 2 and fetches[1].calls == []
+
+
+@pytest.mark.parametrize('now, expected', [
+    (datetime.datetime(2026, 3, 2, 9), '2026-02-27'),    # 週一開盤前 -> 上週五
+    (datetime.datetime(2026, 3, 2, 18), '2026-03-02'),   # 週一收盤後 -> 當天
+    (datetime.datetime(2026, 3, 7, 18), '2026-03-06'),   # 週六 -> 週五
+    (datetime.datetime(2026, 3, 8, 12), '2026-03-06'),   # 週日 -> 週五
+    (datetime.datetime(2026, 4, 3, 18), '2026-04-02'),   # 耶穌受難日休市 -> 前一天
+    (datetime.datetime(2026, 11, 27, 9), '2026-11-25'),  # 感恩節隔天開盤前 -> 感恩節前一天
+    (datetime.datetime(2027, 1, 1, 18), '2026-12-31'),   # 元旦
+])
+def test_metrics_date_is_the_last_completed_session(now, expected):
+    assert metrics_date(now) == expected
+
+
+def test_weekend_reads_reuse_fridays_metrics(tmp_path, monkeypatch):
+    fetch = _Fetch()
+    store = FundamentalsStore(str(tmp_path / 'f.db'), fetch=fetch)
+    for now in (datetime.datetime(2026, 3, 6, 18), datetime.datetime(2026, 3, 7, 10), datetime.datetime(2026, 3, 9, 9)):
+        monkeypatch.setattr(fundamentals_store, '_eastern_now', lambda now=now: now)
+        assert store.get('aapl') == {'metric': {'peTTM': 10}}
+    assert len(fetch.calls) == 1 and store.stats() == {'hits': 2, 'misses': 1}
+
+
+def test_empty_payloads_are_not_stored(tmp_path, after_close):
+    payloads = [{'metric': {}, 'symbol': 'NEWCO'}, {'metric': {'peTTM': 12}, 'symbol': 'NEWCO'}]
+    store = FundamentalsStore(str(tmp_path / 'f.db'), fetch=lambda symbol, background=False: payloads.pop(0))
+    assert store.get('newco') == {'metric': {}, 'symbol': 'NEWCO'}
+    # 上一次查不到沒有被存起來，同一個交易日再查會重新抓
+    assert store.get('newco') == {'metric': {'peTTM': 12}, 'symbol': 'NEWCO'}
+    assert store.get('newco') == {'metric': {'peTTM': 12}, 'symbol': 'NEWCO'} and payloads == []
@@ -0,0 +1,101 @@
+# 日線儲存區的測試：增量更新、預先算好的指標與 memmap 切片 (不連網，用假的日線資料)
+import os
+
+import numpy as np
+import pytest
+
+from history_store import HistoryStore, _eastern_today, compute_indicators, window_start
+from tests.fixtures import synthetic_download
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path), fetch=synthetic_download(), refresh_interval=0)
+
+
+def test_incremental_refresh(store):
+    full = store.fetch
+    dates, prices = full('TEST')
+    # 先存一段較短的歷史，再用增量更新補上其餘的 K 棒
+    store.fetch = lambda symbol, start=None: (dates[:-60], {c: v[:-60] for c, v in prices.items()})
+    first = store.refresh('TEST')
+    store.fetch = full
+    second = store.refresh('TEST')
+    assert first + second == int((dates < _eastern_today()).sum())
+    assert store.refresh('TEST') == 0
+
+
+def test_indicators_and_windows(store):
+    dates, prices = store.fetch('TEST')
+    window = store.window('TEST', '1y', refresh=True)
+    expected = {'ma20': np.convolve(prices['close'], np.ones(20) / 20, 'valid'),
+                'daily_return': prices['close'][1:] / prices['close'][:-1] - 1}
+    rows, arrays = store.columns('TEST')
+    assert np.allclose(arrays['ma20'][19:], expected['ma20'][:rows - 19])
+    assert np.allclose(arrays['daily_return'][1:], expected['daily_return'][:rows - 1])
+    assert np.isnan(arrays['ma50'][:49]).all() and not np.isnan(arrays['ma50'][49:]).any()
+    assert np.shares_memory(window.close, arrays['close']), "區間應該是 memmap 的切片"
+    assert window.date[0] >= window_start(_eastern_today(), '1y')
+    if window.live is not None:
+        assert np.isclose(window.live.ma20, expected['ma20'][-1])
+    series_dates, closes = window.series()
+    assert len(series_dates) == len(closes) == len(window.date) + (window.live is not None)
+    assert len(store.window('TEST', '3mo', refresh=False).date) < len(window.date)
+
+
+def test_split_rebuilds_the_symbol(store):
+    full = store.fetch
+    dates, prices = full('TEST')
+    store.fetch = lambda symbol, start=None: (dates[:-60], {c: v[:-60] for c, v in prices.items()})
+    store.refresh('TEST')
+    _, old = store.columns('TEST')
+    old_close = np.array(old['close'])
+
+    # 2:1 分割後 Yahoo 把過去的價格全部減半 (成交量加倍)，重疊的那一根對不上，要整檔重建
+    def split(symbol, start=None):
+        split_dates, split_prices = full(symbol, start)
+        return split_dates, {c: v * 2 if c == 'volume' else v / 2 for c, v in split_prices.items()}
+
+    store.fetch = split
+    store.refresh('TEST')
+    rows, arrays = store.columns('TEST')
+    assert store.stats()['rebuilds'] == 1
+    assert rows == int((dates < _eastern_today()).sum())
+    assert np.allclose(arrays['close'], prices['close'][:rows] / 2)
+    assert np.allclose(arrays['ma20'][19:], np.convolve(arrays['close'], np.ones(20) / 20, 'valid'))
+    # 舊的對應在檔案被刪掉之後仍然可以讀
+    assert np.array_equal(old['close'], old_close)
+    assert store.refresh('TEST') == 0 and store.stats()['rebuilds'] == 1
+
+
+def test_legacy_directory_is_replaced(store, tmp_path):
+    dates, prices = store.fetch('TEST')
+    legacy = tmp_path / 'TEST'
+    legacy.mkdir()
+    values = {'date': dates[:-5], **{c: v[:-5] for c, v in prices.items()}}
+    values.update(compute_indicators(values['close'], np.empty(0)))
+    store._write_columns(str(legacy), 0, values)
+    assert store.columns('TEST')[0] == len(dates) - 5
+
+    store.fetch = lambda symbol, start=None: (dates, {c: v * 3 for c, v in prices.items()})
+    store.refresh('TEST')
+    assert legacy.is_symlink()
+    assert np.allclose(store.columns('TEST')[1]['close'], prices['close'][:store.columns('TEST')[0]] * 3)
+
+
+def _open_fds():
+    return len(os.listdir('/proc/self/fd'))
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='需要 /proc 才能計算檔案描述子')
+def test_open_memmaps_are_bounded(tmp_path):
+    store = HistoryStore(str(tmp_path), fetch=synthetic_download(days=120), refresh_interval=3600, max_open=4)
+    for k in range(4):
+        store.window(f"S{k:03d}", '1mo').series()
+    baseline = _open_fds()
+    for k in range(4, 60):
+        store.window(f"S{k:03d}", '1mo').series()
+    assert _open_fds() <= baseline
+    assert store.stats()['symbols'] == 4 and store.stats()['evictions'] == 56
+    # 被擠掉的股票再查一次會重新對應，資料一樣
+    assert len(store.window('S000', '1mo', refresh=False).date) > 0
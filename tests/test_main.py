@@ -0,0 +1,74 @@
+# webhook 與 /metrics 的測試 (不連 LINE、不連資料庫)
+import os
+
+import pytest
+
+os.environ.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'test')
+os.environ.setdefault('LINE_CHANNEL_SECRET', 'test')
+os.environ['DB_SCHEMA_INIT'] = 'skip'
+os.environ['FUNDAMENTALS_PREFETCH'] = '0'
+os.environ['ALERTS_ENABLED'] = '0'
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+def test_metrics_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(main, 'METRICS_TOKEN', None)
+    assert client.get('/metrics').status_code == 404
+
+
+def test_metrics_requires_token(client, monkeypatch):
+    monkeypatch.setattr(main, 'METRICS_TOKEN', 'secret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200 and response.get_json()['pid'] == os.getpid()
+
+
+def test_news_reply_defaults_to_one_article(monkeypatch):
+    articles = [{'headline': f'Headline {k}', 'summary': 'Summary', 'url': f'https://example.com/{k}'}
+                for k in range(3)]
+    monkeypatch.setattr(main, 'FINNHUB_API_KEY', 'test')
+    monkeypatch.setattr(main.finnhub, 'get', lambda *args, **kwargs: articles)
+    monkeypatch.setattr(main, 'summarize_news_batch', lambda batch: [f"摘要 {headline}" for headline, _, _ in batch])
+    assert main.get_company_news('aapl') == ("📰 AAPL 的 AI 智慧新聞摘要：\n\n摘要 Headline 0\n\n"
+                                             "🔗 原文連結：\nhttps://example.com/0")
+
+
+def test_alert_rejects_unknown_ticker(monkeypatch):
+    added = []
+
+    class FakeRepository:
+        def list_alerts(self, user_id):
+            return []
+
+        def add_alert(self, *args):
+            added.append(args)
+            return True
+
+    def missing_quote(symbol):
+        raise main.QuoteNotFoundError(symbol)
+
+    monkeypatch.setattr(main, 'get_repository', lambda: FakeRepository())
+    monkeypatch.setattr(main, 'get_quote', missing_quote)
+    assert main.add_price_alert('U1', 'ZZZZQ', 'above', 10.0) == "找不到 ZZZZQ 的報價，無法設定提醒，請確認股票代碼。"
+    assert added == []
+
+
+def test_favorites_reply_lists_symbols_skipped_by_the_rate_limit(monkeypatch):
+    def fake_quotes(symbols):
+        return {symbol: main.Quote(symbol, 100.0, 1.0, 1.0, 101.0, 99.0) if k < 2 else main.RateLimitError(symbol)
+                for k, symbol in enumerate(symbols)}
+
+    monkeypatch.setattr(main, 'FINNHUB_API_KEY', 'test')
+    monkeypatch.setattr(main, 'get_quotes', fake_quotes)
+    monkeypatch.setattr(main, 'get_favorites', lambda user_id: ['AAPL', 'MSFT', 'NVDA', 'TSLA'])
+    event = type('Event', (), {'source': type('Source', (), {'user_id': 'U1'})()})()
+    text = main.reply_favorites(event, None).text
+    assert 'AAPL' in text and 'MSFT' in text
+    assert "另外 2 檔暫時略過：NVDA, TSLA" in text
@@ -0,0 +1,111 @@
+# 市場排行快照的測試：資料過舊時先回舊資料再背景更新、抓取失敗保留舊資料、共用後端的租約交接 (不連網)
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from market_movers import MoversSnapshot
+from shared_state import SQLiteBackend
+
+
+class FakeYahoo:
+    """依序回傳 DataFrame；fail=True 時丟出例外，gate 設定時要等它放行才回傳。"""
+
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+        self.gate = None
+
+    def __call__(self):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.fail:
+            raise ConnectionError('yahoo down')
+        return pd.DataFrame({'Symbol': [f'S{self.calls}'], 'Price': [float(self.calls)]})
+
+
+def _snapshot(fetcher, shared=None, interval=60):
+    snapshot = MoversSnapshot({'gainers': fetcher}, interval=interval, shared=shared)
+    snapshot._refresher = threading.current_thread()  # 不啟動背景更新執行緒，由測試自己呼叫
+    return snapshot
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_first_read_fetches_once_for_concurrent_callers():
+    yahoo = FakeYahoo()
+    yahoo.gate = threading.Event()
+    snapshot = _snapshot(yahoo)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(snapshot.get, 'gainers') for _ in range(4)]
+        assert _wait_for(lambda: yahoo.calls == 1)
+        yahoo.gate.set()
+        results = [future.result(timeout=5) for future in futures]
+    assert yahoo.calls == 1
+    assert all(df['Symbol'].tolist() == ['S1'] for df, _ in results)
+
+
+def test_stale_snapshot_is_served_while_refreshing_in_background():
+    yahoo = FakeYahoo()
+    snapshot = _snapshot(yahoo)
+    assert snapshot.refresh('gainers')
+    df, fetched_at = snapshot._data['gainers']
+    snapshot._data['gainers'] = (df, fetched_at - 600)   # 落後超過兩個週期
+
+    yahoo.gate = threading.Event()
+    stale, stale_at = snapshot.get('gainers')
+    # 不等 Yahoo，立刻回傳舊資料
+    assert stale['Symbol'].tolist() == ['S1'] and stale_at == fetched_at - 600
+    yahoo.gate.set()
+    assert _wait_for(lambda: snapshot.stats()['refreshes'] == 2)
+    fresh, fresh_at = snapshot.get('gainers')
+    assert fresh['Symbol'].tolist() == ['S2'] and fresh_at > stale_at
+
+
+def test_failed_refresh_keeps_the_previous_snapshot():
+    yahoo = FakeYahoo()
+    snapshot = _snapshot(yahoo)
+    assert snapshot.refresh('gainers')
+    yahoo.fail = True
+    assert not snapshot.refresh('gainers')
+    df, _ = snapshot.get('gainers')
+    assert df['Symbol'].tolist() == ['S1'] and snapshot.stats()['failures'] == 1
+
+
+def test_no_data_at_all_returns_none():
+    yahoo = FakeYahoo()
+    yahoo.fail = True
+    assert _snapshot(yahoo).get('gainers') == (None, None)
+
+
+def test_lease_holder_fetches_and_other_workers_pull_its_snapshot(tmp_path):
+    shared = SQLiteBackend(str(tmp_path / 'state.db'))
+    leader_yahoo, follower_yahoo = FakeYahoo(), FakeYahoo()
+    leader = _snapshot(leader_yahoo, shared=shared)
+    follower = _snapshot(follower_yahoo, shared=shared)
+
+    leader.refresh_all()
+    follower.refresh_all()
+    # 這一輪的租約在 leader 手上，follower 不去抓 Yahoo，直接用 leader 存進共用後端的快照
+    assert leader_yahoo.calls == 1 and follower_yahoo.calls == 0
+    df, fetched_at = follower.get('gainers')
+    assert df['Symbol'].tolist() == ['S1'] and fetched_at == leader._data['gainers'][1]
+    assert follower.stats()['shared_pulls'] == 1 and follower_yahoo.calls == 0
+
+    # 本機的資料比共用後端新時不會被舊快照蓋掉
+    assert follower.refresh('gainers')
+    own_fetched_at = follower._data['gainers'][1]
+    assert not follower.pull_shared('gainers')
+    assert follower.get('gainers')[1] == own_fetched_at > fetched_at
+
+    # 租約過期後由下一個搶到的 worker 接手
+    shared.delete('movers:lease:gainers')
+    follower.refresh_all()
+    assert follower_yahoo.calls == 2
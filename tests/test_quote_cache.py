@@ -0,0 +1,108 @@
+# 報價快取的測試：single-flight 合併、TTL 到期、LRU 容量上限與共用後端 (第二層)
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from quote_cache import TTLCache
+from shared_state import SQLiteBackend
+
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache(ttl=60, maxsize=10)
+    calls = []
+    release = threading.Event()
+
+    def loader(key):
+        calls.append(key)
+        release.wait(5)
+        return f"{key}-value"
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(cache.get_or_load, 'AAPL', loader) for _ in range(8)]
+        # 等其他執行緒都排在同一個查詢後面再放行
+        deadline = time.monotonic() + 5
+        while cache.stats()['coalesced'] < 7 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        results = [future.result(timeout=5) for future in futures]
+    assert results == ['AAPL-value'] * 8
+    assert calls == ['AAPL']
+    assert cache.stats()['misses'] == 1 and cache.stats()['coalesced'] == 7
+
+
+def test_load_errors_reach_every_waiter_and_are_not_cached():
+    cache = TTLCache(ttl=60, maxsize=10)
+    release = threading.Event()
+
+    def failing(key):
+        release.wait(5)
+        raise ConnectionError(key)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(cache.get_or_load, 'AAPL', failing) for _ in range(4)]
+        deadline = time.monotonic() + 5
+        while cache.stats()['coalesced'] < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for future in futures:
+            with pytest.raises(ConnectionError):
+                future.result(timeout=5)
+    assert cache.get('AAPL') is None
+    assert cache.get_or_load('AAPL', lambda key: 'ok') == 'ok'
+
+
+def test_entries_expire_after_ttl():
+    cache = TTLCache(ttl=0.05, maxsize=10)
+    loads = []
+    assert cache.get_or_load('AAPL', lambda key: loads.append(key) or 1) == 1
+    assert cache.get_or_load('AAPL', lambda key: loads.append(key) or 2) == 1
+    time.sleep(0.1)
+    assert cache.get('AAPL') is None
+    assert cache.get_or_load('AAPL', lambda key: loads.append(key) or 3) == 3
+    assert loads == ['AAPL', 'AAPL']
+
+
+def test_least_recently_used_entry_is_evicted_at_maxsize():
+    cache = TTLCache(ttl=60, maxsize=3)
+    for key in ('A', 'B', 'C'):
+        cache.set(key, key.lower())
+    assert cache.get('A') == 'a'   # A 變成最近使用，下一個被擠掉的是 B
+    cache.set('D', 'd')
+    assert cache.get('B') is None
+    assert [cache.get(key) for key in ('A', 'C', 'D')] == ['a', 'c', 'd']
+    assert cache.stats()['size'] == 3 and cache.stats()['evictions'] == 1
+
+
+def test_local_miss_falls_through_to_shared_backend(tmp_path):
+    shared = SQLiteBackend(str(tmp_path / 'state.db'))
+    first = TTLCache(ttl=60, maxsize=10, shared=shared, namespace='quote')
+    second = TTLCache(ttl=60, maxsize=10, shared=shared, namespace='quote')
+    assert first.get_or_load('AAPL', lambda key: 101.5) == 101.5
+
+    # 另一個 worker 本機沒有，從共用後端取得，不再呼叫上游
+    def unexpected(key):
+        raise AssertionError('不應該呼叫上游')
+
+    assert second.get_or_load('AAPL', unexpected) == 101.5
+    assert second.stats()['shared_hits'] == 1 and second.get('AAPL') == 101.5
+
+    # 不同 namespace 的快取不會互相讀到
+    other = TTLCache(ttl=60, maxsize=10, shared=shared, namespace='profile')
+    assert other.get_or_load('AAPL', lambda key: 'profile') == 'profile'
+
+    # 作廢時兩層一起刪掉
+    second.invalidate('AAPL')
+    assert TTLCache(ttl=60, maxsize=10, shared=shared, namespace='quote').get_or_load('AAPL', lambda key: 99.0) == 99.0
+
+
+def test_shared_entries_keep_their_original_expiry(tmp_path):
+    shared = SQLiteBackend(str(tmp_path / 'state.db'))
+    TTLCache(ttl=0.2, maxsize=10, shared=shared, namespace='quote').get_or_load('AAPL', lambda key: 1)
+    time.sleep(0.1)
+    second = TTLCache(ttl=0.2, maxsize=10, shared=shared, namespace='quote')
+    assert second.get_or_load('AAPL', lambda key: 2) == 1
+    # 本機只保留到共用資料原本的到期時間，不會再多放一整個 TTL
+    time.sleep(0.15)
+    assert second.get('AAPL') is None
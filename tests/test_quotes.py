@@ -0,0 +1,69 @@
+# 批次報價的測試：整批逾時時回傳已完成的部分、單檔失敗不影響其他代碼、結果順序與傳入順序相同 (不連網)
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import quotes
+from quote_cache import TTLCache
+from quotes import Quote, QuoteNotFoundError, get_quotes
+
+
+@pytest.fixture
+def fake_fetch(monkeypatch):
+    """把 Finnhub 換成假的查詢：slow 裡的代碼要等 release 才回傳，failing 裡的代碼丟出例外，MISSING 查無資料。"""
+    state = {'slow': set(), 'failing': set(), 'release': threading.Event(), 'calls': []}
+
+    def fetch(symbol, background=False, deadline=None):
+        state['calls'].append((symbol, background))
+        if symbol in state['slow']:
+            state['release'].wait(5)
+        if symbol in state['failing']:
+            raise ConnectionError(symbol)
+        if symbol == 'MISSING':
+            return None
+        return Quote(symbol, 100.0, 1.0, 1.0, 101.0, 99.0)
+
+    monkeypatch.setattr(quotes, 'quote_cache', TTLCache(ttl=60, maxsize=100))
+    monkeypatch.setattr(quotes, '_fetch_quote', fetch)
+    yield state
+    state['release'].set()
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+
+def test_results_follow_input_order_without_duplicates(fake_fetch, executor):
+    results = get_quotes(['MSFT', 'aapl', 'NVDA', 'MSFT'], executor=executor)
+    assert list(results) == ['MSFT', 'aapl', 'NVDA']
+    assert results['aapl'].symbol == 'AAPL'
+    assert all(isinstance(quote, Quote) for quote in results.values())
+
+
+def test_per_symbol_failures_do_not_affect_others(fake_fetch, executor):
+    fake_fetch['failing'].add('BAD')
+    results = get_quotes(['AAPL', 'BAD', 'MISSING', 'NVDA'], executor=executor)
+    assert list(results) == ['AAPL', 'BAD', 'MISSING', 'NVDA']
+    assert isinstance(results['BAD'], ConnectionError)
+    assert isinstance(results['MISSING'], QuoteNotFoundError)
+    assert isinstance(results['AAPL'], Quote) and isinstance(results['NVDA'], Quote)
+
+
+def test_deadline_returns_partial_results(fake_fetch, executor):
+    fake_fetch['slow'].add('SLOW')
+    started = time.monotonic()
+    results = get_quotes(['AAPL', 'SLOW', 'NVDA'], deadline=0.2, executor=executor)
+    assert time.monotonic() - started < 2
+    assert list(results) == ['AAPL', 'SLOW', 'NVDA']
+    assert isinstance(results['SLOW'], TimeoutError)
+    assert isinstance(results['AAPL'], Quote) and isinstance(results['NVDA'], Quote)
+    fake_fetch['release'].set()
+
+
+def test_background_flag_reaches_the_fetch(fake_fetch, executor):
+    get_quotes(['AAPL'], executor=executor, background=True)
+    assert fake_fetch['calls'] == [('AAPL', True)]
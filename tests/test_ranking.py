@@ -0,0 +1,18 @@
+# 排行計算的測試：新版輸出要和舊版 rank.py 逐字相同
+import pandas as pd
+
+from ranking import SYMBOL, PRICE, CHANGE, VOLUME, rank_movers, render_gainers
+from tests.fixtures import synthetic_movers, legacy_gainers
+
+
+def test_gainers_match_legacy_output():
+    df = synthetic_movers(2000)
+    expected = legacy_gainers(df, 200)
+    assert render_gainers(rank_movers(df, top_n=200, min_price=2, min_volume=500000)) == expected
+
+
+def test_text_columns_are_parsed():
+    df = pd.DataFrame({SYMBOL: ['AAA', 'BBB', 'CCC'], PRICE: ['1,234.5', '3.2', '1.5'],
+                       CHANGE: ['+3.45%', '12%', '50%'], VOLUME: ['1.2M', '900K', '5M']})
+    ranked = rank_movers(df, top_n=10, min_price=2, min_volume=500000)
+    assert list(ranked[SYMBOL]) == ['AAA', 'BBB']
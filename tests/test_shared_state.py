@@ -0,0 +1,54 @@
+# 共用後端的測試：SQLite 與 Redis 協定 (LocalKVServer) 行為要一致
+import time
+
+import pytest
+
+from shared_state import SQLiteBackend, RedisBackend, LocalKVServer, open_backend
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        yield SQLiteBackend(str(tmp_path / 'state.db'))
+        return
+    pytest.importorskip('redis')
+    server = LocalKVServer().start()
+    yield RedisBackend(server.url)
+    server.shutdown()
+
+
+def test_set_get_delete(backend):
+    assert backend.get('missing') is None
+    backend.set('key', b'value', 60)
+    assert backend.get('key') == b'value'
+    backend.delete('key')
+    assert backend.get('key') is None
+
+
+def test_values_expire(backend):
+    backend.set('expiring', b'x', 0.05)
+    time.sleep(0.1)
+    assert backend.get('expiring') is None
+
+
+def test_add_is_a_lease(backend):
+    assert backend.add('lock', b'1', 0.1)
+    assert not backend.add('lock', b'2', 0.1)
+    time.sleep(0.15)
+    assert backend.add('lock', b'3', 0.1)
+
+
+def test_errors_count_as_misses():
+    pytest.importorskip('redis')
+    backend = RedisBackend('redis://127.0.0.1:1/0')
+    assert backend.get('key') is None
+    assert not backend.add('key', b'1', 1)
+    assert backend.stats()['errors'] == 2
+
+
+def test_open_backend():
+    assert open_backend('memory://') is None
+    assert isinstance(open_backend('sqlite:////tmp/x.db'), SQLiteBackend)
+    with pytest.raises(ValueError):
+        open_backend('ftp://nowhere')
+
@@ -0,0 +1,31 @@
+# 代碼解析的測試 (使用 data/us_listings.csv)
+import pytest
+
+from stock_lookup import resolver, looks_like_ticker
+
+
+@pytest.mark.parametrize('query, symbol', [
+    ('nvda', 'NVDA'),
+    ('Apple', 'AAPL'),
+    ('蘋果', 'AAPL'),
+    ('輝達', 'NVDA'),
+    ('Microsoft Corp', 'MSFT'),
+    ('Bank of Amer', 'BAC'),
+])
+def test_resolve(query, symbol):
+    assert resolver.resolve(query).symbol == symbol
+
+
+def test_typo_is_only_suggested():
+    resolution = resolver.resolve('Appel')
+    assert resolution.symbol is None
+    assert 'AAPL' in resolution.alternatives
+
+
+def test_unknown_name():
+    assert resolver.resolve('zzzzqq') == (None, 0.0, [])
+
+
+@pytest.mark.parametrize('text, expected', [('NVDA', True), ('BRK.B', True), ('蘋果', False), ('TOOLONG', False)])
+def test_looks_like_ticker(text, expected):
+    assert looks_like_ticker(text) is expected
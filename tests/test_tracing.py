@@ -0,0 +1,64 @@
+# 請求追蹤的測試
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import tracing
+from tracing import trace, span, bind, set_attribute, current_trace_id, stage_metrics, pseudonym
+
+
+def test_trace_logs_spans_as_json(caplog, monkeypatch):
+    monkeypatch.setattr(tracing, 'TRACE_LOG_SAMPLE_RATE', 1.0)
+    with caplog.at_level(logging.INFO, logger='trace'):
+        with trace('test.event', user='u1'):
+            set_attribute('command', 'quote')
+            with span('test.stage', symbol='NVDA'):
+                pass
+    record = json.loads(caplog.records[-1].getMessage())
+    assert record['name'] == 'test.event'
+    assert record['user'] == 'u1' and record['command'] == 'quote'
+    assert [s['stage'] for s in record['spans']] == ['test.stage']
+    assert record['spans'][0]['symbol'] == 'NVDA'
+
+
+def test_unsampled_traces_are_logged_only_on_error(caplog, monkeypatch):
+    monkeypatch.setattr(tracing, 'TRACE_LOG_SAMPLE_RATE', 0.0)
+    with caplog.at_level(logging.INFO, logger='trace'):
+        with trace('test.quiet'):
+            pass
+        with pytest.raises(ValueError):
+            with trace('test.broken'):
+                raise ValueError('boom')
+    names = [json.loads(record.getMessage())['name'] for record in caplog.records if record.name == 'trace']
+    assert names == ['test.broken']
+
+
+def test_pseudonym_hides_user_id():
+    assert pseudonym('U1234567890abcdef') == pseudonym('U1234567890abcdef')
+    assert pseudonym('U1234567890abcdef') != pseudonym('U2')
+    assert 'U1234567890abcdef' not in pseudonym('U1234567890abcdef') and len(pseudonym('U1')) == 12
+
+
+def test_span_errors_are_counted():
+    before = stage_metrics.snapshot().get('test.failing', {'errors': 0, 'count': 0})
+    with pytest.raises(ValueError):
+        with span('test.failing'):
+            raise ValueError('boom')
+    after = stage_metrics.snapshot()['test.failing']
+    assert after['count'] == before['count'] + 1
+    assert after['errors'] == before['errors'] + 1
+
+
+def _bound_work():
+    with span('test.bound'):
+        return current_trace_id()
+
+
+def test_bind_keeps_trace_in_executor():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(current_trace_id).result() is None
+        with trace('test.bind') as current:
+            assert executor.submit(bind(_bound_work)).result() == current.trace_id
+            assert [raw[0] for raw in current.spans] == ['test.bound']
@@ -0,0 +1,41 @@
+# 背景事件佇列的測試：同一批事件要嘛全部放入、要嘛全部拒絕
+import threading
+import time
+
+from webhook_queue import EventDispatcher
+
+
+def _blocked_dispatcher(queue_size):
+    release = threading.Event()
+    handled = []
+
+    def handle(item):
+        release.wait()
+        handled.append(item)
+
+    dispatcher = EventDispatcher(handle, workers=1, queue_size=queue_size)
+    assert dispatcher.submit('U0', 'busy')
+    # 等工作執行緒拿走第一個事件並卡住，之後佇列剩下 queue_size 個空位
+    deadline = time.monotonic() + 5
+    while dispatcher.stats()['depth'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return dispatcher, release, handled
+
+
+def test_submit_all_is_all_or_nothing():
+    dispatcher, release, handled = _blocked_dispatcher(queue_size=2)
+    assert not dispatcher.submit_all([('U1', 'a'), ('U2', 'b'), ('U3', 'c')])
+    assert dispatcher.stats()['depth'] == 0
+    assert dispatcher.stats()['rejected'] == 3
+    assert dispatcher.submit_all([('U1', 'a'), ('U2', 'b')])
+    release.set()
+    dispatcher.join()
+    assert handled == ['busy', 'a', 'b']
+
+
+def test_same_user_events_keep_their_order():
+    handled = []
+    dispatcher = EventDispatcher(handled.append, workers=4, queue_size=100)
+    assert dispatcher.submit_all([('U1', k) for k in range(50)])
+    dispatcher.join()
+    assert handled == list(range(50))
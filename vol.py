@@ -1,34 +1,29 @@
 # vol.py (新版 - 使用 yahoo_fin)
+import os
 import logging
-from yahoo_fin import stock_info as si
-import pandas as pd
+from market_movers import movers, format_age
+
+VOLUME_TOP_N = int(os.environ.get('VOLUME_TOP_N', 10))
+# 空字串代表沿用 Yahoo 原本的排序
+VOLUME_SORT_BY = os.environ.get('VOLUME_SORT_BY') or None
 
 def get_top_volume_stocks() -> str:
     """
     使用 yahoo_fin 獲取當日成交量最大的股票排名 (免費)。
     """
+    # ranking 會載入 pandas / numpy，等第一次查排行時才引入，不拖慢啟動
+    from ranking import rank_movers, render_volume
     try:
-        most_active_df = si.get_day_most_active()
+        most_active_df, fetched_at = movers.get('most_active')
         
-        if most_active_df.empty:
+        if most_active_df is None or most_active_df.empty:
             return "抱歉，目前無法從 Yahoo Finance 取得熱門成交量資料。"
 
-        top_10_active = most_active_df.head(10)
+        top_active = rank_movers(most_active_df, top_n=VOLUME_TOP_N, sort_by=VOLUME_SORT_BY)
 
         reply_text = "📈 **熱門成交量排名 (via Yahoo)** 📈\n\n"
-        for index, row in top_10_active.iterrows():
-            symbol = row.get('Symbol', 'N/A')
-            price = row.get('Price (Intraday)', 0)
-            change_percent = row.get('% Change', 0)
-            volume = row.get('Volume', 0) / 1000000  # 轉換為百萬股
-
-            emoji = "🔼" if change_percent >= 0 else "🔽"
-
-            reply_text += f"▪️ **{symbol}** {emoji}\n"
-            reply_text += f"   - 價格：${price:.2f}\n"
-            reply_text += f"   - 漲跌：{change_percent:.2f}%\n"
-            reply_text += f"   - 成交量：{volume:.1f} 百萬股\n\n"
-
+        reply_text += render_volume(top_active)
+        reply_text += format_age(fetched_at)
         return reply_text.strip()
 
     except Exception as e:
@@ -0,0 +1,111 @@
+# webhook_queue.py
+# 背景事件佇列：/callback 驗證簽章後把事件丟進這裡就立刻回 200，
+# 真正耗時的 Finnhub / Gemini / yfinance / matplotlib 工作交給背景執行緒處理。
+# 依使用者分片 (shard) 到固定的執行緒，保證同一位使用者的訊息依序處理。
+# 這個保證只在同一個行程內成立：gunicorn 有多個 worker 時，同一位使用者的事件可能落在不同 worker 上同時處理。
+import os
+import queue
+import logging
+import threading
+import time
+import zlib
+
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 100))
+
+
+class EventDispatcher:
+    """
+    固定數量的工作執行緒，每條執行緒有自己的有界佇列。
+    同一個 key (使用者) 永遠進同一條佇列；佇列滿了 submit() 會回傳 False，由呼叫端決定如何回應。
+    submit_all() 一次放入多個事件，要嘛全部放入、要嘛一個都不放，呼叫端回 503 讓對方重送時不會有事件被處理兩次。
+    執行緒在第一次 submit 時才啟動，避免 gunicorn fork 之前就建立執行緒。
+    """
+
+    def __init__(self, handle, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE):
+        self._handle = handle
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+        # 所有放入佇列的動作都在這個鎖裡，檢查完剩餘空間到真正放入之間，空間只會變多
+        self._submit_lock = threading.Lock()
+        self.queue_size = queue_size
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_wait = 0.0
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for index, work_queue in enumerate(self._queues):
+                thread = threading.Thread(target=self._worker, args=(work_queue,),
+                                          name=f'webhook-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _shard(self, key):
+        return self._queues[zlib.crc32(key.encode('utf-8')) % len(self._queues)]
+
+    def submit(self, key, item):
+        return self.submit_all([(key, item)])
+
+    def submit_all(self, items):
+        """items 為 [(key, item)]；所有事件都放得下才放入並回傳 True，否則一個都不放並回傳 False。"""
+        self._ensure_started()
+        shards = [(self._shard(key), item) for key, item in items]
+        needed = {}
+        for work_queue, _ in shards:
+            needed[work_queue] = needed.get(work_queue, 0) + 1
+        with self._submit_lock:
+            if any(work_queue.maxsize - work_queue.qsize() < count for work_queue, count in needed.items()):
+                with self._lock:
+                    self.rejected += len(shards)
+                logging.warning(f"事件佇列已滿 (上限 {self.queue_size})，拒絕這一批 {len(shards)} 個事件")
+                return False
+            now = time.monotonic()
+            for work_queue, item in shards:
+                work_queue.put_nowait((now, item))
+        with self._lock:
+            self.submitted += len(shards)
+        return True
+
+    def _worker(self, work_queue):
+        while True:
+            enqueued_at, item = work_queue.get()
+            waited = time.monotonic() - enqueued_at
+            try:
+                self._handle(item)
+                with self._lock:
+                    self.processed += 1
+                    self.max_wait = max(self.max_wait, waited)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                logging.error(f"背景處理事件時發生錯誤: {e}", exc_info=True)
+            finally:
+                work_queue.task_done()
+
+    def join(self):
+        """等待目前佇列中的事件全部處理完 (測試與壓測用)。"""
+        for work_queue in self._queues:
+            work_queue.join()
+
+    def stats(self):
+        depths = [work_queue.qsize() for work_queue in self._queues]
+        with self._lock:
+            return {
+                'workers': len(self._queues),
+                'queue_size': self.queue_size,
+                'depth': sum(depths),
+                'depth_per_worker': depths,
+                'submitted': self.submitted,
+                'processed': self.processed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'max_wait_seconds': round(self.max_wait, 3),
+            }